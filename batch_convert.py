@@ -0,0 +1,258 @@
+"""Convert a whole folder of MIDIs at once.
+
+Reading MIDIs, converting them and writing charts are overlapped: MIDI bytes and the
+config files are read concurrently on threads, ``midi_to_representation`` and
+``MidiConv.process_midi`` run in a process pool, and charts are written on threads
+while the next songs are still converting. The queues between the stages are
+bounded, so a slow stage makes the stages before it wait instead of piling up songs
+in memory.
+
+```
+py batch_convert.py songs/ charts/ -v example_event.json -n note_types.txt
+```
+
+Every ``*.mid`` in ``songs/`` becomes a chart with the same name in ``charts/``. Add
+``--metrics batch.prom`` and / or ``--trace batch.trace.json`` to see how fast every stage
+of every song went (see ``batch_metrics``).
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Any, Optional
+
+import mido
+
+from batch_metrics import StageRecorder, StageSpan, write_chrome_trace, write_openmetrics
+from chart_output import BuildManifest, WrittenFile, chart_text, write_if_changed
+from midi_processing import midi_to_representation, midi_to_representation_selective, Progress, PARSE
+from run_with_ui import BasicConverter, CustomEventMetadata, load_event_information, load_note_types
+
+DEFAULT_QUEUE_DEPTH = 4
+
+
+@dataclass
+class BatchResult:
+    """What happened to one song."""
+    midi_file: Path
+    output_chart: Path
+    error: Optional[str] = None
+    timings_ms: dict[str, float] = field(default_factory=dict)  # read, convert, write
+    spans: list[StageSpan] = field(default_factory=list)  # the same, in the main process
+    # only if stages are recorded:
+    worker_spans: list[StageSpan] = field(default_factory=list)  # parse, listeners... in the worker
+    worker: Optional[int] = None  # pid of the worker process
+    notes: int = 0
+    written: Optional[WrittenFile] = None  # the chart, once written or found unchanged
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def record(self, stage: str, start_s: float, t0: float) -> None:
+        """``stage`` ran from ``start_s`` (``time.time()``) until now, ``t0`` being
+        ``time.perf_counter()`` when it started."""
+        seconds = time.perf_counter() - t0
+        self.timings_ms[stage] = seconds * 1000
+        self.spans.append(StageSpan(stage=stage, start_s=start_s, end_s=start_s + seconds))
+
+
+def convert_midi_bytes(bc: BasicConverter, midi_bytes: bytes, evs: list[CustomEventMetadata],
+                       note_types: list[str], only_required_tracks: bool = False,
+                       progress: Optional[Progress] = None) -> str:
+    """The CPU bound part of a conversion. Return the chart as JSON text.
+    This runs in a worker process."""
+    if only_required_tracks:
+        if progress is not None:
+            progress.start(PARSE)
+        midi_representation = midi_to_representation_selective(
+            midi_bytes, bc.get_midi_conv(evs, note_types).required_tracks())
+        if progress is not None:
+            progress.finish()
+    else:
+        midi_representation = midi_to_representation(mido.MidiFile(file=io.BytesIO(midi_bytes)), progress=progress)
+    return chart_text(bc.convert(midi_representation, evs, note_types, progress=progress))
+
+
+def convert_midi_bytes_recorded(bc: BasicConverter, midi_bytes: bytes, evs: list[CustomEventMetadata],
+                                note_types: list[str],
+                                only_required_tracks: bool = False) -> tuple[str, StageRecorder, int]:
+    """``convert_midi_bytes``, also giving when every stage ran and the pid of the worker."""
+    recorder = StageRecorder()
+    text = convert_midi_bytes(bc, midi_bytes, evs, note_types, only_required_tracks, recorder.progress())
+    return text, recorder, os.getpid()
+
+
+def _song_converter(template: BasicConverter, midi_path: Path, out_dir: Path) -> BasicConverter:
+    bc = replace(template, midi_file=midi_path, output_chart=out_dir / f"{midi_path.stem}.json")
+    bc.resolve_song_name()
+    return bc
+
+
+async def convert_folder_async(template: BasicConverter, midi_paths: list[Path], out_dir: Path,
+                               executor: Executor, workers: int,
+                               queue_depth: int = DEFAULT_QUEUE_DEPTH,
+                               only_required_tracks: bool = False,
+                               record_stages: bool = False) -> list[BatchResult]:
+    """Convert every MIDI in ``midi_paths`` into ``out_dir``. Every setting except the
+    MIDI, output chart and (if empty) the song name comes from ``template``.
+
+    ``workers`` songs are converted at a time on ``executor``, and at most ``queue_depth``
+    songs wait to be converted and to be written each, with up to ``queue_depth`` charts
+    being written at once.
+
+    See ``BasicConverter.read_midi`` for ``only_required_tracks``. If ``record_stages``,
+    workers also send back when each stage of the conversion ran and how many notes the
+    chart has, for ``batch_metrics``.
+
+    Songs that fail are reported in their ``BatchResult`` and do not stop the batch.
+    """
+    loop = asyncio.get_running_loop()
+    evs, note_types = await asyncio.gather(
+        asyncio.to_thread(load_event_information, template.event_information),
+        asyncio.to_thread(load_note_types, template.note_types)
+    )
+    results = [BatchResult(midi_file=p, output_chart=out_dir / f"{p.stem}.json") for p in midi_paths]
+    read_q: asyncio.Queue[Optional[tuple[BatchResult, BasicConverter, bytes]]] = asyncio.Queue(queue_depth)
+    write_q: asyncio.Queue[Optional[tuple[BatchResult, str]]] = asyncio.Queue(queue_depth)
+
+    async def read_one(result: BatchResult, sem: asyncio.Semaphore) -> None:
+        async with sem:
+            start_s, t0 = time.time(), time.perf_counter()
+            try:
+                midi_bytes = await asyncio.to_thread(result.midi_file.read_bytes)
+            except OSError as e:
+                result.error = f"{type(e).__name__}: {e}"
+                return
+            result.record("read", start_s, t0)
+            await read_q.put((result, _song_converter(template, result.midi_file, out_dir), midi_bytes))
+
+    async def reader() -> None:
+        # the semaphore only limits reads in flight; read_q is what applies the backpressure
+        sem = asyncio.Semaphore(queue_depth)
+        await asyncio.gather(*(read_one(r, sem) for r in results))
+        for _ in range(workers):
+            await read_q.put(None)
+
+    async def converter() -> None:
+        while (item := await read_q.get()) is not None:
+            result, bc, midi_bytes = item
+            start_s, t0 = time.time(), time.perf_counter()
+            try:
+                if record_stages:
+                    text, recorder, result.worker = await loop.run_in_executor(
+                        executor, convert_midi_bytes_recorded, bc, midi_bytes, evs, note_types, only_required_tracks)
+                    result.worker_spans, result.notes = recorder.spans, recorder.notes
+                else:
+                    text = await loop.run_in_executor(executor, convert_midi_bytes, bc, midi_bytes, evs, note_types,
+                                                      only_required_tracks)
+            except Exception as e:  # one broken MIDI should not stop the whole batch
+                result.error = f"{type(e).__name__}: {e}"
+                continue
+            result.record("convert", start_s, t0)
+            await write_q.put((result, text))
+
+    async def writer() -> None:
+        while (item := await write_q.get()) is not None:
+            await write_one(*item)
+
+    async def write_one(result: BatchResult, text: str) -> None:
+        start_s, t0 = time.time(), time.perf_counter()
+        try:
+            result.written = await asyncio.to_thread(write_if_changed, result.output_chart, text)
+        except OSError as e:
+            result.error = f"{type(e).__name__}: {e}"
+            return
+        result.record("write", start_s, t0)
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # a fixed number of writers, so no more than queue_depth charts are being written at once
+    writer_tasks = [asyncio.create_task(writer()) for _ in range(queue_depth)]
+    await asyncio.gather(reader(), *(converter() for _ in range(workers)))
+    for _ in writer_tasks:
+        await write_q.put(None)
+    await asyncio.gather(*writer_tasks)
+    return results
+
+
+def convert_folder(template: BasicConverter, midi_dir: Path, out_dir: Path, workers: Optional[int] = None,
+                   queue_depth: int = DEFAULT_QUEUE_DEPTH, only_required_tracks: bool = False,
+                   record_stages: bool = False) -> list[BatchResult]:
+    """Convert every ``*.mid`` in ``midi_dir`` into ``out_dir`` using a process pool."""
+    midi_paths = sorted(midi_dir.glob("*.mid"))
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return asyncio.run(convert_folder_async(template, midi_paths, out_dir, executor,
+                                                workers=workers, queue_depth=queue_depth,
+                                                only_required_tracks=only_required_tracks,
+                                                record_stages=record_stages))
+
+
+def _summarize(results: list[BatchResult], elapsed: float) -> dict[str, Any]:
+    failed = [r for r in results if not r.ok]
+    return {
+        "songs": len(results),
+        "failed": len(failed),
+        "unchanged": sum(1 for r in results if r.written is not None and not r.written.changed),
+        "seconds": round(elapsed, 3),
+        "errors": {str(r.midi_file): r.error for r in failed}
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("midi_dir", help="Folder of MIDI files (.mid) to convert")
+    parser.add_argument("output_dir", help="Folder to write the charts (.json) to")
+    parser.add_argument("-v", "--event_info", help="Path to event info file (.json, r)", default=".")
+    parser.add_argument("-n", "--note_types", help="Path to note types file (.txt, r)", default=".")
+    parser.add_argument("-b", "--bf", help="Name of BF", default="bf")
+    parser.add_argument("-e", "--en", help="Name of enemy character (left)", default="dad")
+    parser.add_argument("-g", "--gf", help="Name of GF", default="gf")
+    parser.add_argument("-s", "--scroll", type=float, help="Scroll speed", default=2.4)
+    parser.add_argument('-l', '--stage', help="Stage", default="Stage")
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes", default=None)
+    parser.add_argument("-q", "--queue_depth", type=int, help="Songs allowed to wait between stages",
+                        default=DEFAULT_QUEUE_DEPTH)
+    parser.add_argument("--only_required_tracks", action="store_true",
+                        help="Only parse the notes of tracks the charts use")
+    parser.add_argument("--manifest", help="Record the hashes of every song's inputs and chart in this manifest "
+                                           "(.json), see chart_output", default=None)
+    parser.add_argument("--metrics", help="Write throughput and stage timings to this OpenMetrics file (.prom)",
+                        default=None)
+    parser.add_argument("--trace", help="Write a timeline of every song's stages to this trace file (.json), "
+                                        "for chrome://tracing or Perfetto", default=None)
+    args = parser.parse_args()
+    bc_template = BasicConverter(
+        midi_file=Path("."),
+        output_chart=Path("."),
+        event_information=Path(args.event_info),
+        note_types=Path(args.note_types),
+        bf=args.bf,
+        en=args.en,
+        gf=args.gf,
+        scroll_speed=float(args.scroll),
+        stage=args.stage
+    )
+    start = time.perf_counter()
+    batch_results = convert_folder(bc_template, Path(args.midi_dir), Path(args.output_dir),
+                                   workers=args.workers, queue_depth=args.queue_depth,
+                                   only_required_tracks=args.only_required_tracks,
+                                   record_stages=bool(args.metrics or args.trace))
+    elapsed = time.perf_counter() - start
+    if args.manifest:
+        manifest = BuildManifest.load(Path(args.manifest))
+        for r in batch_results:
+            if r.written is not None:
+                inputs = replace(bc_template, midi_file=r.midi_file).input_files()
+                manifest.record(r.output_chart, inputs, [r.written], sum(r.timings_ms.values()) / 1000)
+        manifest.save(Path(args.manifest))
+    if args.metrics:
+        write_openmetrics(Path(args.metrics), batch_results, elapsed)
+    if args.trace:
+        write_chrome_trace(Path(args.trace), batch_results)
+    print(json.dumps(_summarize(batch_results, elapsed), indent=2))
@@ -0,0 +1,178 @@
+"""Throughput numbers and a timeline of a ``batch_convert`` run, as plain files.
+
+Every song's conversion records when each of its stages (``parse``, ``listeners``,
+``events``, ``sections``, ``export``, see ``midi_processing.progress``) started and ended
+in the worker process, through a ``Progress`` callback that is only called when a stage
+starts or ends. The batch adds when the song was read, handed to a worker and written.
+From that:
+
+- ``write_openmetrics`` writes an OpenMetrics text file (for a node exporter's textfile
+  collector, or just to keep): songs and notes per second, failures, a histogram of every
+  stage, how busy every worker was and the slowest songs
+- ``write_chrome_trace`` writes a trace event JSON, to open in ``chrome://tracing`` or
+  Perfetto: one row per worker with the stages of every song it converted, and the reads
+  and writes of the main process
+"""
+import json
+import math
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+
+from midi_processing import Progress, SECTIONS
+
+if TYPE_CHECKING:
+    from batch_convert import BatchResult
+
+DEFAULT_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DEFAULT_SLOWEST = 10
+METRIC_PREFIX = "midiconv_batch"
+
+
+@dataclass(frozen=True)
+class StageSpan:
+    """FIELDS:
+
+    - stage: str
+    - start_s: float  # time.time(), so spans of different processes line up
+    - end_s: float
+    """
+    stage: str
+    start_s: float
+    end_s: float
+
+    @property
+    def seconds(self) -> float:
+        return self.end_s - self.start_s
+
+
+@dataclass
+class StageRecorder:
+    """A ``Progress`` callback keeping a span for every stage. Use ``progress()`` to make
+    the ``Progress``, which only calls it when a stage starts or ends."""
+    spans: list[StageSpan] = field(default_factory=list)
+    totals: dict[str, Optional[int]] = field(default_factory=dict)
+
+    def __call__(self, stage: str, done: int, total: Optional[int]) -> None:
+        now = time.time()
+        if self.spans and self.spans[-1].stage == stage:
+            self.spans[-1] = StageSpan(stage=stage, start_s=self.spans[-1].start_s, end_s=now)
+        else:
+            self.spans.append(StageSpan(stage=stage, start_s=now, end_s=now))
+        self.totals[stage] = total
+
+    def progress(self) -> Progress:
+        return Progress(callback=self, interval_s=math.inf)
+
+    @property
+    def notes(self) -> int:
+        """Notes put into the chart, as counted by the ``sections`` stage."""
+        return self.totals.get(SECTIONS) or 0
+
+
+def _labels(**labels: str) -> str:
+    escaped = (f'{k}="{v.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for k, v in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def _number(value: float) -> str:
+    return "+Inf" if value == math.inf else repr(float(value))
+
+
+def format_openmetrics(results: list["BatchResult"], elapsed_s: float,
+                       buckets_s: tuple[float, ...] = DEFAULT_BUCKETS_S, slowest: int = DEFAULT_SLOWEST) -> str:
+    """The metrics of a batch that took ``elapsed_s`` seconds, in the OpenMetrics text format."""
+    p = METRIC_PREFIX
+    ok = [r for r in results if r.ok]
+    notes = sum(r.notes for r in ok)
+    lines = [
+        f"# TYPE {p}_songs counter",
+        f"# HELP {p}_songs Songs converted, by result.",
+        f'{p}_songs_total{_labels(result="ok")} {len(ok)}',
+        f'{p}_songs_total{_labels(result="failed")} {len(results) - len(ok)}',
+        f"# TYPE {p}_notes counter",
+        f"# HELP {p}_notes Notes written to charts.",
+        f"{p}_notes_total {notes}",
+        f"# TYPE {p}_duration_seconds gauge",
+        f"{p}_duration_seconds {_number(elapsed_s)}",
+        f"# TYPE {p}_songs_per_second gauge",
+        f"{p}_songs_per_second {_number(len(ok) / elapsed_s if elapsed_s > 0 else 0.0)}",
+        f"# TYPE {p}_notes_per_second gauge",
+        f"{p}_notes_per_second {_number(notes / elapsed_s if elapsed_s > 0 else 0.0)}",
+    ]
+
+    by_stage: dict[str, list[float]] = {}
+    for r in ok:
+        for span in r.spans + r.worker_spans:
+            by_stage.setdefault(span.stage, []).append(span.seconds)
+    lines += [f"# TYPE {p}_stage_seconds histogram",
+              f"# HELP {p}_stage_seconds Time every song spent in every stage."]
+    for stage, seconds in by_stage.items():
+        seconds.sort()
+        count = 0
+        for le in buckets_s + (math.inf,):
+            while count < len(seconds) and seconds[count] <= le:
+                count += 1
+            lines.append(f"{p}_stage_seconds_bucket{_labels(stage=stage, le=_number(le))} {count}")
+        lines.append(f"{p}_stage_seconds_count{_labels(stage=stage)} {len(seconds)}")
+        lines.append(f"{p}_stage_seconds_sum{_labels(stage=stage)} {_number(sum(seconds))}")
+
+    busy: dict[int, float] = {}
+    for r in results:
+        if r.worker is not None and r.worker_spans:
+            busy[r.worker] = busy.get(r.worker, 0.0) + r.worker_spans[-1].end_s - r.worker_spans[0].start_s
+    lines += [f"# TYPE {p}_worker_utilization gauge",
+              f"# HELP {p}_worker_utilization Part of the batch every worker process spent converting."]
+    lines += [f"{p}_worker_utilization{_labels(worker=str(w))} {_number(b / elapsed_s if elapsed_s > 0 else 0.0)}"
+              for w, b in sorted(busy.items())]
+
+    slow = sorted(ok, key=lambda r: r.timings_ms.get("convert", 0.0), reverse=True)[:slowest]
+    lines += [f"# TYPE {p}_slowest_song_seconds gauge",
+              f"# HELP {p}_slowest_song_seconds Conversion time of the {slowest} slowest songs."]
+    lines += [f"{p}_slowest_song_seconds{_labels(song=r.midi_file.name)} "
+              f"{_number(r.timings_ms.get('convert', 0.0) / 1000)}" for r in slow]
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def chrome_trace(results: list["BatchResult"]) -> dict[str, Any]:
+    """The batch as trace events. Times are in microseconds from the first span."""
+    spans = [s for r in results for s in r.spans + r.worker_spans]
+    if not spans:
+        return {"traceEvents": [], "displayTimeUnit": "ms"}
+    origin = min(s.start_s for s in spans)
+
+    def us(t: float) -> float:
+        return round((t - origin) * 1e6, 3)
+
+    events: list[dict[str, Any]] = [{"name": "process_name", "ph": "M", "pid": 0, "args": {"name": "batch"}}]
+    for w in sorted({r.worker for r in results if r.worker is not None}):
+        events.append({"name": "process_name", "ph": "M", "pid": w, "args": {"name": f"worker {w}"}})
+    for i, r in enumerate(results):
+        song = r.midi_file.name
+        # reads, writes and waits of several songs overlap in the main process, so they are async spans
+        for span in r.spans:
+            common = {"name": span.stage, "cat": "batch", "pid": 0, "tid": 0, "id": i, "args": {"song": song}}
+            events.append({**common, "ph": "b", "ts": us(span.start_s)})
+            events.append({**common, "ph": "e", "ts": us(span.end_s)})
+        if r.worker is not None and r.worker_spans:
+            first, last = r.worker_spans[0], r.worker_spans[-1]
+            events.append({"name": song, "cat": "song", "ph": "X", "pid": r.worker, "tid": r.worker,
+                           "ts": us(first.start_s), "dur": us(last.end_s) - us(first.start_s),
+                           "args": {"notes": r.notes, "error": r.error}})
+            events += [{"name": span.stage, "cat": "stage", "ph": "X", "pid": r.worker, "tid": r.worker,
+                        "ts": us(span.start_s), "dur": us(span.end_s) - us(span.start_s), "args": {"song": song}}
+                       for span in r.worker_spans]
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_openmetrics(path: Path, results: list["BatchResult"], elapsed_s: float) -> None:
+    with open(path.__str__(), "w", encoding="UTF-8", newline="\n") as f:
+        f.write(format_openmetrics(results, elapsed_s))
+
+
+def write_chrome_trace(path: Path, results: list["BatchResult"]) -> None:
+    with open(path.__str__(), "w", encoding="UTF-8") as f:
+        json.dump(chrome_trace(results), f)
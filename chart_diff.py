@@ -0,0 +1,289 @@
+"""Compare charts made by ``MidiConv.process_midi``, to see what a converter change did.
+
+Notes, sections and events of both charts are aligned by time (within a tolerance) with
+a sorted merge, and what differs is reported: added, removed and moved notes, changed
+holds and note types, camera / gf / alt flags and BPM of sections, events and the song
+metadata.
+
+```
+py chart_diff.py old.json new.json
+py chart_diff.py old_charts/ new_charts/
+```
+
+Give two folders to compare every chart with the same name in both. Other JSON files in
+them (``events.json``, chart metadata, manifests) are skipped, and a chart that can't be
+read is reported without stopping the rest. The exit code is 1 if anything differs.
+"""
+import argparse
+import json
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Hashable, Iterator, Optional, TypeVar, Union
+
+_T = TypeVar("_T")
+
+DEFAULT_TOLERANCE_MS = 1.0
+EPSILON = 1e-6
+
+
+@dataclass(frozen=True)
+class ChartNote:
+    time: float
+    char: int  # 0=en, 1=bf, whatever the section was pointing at
+    arrow: int  # from 0, as in ``FNFNote.arrow``
+    hold: float
+    extra: Any
+    section: int  # index of the section it was in
+
+
+@dataclass(frozen=True)
+class ChartSection:
+    index: int
+    start_ms: float
+    flags: dict[str, Any]  # everything but the notes
+
+
+@dataclass(frozen=True)
+class ChartEvent:
+    time: float
+    event: tuple[str, ...]  # json of [name, v1, v2], so events can be hashed
+
+
+@dataclass
+class ChartDiff:
+    """Everything that differs between chart ``old`` and chart ``new``."""
+    added_notes: list[ChartNote] = field(default_factory=list)
+    removed_notes: list[ChartNote] = field(default_factory=list)
+    moved_notes: list[tuple[ChartNote, ChartNote]] = field(default_factory=list)
+    changed_holds: list[tuple[ChartNote, ChartNote]] = field(default_factory=list)
+    changed_types: list[tuple[ChartNote, ChartNote]] = field(default_factory=list)
+    added_sections: list[ChartSection] = field(default_factory=list)
+    removed_sections: list[ChartSection] = field(default_factory=list)
+    # (section in new, flag, old value, new value)
+    changed_flags: list[tuple[int, str, Any, Any]] = field(default_factory=list)
+    added_events: list[ChartEvent] = field(default_factory=list)
+    removed_events: list[ChartEvent] = field(default_factory=list)
+    moved_events: list[tuple[ChartEvent, ChartEvent]] = field(default_factory=list)
+    changed_metadata: dict[str, tuple[Any, Any]] = field(default_factory=dict)
+
+    def counts(self) -> dict[str, int]:
+        """How many of each kind of difference there are, leaving out kinds with none."""
+        counts = {k: len(v) for k, v in vars(self).items()}
+        return {k: c for k, c in counts.items() if c}
+
+    @property
+    def identical(self) -> bool:
+        return not self.counts()
+
+    def describe(self, limit: int = 10) -> str:
+        """A readable report, showing up to ``limit`` differences of each kind."""
+        lines: list[str] = []
+        for kind, items in vars(self).items():
+            if not items:
+                continue
+            items = list(items.items()) if isinstance(items, dict) else items
+            lines.append(f"{kind.replace('_', ' ')}: {len(items)}")
+            lines.extend(f"    {_describe_item(item)}" for item in items[:limit])
+            if len(items) > limit:
+                lines.append(f"    ... and {len(items) - limit} more")
+        return "\n".join(lines) if lines else "identical"
+
+
+def _describe_item(item: Any) -> str:
+    if isinstance(item, ChartNote):
+        return f"{item.time:.3f} ms char {item.char} arrow {item.arrow} hold {item.hold:.3f}"
+    if isinstance(item, ChartSection):
+        return f"section {item.index} at {item.start_ms:.3f} ms"
+    if isinstance(item, ChartEvent):
+        return f"{item.time:.3f} ms {', '.join(item.event)}"
+    if isinstance(item, tuple) and len(item) == 2 and not isinstance(item[0], str):
+        return f"{_describe_item(item[0])} -> {_describe_item(item[1])}"
+    if isinstance(item, tuple) and len(item) == 2:
+        return f"{item[0]}: {item[1][0]!r} -> {item[1][1]!r}"
+    if isinstance(item, tuple):
+        index, flag, old, new = item
+        return f"section {index} {flag}: {old!r} -> {new!r}"
+    return repr(item)
+
+
+def chart_notes(chart: dict[str, Any], arrow_count: int = 4) -> list[ChartNote]:
+    """Every note of a chart, with arrows made independent of ``mustHitSection`` again."""
+    notes: list[ChartNote] = []
+    for i, section in enumerate(chart["song"]["notes"]):
+        must_hit = int(bool(section["mustHitSection"]))
+        for time, arrow, hold, *extra in section["sectionNotes"]:
+            pad_up, arrow = divmod(int(arrow), arrow_count)
+            notes.append(ChartNote(time=time, char=pad_up ^ must_hit, arrow=arrow, hold=hold,
+                                   extra=extra[0] if extra else None, section=i))
+    return notes
+
+
+def chart_sections(chart: dict[str, Any]) -> list[ChartSection]:
+    sections: list[ChartSection] = []
+    start_ms = 0.0
+    for i, section in enumerate(chart["song"]["notes"]):
+        flags = {k: v for k, v in section.items() if k != "sectionNotes"}
+        sections.append(ChartSection(index=i, start_ms=start_ms, flags=flags))
+        start_ms += section.get("sectionBeats", 4) * 60000 / section["bpm"]
+    return sections
+
+
+def chart_events(chart: dict[str, Any]) -> list[ChartEvent]:
+    return [ChartEvent(time=time, event=tuple(json.dumps(v) for v in ev))
+            for time, evs in chart["song"].get("events", []) for ev in evs]
+
+
+def align(old: list[_T], new: list[_T], time_of: Callable[[_T], float], lane_of: Callable[[_T], Hashable],
+          tolerance: float) -> Iterator[tuple[Optional[_T], Optional[_T]]]:
+    """Pair up items of ``old`` and ``new`` in the same lane that are at most ``tolerance`` apart,
+    by walking both lanes sorted by time. Unpaired items come with None."""
+    lanes: dict[Hashable, tuple[list[_T], list[_T]]] = {}
+    for side, items in enumerate((old, new)):
+        for item in items:
+            lanes.setdefault(lane_of(item), ([], []))[side].append(item)
+    for a, b in lanes.values():
+        a.sort(key=time_of)
+        b.sort(key=time_of)
+        i = j = 0
+        while i < len(a) and j < len(b):
+            d = time_of(b[j]) - time_of(a[i])
+            if abs(d) <= tolerance:
+                yield a[i], b[j]
+                i += 1
+                j += 1
+            elif d < 0:
+                yield None, b[j]
+                j += 1
+            else:
+                yield a[i], None
+                i += 1
+        yield from ((x, None) for x in a[i:])
+        yield from ((None, y) for y in b[j:])
+
+
+def diff_charts(old: dict[str, Any], new: dict[str, Any], tolerance: float = DEFAULT_TOLERANCE_MS,
+                hold_tolerance: float = DEFAULT_TOLERANCE_MS, arrow_count: int = 4) -> ChartDiff:
+    """Compare two loaded charts. Times closer than ``tolerance`` ms are the same note."""
+    diff = ChartDiff()
+    for a, b in align(chart_notes(old, arrow_count), chart_notes(new, arrow_count),
+                      lambda n: n.time, lambda n: (n.char, n.arrow), tolerance):
+        if a is None:
+            diff.added_notes.append(b)
+        elif b is None:
+            diff.removed_notes.append(a)
+        else:
+            if abs(a.time - b.time) > EPSILON:
+                diff.moved_notes.append((a, b))
+            if abs(a.hold - b.hold) > hold_tolerance:
+                diff.changed_holds.append((a, b))
+            if a.extra != b.extra:
+                diff.changed_types.append((a, b))
+
+    for a, b in align(chart_sections(old), chart_sections(new), lambda s: s.start_ms, lambda s: 0, tolerance):
+        if a is None:
+            diff.added_sections.append(b)
+        elif b is None:
+            diff.removed_sections.append(a)
+        else:
+            for flag in sorted(a.flags.keys() | b.flags.keys()):
+                if a.flags.get(flag) != b.flags.get(flag):
+                    diff.changed_flags.append((b.index, flag, a.flags.get(flag), b.flags.get(flag)))
+
+    for a, b in align(chart_events(old), chart_events(new), lambda e: e.time, lambda e: e.event, tolerance):
+        if a is None:
+            diff.added_events.append(b)
+        elif b is None:
+            diff.removed_events.append(a)
+        elif abs(a.time - b.time) > EPSILON:
+            diff.moved_events.append((a, b))
+
+    old_song, new_song = old["song"], new["song"]
+    for key in sorted((old_song.keys() | new_song.keys()) - {"notes", "events"}):
+        if old_song.get(key) != new_song.get(key):
+            diff.changed_metadata[key] = (old_song.get(key), new_song.get(key))
+
+    for kind in (diff.added_notes, diff.removed_notes):
+        kind.sort(key=lambda n: n.time)
+    for kind in (diff.moved_notes, diff.changed_holds, diff.changed_types):
+        kind.sort(key=lambda p: p[1].time)
+    diff.changed_flags.sort(key=lambda c: c[0])
+    return diff
+
+
+def diff_chart_files(old: Path, new: Path, **kwargs: Any) -> ChartDiff:
+    """Compare two chart files, skipping the parsing if they are byte for byte the same."""
+    old_bytes, new_bytes = old.read_bytes(), new.read_bytes()
+    if old_bytes == new_bytes:
+        return ChartDiff()
+    return diff_charts(json.loads(old_bytes), json.loads(new_bytes), **kwargs)
+
+
+def is_chart_file(path: Path) -> bool:
+    """Whether ``path`` holds a chart (a ``song`` object with ``notes``), not some other JSON
+    kept next to charts. Files that can't be read count as charts, so the error is reported."""
+    try:
+        with open(path, "r", encoding="UTF-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return True
+    song = data.get("song") if isinstance(data, dict) else None
+    return isinstance(song, dict) and "notes" in song
+
+
+def diff_chart_dirs(old_dir: Path, new_dir: Path, **kwargs: Any) -> dict[str, Union[ChartDiff, str]]:
+    """Compare every ``*.json`` chart found in either folder, by path relative to it. JSON
+    files that are not charts (see ``is_chart_file``) are skipped. Charts found in only one
+    folder map to ``"only in old"`` or ``"only in new"``, and charts that could not be
+    compared to the error."""
+    old_charts = {p.relative_to(old_dir).as_posix() for p in old_dir.rglob("*.json") if is_chart_file(p)}
+    new_charts = {p.relative_to(new_dir).as_posix() for p in new_dir.rglob("*.json") if is_chart_file(p)}
+    results: dict[str, Union[ChartDiff, str]] = {}
+    for name in sorted(old_charts | new_charts):
+        if name not in new_charts:
+            results[name] = "only in old"
+        elif name not in old_charts:
+            results[name] = "only in new"
+        else:
+            try:
+                results[name] = diff_chart_files(old_dir / name, new_dir / name, **kwargs)
+            except Exception as e:
+                results[name] = f"{type(e).__name__}: {e}"
+    return results
+
+
+def _summarize(results: dict[str, Union[ChartDiff, str]]) -> dict[str, Any]:
+    changed = {name: r.counts() for name, r in results.items() if isinstance(r, ChartDiff) and not r.identical}
+    return {
+        "charts": len(results),
+        "identical": sum(1 for r in results.values() if isinstance(r, ChartDiff) and r.identical),
+        "changed": changed,
+        "only_in_old": [name for name, r in results.items() if r == "only in old"],
+        "only_in_new": [name for name, r in results.items() if r == "only in new"],
+        "errors": {name: r for name, r in results.items()
+                   if isinstance(r, str) and r not in ("only in old", "only in new")},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare two charts, or two folders of charts")
+    parser.add_argument("old", help="Chart (.json) or folder of charts to compare from")
+    parser.add_argument("new", help="Chart (.json) or folder of charts to compare to")
+    parser.add_argument("-t", "--tolerance", type=float, default=DEFAULT_TOLERANCE_MS,
+                        help="Notes, sections and events this many ms apart are still the same")
+    parser.add_argument("--hold_tolerance", type=float, default=DEFAULT_TOLERANCE_MS,
+                        help="Holds differing by at most this many ms are the same")
+    parser.add_argument("--arrow_count", type=int, default=4, help="Keys per character")
+    parser.add_argument("--limit", type=int, default=10, help="Differences of each kind to show")
+    args = parser.parse_args()
+    options = {"tolerance": args.tolerance, "hold_tolerance": args.hold_tolerance, "arrow_count": args.arrow_count}
+    old_path, new_path = Path(args.old), Path(args.new)
+    if old_path.is_dir() and new_path.is_dir():
+        summary = _summarize(diff_chart_dirs(old_path, new_path, **options))
+        print(json.dumps(summary, indent=2))
+        differs = bool(summary["changed"] or summary["only_in_old"] or summary["only_in_new"] or summary["errors"])
+    else:
+        chart_diff = diff_chart_files(old_path, new_path, **options)
+        print(chart_diff.describe(args.limit))
+        differs = not chart_diff.identical
+    sys.exit(1 if differs else 0)
@@ -0,0 +1,155 @@
+"""Write one converted song in several chart formats at once.
+
+``MidiConv.build_chart`` parses nothing twice: it runs the listeners once and gives a
+``ChartIntermediate`` (sections with their notes, events, tempo map and metadata), which
+every ``AbstractChartExporter`` turns into the files of its format:
+
+- ``psych``: the Psych Engine chart ``process_midi`` makes, ``song.json``
+- ``vslice``: the split format of the newer base game, ``song-chart.json`` with the notes
+  and events and ``song-metadata.json`` with the tempo, characters and stage
+
+For an engine of your own, subclass ``AbstractChartExporter`` and pass an instance of it.
+``export_chart`` runs the exporters (and the JSON encoding) on an executor if given one,
+so with a process pool every format is made in parallel.
+"""
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from chart_gen import AbstractChartExporter, ChartIntermediate, PsychChartExporter
+from chart_output import WrittenFile, chart_text, write_if_changed
+
+VSLICE_CHART_VERSION = "2.0.0"
+VSLICE_METADATA_VERSION = "2.2.4"
+GENERATED_BY = "chart-gen-10-5"
+
+
+@dataclass
+class VSliceChartExporter(AbstractChartExporter):
+    """The chart and metadata files of the base game since 0.3. Lanes 0-3 are bf and 4-7
+    the enemy; camera moves become ``FocusCamera`` events and Psych events keep their
+    name, with ``[v1, v2]`` as their value.
+
+    FIELDS:
+
+    - difficulty: str  # the notes are put under this difficulty
+    - artist: str
+    - note_style: str
+    """
+    difficulty: str = "normal"
+    artist: str = "Unknown"
+    note_style: str = "funkin"
+    name = "vslice"
+
+    def export(self, chart: ChartIntermediate) -> dict[str, Any]:
+        return {"-chart": self.chart_json(chart), "-metadata": self.metadata_json(chart)}
+
+    def chart_json(self, chart: ChartIntermediate) -> dict[str, Any]:
+        notes: list[dict[str, Any]] = []
+        for ses in chart.sections:
+            for note in ses.notes:
+                # with must_hit, bf gets arrows 0-3 and the enemy 4-7, as here
+                time, lane, hold, *kind = note.export_note(True)
+                vn: dict[str, Any] = {"t": time, "d": lane}
+                if hold:
+                    vn["l"] = hold
+                if kind and kind[0]:
+                    vn["k"] = kind[0]
+                notes.append(vn)
+        notes.sort(key=lambda vn: vn["t"])
+
+        events: list[dict[str, Any]] = []
+        focus = None
+        for ses, start_ms in zip(chart.sections, chart.sections_ms):
+            char = 2 if ses.gf_section else 0 if ses.bf_cam else 1
+            if char != focus:
+                events.append({"t": start_ms, "e": "FocusCamera", "v": {"char": char}})
+                focus = char
+        for ev in chart.events:
+            events.extend({"t": ev.time, "e": name, "v": values} for name, *values in ev.export_event())
+        events.sort(key=lambda ve: ve["t"])
+
+        return {
+            "version": VSLICE_CHART_VERSION,
+            "scrollSpeed": {self.difficulty: chart.metadata.scroll_speed},
+            "events": events,
+            "notes": {self.difficulty: notes},
+            "generatedBy": GENERATED_BY
+        }
+
+    def metadata_json(self, chart: ChartIntermediate) -> dict[str, Any]:
+        time_changes: list[dict[str, Any]] = []
+        bpm = chart.initial_bpm
+        for ses, start_ms in zip(chart.sections, chart.sections_ms):
+            bpm = ses.new_bpm if ses.new_bpm is not None else bpm
+            # same as a time signature in chart_reader: 3.5 beats is 7/8
+            numerator, denominator = ses.section_beats, 4
+            while numerator != int(numerator) and denominator < 32:
+                numerator, denominator = numerator * 2, denominator * 2
+            change = {"t": start_ms, "bpm": bpm, "n": max(1, round(numerator)), "d": denominator}
+            if not time_changes or any(time_changes[-1][k] != change[k] for k in ("bpm", "n", "d")):
+                time_changes.append(change)
+        if not time_changes:
+            time_changes.append({"t": 0.0, "bpm": bpm, "n": 4, "d": 4})
+
+        metadata = chart.metadata
+        return {
+            "version": VSLICE_METADATA_VERSION,
+            "songName": metadata.song,
+            "artist": self.artist,
+            "timeFormat": "ms",
+            "timeChanges": time_changes,
+            "playData": {
+                "songVariations": [],
+                "difficulties": [self.difficulty],
+                "characters": {"player": metadata.bf, "girlfriend": metadata.gf, "opponent": metadata.en},
+                "stage": metadata.stage,
+                "noteStyle": self.note_style
+            },
+            "generatedBy": GENERATED_BY
+        }
+
+
+EXPORTERS: dict[str, Callable[[], AbstractChartExporter]] = {
+    PsychChartExporter.name: PsychChartExporter,
+    VSliceChartExporter.name: VSliceChartExporter,
+}
+
+
+def get_exporters(formats: list[str]) -> list[AbstractChartExporter]:
+    """Exporters for format names as in ``EXPORTERS``, e.g. ``["psych", "vslice"]``."""
+    unknown = [f for f in formats if f not in EXPORTERS]
+    if unknown:
+        raise ValueError(f"Unknown chart formats {unknown}, known ones are {sorted(EXPORTERS)}")
+    return [EXPORTERS[f]() for f in formats]
+
+
+def _export_job(exporter: AbstractChartExporter, chart: ChartIntermediate) -> dict[str, str]:
+    return {suffix: chart_text(data) for suffix, data in exporter.export(chart).items()}
+
+
+def export_chart(chart: ChartIntermediate, exporters: list[AbstractChartExporter],
+                 executor: Optional[Executor] = None) -> dict[str, str]:
+    """``{suffix: JSON text}`` of every file of every exporter. Exporters run (and their
+    files are encoded) on ``executor`` if given, in which case they and the chart must be
+    picklable for a process pool. Two exporters writing the same suffix is an error."""
+    if executor is None:
+        outputs = [_export_job(exporter, chart) for exporter in exporters]
+    else:
+        outputs = list(executor.map(_export_job, exporters, [chart] * len(exporters)))
+    files: dict[str, str] = {}
+    for exporter, output in zip(exporters, outputs):
+        for suffix, text in output.items():
+            if suffix in files:
+                raise ValueError(f"Two chart formats write {suffix or 'the chart'}, the second one is "
+                                 f"{exporter.name or type(exporter).__name__}")
+            files[suffix] = text
+    return files
+
+
+def write_chart_files(output_chart: Path, files: dict[str, str]) -> list[WrittenFile]:
+    """Write what ``export_chart`` gave next to ``output_chart``, leaving files that would
+    not change alone."""
+    return [write_if_changed(output_chart.with_name(f"{output_chart.stem}{suffix}{output_chart.suffix or '.json'}"),
+                             text) for suffix, text in files.items()]
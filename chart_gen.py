@@ -1,10 +1,16 @@
+import bisect
+import heapq
+import json
 import math
 import re
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
-from typing import Any, Union, Optional, final, cast
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Any, Union, Optional, final, Iterator, Iterable, TextIO
 
-from midi_processing import Note, MidiRepresentation, TempoChange, TimeSignature
+from midi_processing import Note, MidiRepresentation, TempoChange, SharedBlock, \
+    share_representation, attach_representation, unlink_block, Progress, ConversionCancelled, \
+    LISTENERS, EVENTS, SECTIONS, SHARDS, EXPORT, BarGrid
 
 VAL = Union[int, float, str]
 INT_OR_BOOL = Union[int, bool]
@@ -19,7 +25,7 @@ def get_actual_duration(beat: float, duration_beats: float, tcs: list[TempoChang
 
 
 def beat_to_s(beat: float, tcs: list[TempoChange]) -> float:
-    tcs = sorted(tcs, key=lambda s: s.beat)
+    """``tcs`` must be sorted by beat, such as ``MidiRepresentation.sorted_bpm_changes()``."""
     bpm = 120  # current bpm
     cur_time = 0.0  # time since the last tempo change
     last_tc = 0.0  # beat of the last tempo change
@@ -65,7 +71,7 @@ def ntn(note_name: str) -> int:
     return octave * 12 + base_dict[base] + sf_d[sharp_flat]
 
 
-@dataclass
+@dataclass(slots=True)
 class AbstractFNFNote(ABC):
     """This class represents a note,
     that would represent an arrow in the FNF chart."""
@@ -79,15 +85,15 @@ class AbstractFNFNote(ABC):
         pass
 
 
-@dataclass
+@dataclass(slots=True)
 class ExtraData:
     """Additional data to pass in all variants of ``process_note``, if needed."""
     note_index: int
     notes: list[Note]
-    bpm_changes: list[TempoChange]
+    bpm_changes: list[TempoChange]  # sorted by beat
 
 
-@dataclass
+@dataclass(slots=True)
 class FNFNote(AbstractFNFNote):
     char: int  # the character the note belongs to, starting from 0.
     # by default, 0=en, 1=bf. If your mod has over 2 characters
@@ -123,7 +129,7 @@ class FNFNote(AbstractFNFNote):
             ]
 
 
-@dataclass
+@dataclass(slots=True)
 class AbstractFNFEvent(ABC):
     """AN EVENT USUALLY CONSISTS OF
     [EVENT NAME, V1, V2]
@@ -152,7 +158,7 @@ class AbstractFNFEvent(ABC):
         return [self.time, self.export_event()]
 
 
-@dataclass
+@dataclass(slots=True)
 class FNFEvent(AbstractFNFEvent):
     name: str
     v1: str
@@ -241,14 +247,14 @@ class RegularFNFNoteListener(AbstractNoteListener):
 
 
 def get_bpm_so_far(beat: float, tempo_changes: list[TempoChange]) -> float:
+    """``tempo_changes`` must be sorted by beat, such as ``MidiRepresentation.sorted_bpm_changes()``."""
     if not tempo_changes:
         return DEFAULT_BPM
 
-    tc_sorted = sorted(tempo_changes, key=lambda s: s.beat)
-    for i, tc in enumerate(tempo_changes):
+    for tc in tempo_changes:
         if beat >= tc.beat:
-            return tc_sorted[i].new_bpm_rounded
-    return tc_sorted[-1].new_bpm_rounded
+            return tc.new_bpm_rounded
+    return tempo_changes[-1].new_bpm_rounded
 
 
 @dataclass
@@ -257,7 +263,7 @@ class MidiConvOpt:
     events: list[AbstractFNFEvent]
 
 
-@dataclass
+@dataclass(slots=True)
 class RawSection:
     bf_cam: bool
     notes: list[AbstractFNFNote]
@@ -277,19 +283,8 @@ def find_index_first_above(sorted_list: list[float], value: float, b: int = 0, e
 
     if e is None:
         e = len(sorted_list)
-
-    if e - b == 0:
-        return -1
-    elif e - b == 1:
-        return b if sorted_list[b] <= value + eps else -1
-
-    m = (b + e) // 2
-
-    if sorted_list[m] <= value + eps:
-        rv = find_index_first_above(sorted_list, value, m, e)
-    else:
-        rv = find_index_first_above(sorted_list, value, b, m)
-    return rv
+    rv = bisect.bisect_right(sorted_list, value + eps, b, e) - 1
+    return rv if rv >= b else -1
 
 
 def flagged_sections(target_track: str, midi_rep: MidiRepresentation, sections_generated: list[float]) -> list[bool]:
@@ -306,8 +301,9 @@ def flagged_sections(target_track: str, midi_rep: MidiRepresentation, sections_g
         camera_pointing_to_bf: list[bool] = [False for _ in sections_generated]
     else:
         camera_pointing_to_bf: list[bool] = []
-        target_track_notes = sorted(target_track_2.notes, key=lambda n: n.beat)
-        target_track_beats = [n.beat for n in target_track_notes]
+        # cached on the track, which is not changed in place during a conversion
+        target_track_notes = target_track_2.sorted_notes()
+        target_track_beats = target_track_2.sorted_beats()
         previous_choice = False
         for sg in sections_generated:
             # sg is the time the section starts.
@@ -332,11 +328,20 @@ def flagged_sections(target_track: str, midi_rep: MidiRepresentation, sections_g
     return camera_pointing_to_bf
 
 
-def get_json_notes_list(initial_bpm: float, ses_col: list[RawSection]) -> list[dict[str, Any]]:
+def get_json_notes_list(initial_bpm: float, ses_col: list[RawSection],
+                        progress: Optional[Progress] = None) -> list[dict[str, Any]]:
     """Return the notes that would be injected into the JSON file"""
-    json_notes_list = []
+    return list(iter_json_notes(initial_bpm, ses_col, progress))
+
+
+def iter_json_notes(initial_bpm: float, ses_col: Iterable[RawSection],
+                    progress: Optional[Progress] = None) -> Iterator[dict[str, Any]]:
+    """Like ``get_json_notes_list``, but one section at a time.
+    Sections are counted to ``progress`` in the stage it is in."""
     current_bpm = initial_bpm
-    for ses in ses_col:
+    for i, ses in enumerate(ses_col):
+        if progress is not None:
+            progress.update(i)
         sd = {
             "sectionBeats": ses.section_beats,
             "altAnim": ses.alt_anim,
@@ -352,8 +357,7 @@ def get_json_notes_list(initial_bpm: float, ses_col: list[RawSection]) -> list[d
             sd["bpm"] = ses.new_bpm
             sd["changeBPM"] = True
             current_bpm = ses.new_bpm
-        json_notes_list.append(sd)
-    return json_notes_list
+        yield sd
 
 
 @dataclass
@@ -369,6 +373,68 @@ class FNFMetadata:
     splash_skin: Optional[str] = None
 
 
+@dataclass
+class ChartIntermediate:
+    """A converted song before it is written in any chart format, made once by
+    ``MidiConv.build_chart`` and shared by every ``AbstractChartExporter``. Exporters
+    must not mutate it.
+
+    FIELDS:
+
+    - metadata: FNFMetadata
+    - initial_bpm: float
+    - sections: list[RawSection]  # with their notes, in the order process_midi writes them
+    - sections_ms: list[float]  # when every section starts
+    - events: list[AbstractFNFEvent]  # sorted like process_midi writes them
+    """
+    metadata: FNFMetadata
+    initial_bpm: float
+    sections: list[RawSection]
+    sections_ms: list[float]
+    events: list[AbstractFNFEvent]
+
+    def tempo_map(self) -> list[tuple[float, float]]:
+        """(ms, bpm) of the start of the song and of every section where the BPM changes."""
+        tempo = [(0.0, self.initial_bpm)]
+        for ses, start_ms in zip(self.sections, self.sections_ms):
+            if ses.new_bpm is not None and ses.new_bpm != tempo[-1][1]:
+                tempo.append((start_ms, ses.new_bpm))
+        return tempo
+
+
+class AbstractChartExporter(ABC):
+    """Writes a ``ChartIntermediate`` in one engine's chart format."""
+    name: str = ""  # short name of the format, as given to ``--formats``
+
+    @abstractmethod
+    def export(self, chart: ChartIntermediate) -> dict[str, Any]:
+        """Return ``{suffix: JSON data}``, one entry per file of the chart. A chart saved
+        as ``song.json`` is written to ``song<suffix>.json``."""
+        pass
+
+
+@dataclass
+class PsychChartExporter(AbstractChartExporter):
+    """The Psych Engine 0.7 (and legacy) chart ``process_midi`` gives. Without
+    ``embed_events``, the chart has no events; write them once for every difficulty
+    with ``build_events_json`` instead."""
+    embed_events: bool = True
+    name = "psych"
+
+    def export(self, chart: ChartIntermediate) -> dict[str, Any]:
+        return {"": self.chart_json(chart)}
+
+    def chart_json(self, chart: ChartIntermediate, progress: Optional[Progress] = None) -> dict[str, Any]:
+        """Sections are counted to ``progress`` as the ``export`` stage."""
+        if progress is None:
+            progress = Progress()
+        progress.start(EXPORT, len(chart.sections))
+        json_notes_list = get_json_notes_list(chart.initial_bpm, chart.sections, progress)
+        json_events = [ev.export_event_with_time() for ev in chart.events] if self.embed_events else []
+        progress.finish()
+        return build_chart_json(chart.metadata, chart.initial_bpm, json_notes_list, json_events)
+
+
 @dataclass
 class MidiConv:
     note_listeners: list[AbstractNoteListener]
@@ -379,101 +445,437 @@ class MidiConv:
     gf_track: str = "gf"
     alt_anim: str = "alt"
 
-    def process_midi(self, midi_rep: MidiRepresentation, metadata: FNFMetadata) -> dict[str, Any]:
+    def process_midi(self, midi_rep: MidiRepresentation, metadata: FNFMetadata,
+                     progress: Optional[Progress] = None, with_events: bool = True) -> dict[str, Any]:
+        """If ``progress`` is given, the ``listeners``, ``events``, ``sections`` and ``export``
+        stages are reported to it, and it can cancel the conversion. Without ``with_events``,
+        events are not made at all and the chart has none (see ``process_events``)."""
+        if progress is None:
+            progress = Progress()
+        return PsychChartExporter().chart_json(self.build_chart(midi_rep, metadata, progress, with_events), progress)
 
-        initial_bpm = midi_rep.bpm_changes[0].new_bpm_rounded if midi_rep.bpm_changes else 120
+    @final
+    def process_events(self, midi_rep: MidiRepresentation, progress: Optional[Progress] = None) -> dict[str, Any]:
+        """Only the events of the chart, as the ``events.json`` Psych Engine loads for every
+        difficulty of the song. The ``events`` stage is reported to ``progress``."""
+        return build_events_json([ev.export_event_with_time() for ev in self._get_event_notes(midi_rep, progress)])
+
+    @final
+    def build_chart(self, midi_rep: MidiRepresentation, metadata: FNFMetadata,
+                    progress: Optional[Progress] = None, with_events: bool = True) -> ChartIntermediate:
+        """Run the listeners and put the notes into sections, once for every chart format
+        (see ``AbstractChartExporter``). The ``listeners``, ``events`` and ``sections``
+        stages are reported to ``progress``. Without ``with_events``, there are no events."""
+        if progress is None:
+            progress = Progress()
 
-        song_length = max(
-            math.ceil(max(max(n.beat + n.duration for n in v.notes) for v in midi_rep.tracks.values()) + 1),
-            math.ceil(max(bc.beat + 14 for bc in midi_rep.bpm_changes)),
-            math.ceil(max(tcc.beat + 14 for tcc in midi_rep.time_signature_changes)))
-        fnf_notes = self._get_fnf_notes(midi_rep)
-        event_notes = self._get_event_notes(midi_rep)
+        initial_bpm = get_initial_bpm(midi_rep)
+
+        song_length = get_chart_song_length(midi_rep)
+        fnf_notes = self._get_fnf_notes(midi_rep, progress)
+        event_notes = self._get_event_notes(midi_rep, progress) if with_events else []
 
         # SECTIONS EXPORT GENERATOR
-        raw_section_collection = self._generate_section_collection(fnf_notes, midi_rep, song_length)
-
-        json_notes_list = get_json_notes_list(initial_bpm, raw_section_collection)
-        json_events = [ev.export_event_with_time() for ev in event_notes]
-
-        song_data = {
-            "player1": metadata.bf,
-            "events": json_events,
-            "player2": metadata.en,
-            "gfVersion": metadata.gf,
-            "song": metadata.song,
-            "stage": metadata.stage,
-            "needsVoices": metadata.needs_voices,
-            "validScore": metadata.valid_score,
-            "bpm": initial_bpm,
-            "speed": metadata.scroll_speed,
-            "notes": json_notes_list,
-            "generatedBy": "chart-gen-10-5"
-        }
-        if metadata.splash_skin:
-            song_data["splashSkin"] = metadata.splash_skin
+        raw_section_collection = self._generate_section_collection(fnf_notes, midi_rep, song_length, progress)
 
-        json_data = {
-            "song": song_data
-        }
-        return json_data
+        return ChartIntermediate(metadata=metadata, initial_bpm=initial_bpm, sections=raw_section_collection,
+                                 sections_ms=list(section_grid(midi_rep, song_length).starts_ms), events=event_notes)
 
     @final
-    def _get_event_notes(self, midi_rep: MidiRepresentation) -> list[AbstractFNFEvent]:
-        event_notes: list[AbstractFNFEvent] = []
-        for event_listener in self.event_listeners:
-            target_track = next((x for x in midi_rep.tracks.values() if x.track_name == event_listener.track), None)
+    def write_chart_streaming(self, midi_rep: MidiRepresentation, metadata: FNFMetadata, fp: TextIO,
+                              progress: Optional[Progress] = None, with_events: bool = True) -> None:
+        """Write the chart ``process_midi`` gives to ``fp``, as ``json.dump`` would, without
+        ever holding more than a few sections' worth of notes (see ``iter_sections``).
+        Events are still all collected first, since they come before the notes in the chart.
+        If cancelled through ``progress``, ``fp`` is left with part of a chart."""
+        initial_bpm = get_initial_bpm(midi_rep)
+        json_events = ([ev.export_event_with_time() for ev in self._get_event_notes(midi_rep, progress)]
+                       if with_events else [])
+        chart = build_chart_json(metadata, initial_bpm, [], json_events)
+        fp.write('{"song": {')
+        for i, (key, value) in enumerate(chart["song"].items()):
+            if i:
+                fp.write(", ")
+            fp.write(f"{json.dumps(key)}: ")
+            if key != "notes":
+                json.dump(value, fp, allow_nan=False)
+                continue
+            fp.write("[")
+            for j, sd in enumerate(iter_json_notes(initial_bpm, self.iter_sections(midi_rep, progress))):
+                if j:
+                    fp.write(", ")
+                json.dump(sd, fp, allow_nan=False)
+            fp.write("]")
+        fp.write("}}")
+
+    @final
+    def iter_sections(self, midi_rep: MidiRepresentation,
+                      progress: Optional[Progress] = None) -> Iterator[RawSection]:
+        """The sections ``process_midi`` makes, in order, each one given out as soon as no
+        later note can land in it. Every section given out is a new one that is not changed
+        afterwards, so they can be kept (``list(iter_sections(...))`` works); the generator
+        itself holds no notes of sections it already gave out.
+
+        The notes of every listener are merged by time with a heap, so listeners are called
+        in time order instead of track by track. Listeners must give their notes the
+        ``time_ms`` they were called with (as they always should), otherwise notes could
+        belong to sections that were already given out, which raises a ValueError.
+        Notes are counted to ``progress`` as the ``listeners`` stage.
+        """
+        if progress is None:
+            progress = Progress()
+        song_length = get_chart_song_length(midi_rep)
+        _, ses_col, sections_ms = self._generate_empty_sections(midi_rep, song_length)
+        eps = 0.0000001  # same as find_index_first_above
+
+        target_tracks = [next((x for x in midi_rep.tracks.values() if x.track_name == lis.track), None)
+                         for lis in self.note_listeners]
+        tcs = midi_rep.sorted_bpm_changes()
+
+        def listener_notes(li: int) -> Iterator[tuple[float, int, int, Note]]:
+            target_track = target_tracks[li]
+            if target_track is None:
+                return
+            notes = target_track.notes
+            # beat_to_s is not monotonic when there are several tempo changes, so merge on the time itself
+            times_ms = [1000 * beat_to_s(n.beat, tcs) for n in notes]
+            for i in sorted(range(len(notes)), key=times_ms.__getitem__):
+                yield times_ms[i], li, i, notes[i]
+
+        open_notes: dict[int, list[tuple[tuple[int, int], AbstractFNFNote]]] = {}
+        next_section = 0
+
+        def close_section() -> RawSection:
+            nonlocal next_section
+            # same order as process_midi: listener by listener, then note by note
+            notes = [n for _, n in sorted(open_notes.pop(next_section, []), key=lambda kn: kn[0])]
+            # ses_col keeps the empty section, the notes only go to the caller
+            ses = replace(ses_col[next_section], notes=notes)
+            next_section += 1
+            return ses
+
+        progress.start(LISTENERS, sum(len(t.notes) for t in target_tracks if t is not None))
+        merged = heapq.merge(*(listener_notes(li) for li in range(len(self.note_listeners))))
+        for done, (time_ms, li, i, note) in enumerate(merged):
+            progress.update(done)
+            # no note from now on can start before time_ms
+            while next_section + 1 < len(ses_col) and sections_ms[next_section + 1] <= time_ms + eps:
+                yield close_section()
+            tpn = self.note_listeners[li].process_note(note, time_ms, get_bpm_so_far(note.beat, tcs),
+                                                       ExtraData(i, target_tracks[li].notes, tcs))
+            if tpn is None:
+                continue
+            ses_idx = find_index_first_above(sections_ms, tpn.time)
+            if ses_idx == -1:
+                ses_idx = len(ses_col) - 1
+            if ses_idx < next_section:
+                raise ValueError(f"Note at {tpn.time} ms belongs to a section that was already written. "
+                                 f"Listeners must not change the time of their notes when streaming")
+            open_notes.setdefault(ses_idx, []).append(((li, i), tpn))
+        progress.finish()
+        while next_section < len(ses_col):
+            yield close_section()
+
+    @final
+    def required_tracks(self) -> set[str]:
+        """Names of every track this converter reads notes from."""
+        return ({lis.track for lis in self.note_listeners}
+                .union(lis.track for lis in self.event_listeners)
+                .union({self.cam_track, self.gf_track, self.alt_anim}))
+
+    @final
+    def process_midi_sharded(self, midi_rep: MidiRepresentation, metadata: FNFMetadata, shards: int,
+                             executor: Optional[Executor] = None, shared_memory: bool = False,
+                             progress: Optional[Progress] = None, with_events: bool = True) -> dict[str, Any]:
+        """Same output as ``process_midi``, but made with ``build_chart_sharded``."""
+        if progress is None:
+            progress = Progress()
+        chart = self.build_chart_sharded(midi_rep, metadata, shards, executor, shared_memory, progress, with_events)
+        return PsychChartExporter().chart_json(chart, progress)
+
+    @final
+    def build_chart_sharded(self, midi_rep: MidiRepresentation, metadata: FNFMetadata, shards: int,
+                            executor: Optional[Executor] = None, shared_memory: bool = False,
+                            progress: Optional[Progress] = None, with_events: bool = True) -> ChartIntermediate:
+        """Same as ``build_chart``, but the song is cut at section boundaries into
+        ``shards`` windows, and the listeners of every window run (and the notes are put
+        into their sections) in parallel. Meant for very long songs.
+
+        Windows are sent to ``executor`` if one is given, otherwise to a new process pool
+        with one process per shard, so listeners must be picklable. If ``shared_memory``,
+        the MIDI is handed to the workers once through shared memory instead of being
+        pickled for every shard (see ``midi_processing.shared_transport``).
+
+        Finished shards are counted to ``progress`` as the ``shards`` stage. If it cancels,
+        shards that have not started yet are dropped, but running ones are waited for.
+        """
+        if progress is None:
+            progress = Progress()
+        initial_bpm = get_initial_bpm(midi_rep)
+        song_length = get_chart_song_length(midi_rep)
+        sections_generated, ses_col, sections_ms = self._generate_empty_sections(midi_rep, song_length)
+
+        shards = max(1, min(shards, len(ses_col)))
+        bounds = [round(i * len(ses_col) / shards) for i in range(shards + 1)]
+        # beat windows that cover every beat exactly once
+        windows = [-math.inf] + [sections_generated[b] for b in bounds[1:-1]] + [math.inf]
+        listened_tracks = {lis.track for lis in self.note_listeners}
+        if with_events:
+            listened_tracks.update(lis.track for lis in self.event_listeners)
+        shard_rep = MidiRepresentation(
+            tracks={i: t for i, t in midi_rep.tracks.items() if t.track_name in listened_tracks},
+            channel_instrument_map=midi_rep.channel_instrument_map,
+            bpm_changes=midi_rep.bpm_changes,
+            time_signature_changes=midi_rep.time_signature_changes
+        )
+        shared_rep = share_representation(shard_rep) if shared_memory else None
+        jobs = [_ShardJob(midi_conv=self, midi_rep=shard_rep if shared_rep is None else None,
+                          shared_rep=shared_rep, sections=ses_col[bounds[s]:bounds[s + 1]],
+                          first_section=bounds[s], sections_ms=sections_ms,
+                          beat_window=(windows[s], windows[s + 1]), with_events=with_events)
+                for s in range(shards)]
+        progress.start(SHARDS, shards)
+        try:
+            if executor is not None:
+                results = _collect_shards(executor, jobs, progress)
+            else:
+                with ProcessPoolExecutor(max_workers=shards) as pool:
+                    results = _collect_shards(pool, jobs, progress)
+            progress.finish()
+        finally:
+            if shared_rep is not None:
+                unlink_block(shared_rep)
+
+        # stitch the shards back together
+        note_keys: list[list[tuple[int, int]]] = []
+        for s, res in enumerate(results):
+            ses_col[bounds[s]:bounds[s + 1]] = res.sections
+            note_keys.extend(res.note_keys)
+        for key, fnf_note in sorted((st for res in results for st in res.strays), key=lambda st: st[0]):
+            ses_idx = find_index_first_above(sections_ms, fnf_note.time)
+            # keep the order process_midi would have given: listener by listener, then note by note
+            ins = bisect.bisect(note_keys[ses_idx], key)
+            note_keys[ses_idx].insert(ins, key)
+            ses_col[ses_idx].notes.insert(ins, fnf_note)
+        event_notes = [ev for _, ev in heapq.merge(*(res.events for res in results), key=lambda ke: ke[0])]
+        return ChartIntermediate(metadata=metadata, initial_bpm=initial_bpm, sections=ses_col,
+                                 sections_ms=list(sections_ms), events=event_notes)
+
+    @final
+    def _get_event_notes(self, midi_rep: MidiRepresentation,
+                         progress: Optional[Progress] = None) -> list[AbstractFNFEvent]:
+        return [ev for _, ev in self._get_keyed_event_notes(midi_rep, progress=progress)]
+
+    @final
+    def _get_keyed_event_notes(self, midi_rep: MidiRepresentation,
+                               beat_window: tuple[float, float] = (-math.inf, math.inf),
+                               progress: Optional[Progress] = None) -> list[tuple[tuple[int, int], AbstractFNFEvent]]:
+        """Events of notes that start in ``beat_window``, keyed by (listener index, note index).
+        Notes gone through are counted to ``progress`` as the ``events`` stage."""
+        lo, hi = beat_window
+        event_notes: list[tuple[tuple[int, int], AbstractFNFEvent]] = []
+        target_tracks = [next((x for x in midi_rep.tracks.values() if x.track_name == lis.track), None)
+                         for lis in self.event_listeners]
+        if progress is None:
+            progress = Progress()
+        progress.start(EVENTS, sum(len(t.notes) for t in target_tracks if t is not None))
+        done = 0
+        tcs = midi_rep.sorted_bpm_changes()
+        for li, event_listener in enumerate(self.event_listeners):
+            target_track = target_tracks[li]
             if target_track is None:
                 continue
             for i, note in enumerate(target_track.notes):
-                ev_n = (event_listener.process_event(note, 1000 * beat_to_s(note.beat, midi_rep.bpm_changes),
-                                                     ExtraData(i, target_track.notes, midi_rep.bpm_changes)))
+                progress.update(done + i)
+                if not lo <= note.beat < hi:
+                    continue
+                ev_n = (event_listener.process_event(note, 1000 * beat_to_s(note.beat, tcs),
+                                                     ExtraData(i, target_track.notes, tcs)))
                 if ev_n is not None:
-                    event_notes.append(ev_n)
+                    event_notes.append(((li, i), ev_n))
+            done += len(target_track.notes)
+        progress.finish()
         return event_notes
 
     @final
-    def _get_fnf_notes(self, midi_rep: MidiRepresentation) -> list[AbstractFNFNote]:
-        fnf_notes: list[AbstractFNFNote] = []
-        for listener in self.note_listeners:
-            target_track = next((x for x in midi_rep.tracks.values() if x.track_name == listener.track), None)
+    def _get_fnf_notes(self, midi_rep: MidiRepresentation,
+                       progress: Optional[Progress] = None) -> list[AbstractFNFNote]:
+        return [n for _, n in self._get_keyed_fnf_notes(midi_rep, progress=progress)]
+
+    @final
+    def _get_keyed_fnf_notes(self, midi_rep: MidiRepresentation, beat_window: tuple[float, float] = (
+            -math.inf, math.inf), progress: Optional[Progress] = None) -> list[tuple[tuple[int, int], AbstractFNFNote]]:
+        """Notes made from MIDI notes that start in ``beat_window``, keyed by (listener index, note index).
+        Notes gone through are counted to ``progress`` as the ``listeners`` stage."""
+        lo, hi = beat_window
+        fnf_notes: list[tuple[tuple[int, int], AbstractFNFNote]] = []
+        target_tracks = [next((x for x in midi_rep.tracks.values() if x.track_name == lis.track), None)
+                         for lis in self.note_listeners]
+        if progress is None:
+            progress = Progress()
+        progress.start(LISTENERS, sum(len(t.notes) for t in target_tracks if t is not None))
+        done = 0
+        tcs = midi_rep.sorted_bpm_changes()
+        for li, listener in enumerate(self.note_listeners):
+            target_track = target_tracks[li]
             if target_track is None:
                 continue
             for i, note in enumerate(target_track.notes):
+                progress.update(done + i)
+                if not lo <= note.beat < hi:
+                    continue
                 tpn = listener.process_note(note,
-                                            1000 * beat_to_s(note.beat, midi_rep.bpm_changes),
-                                            get_bpm_so_far(note.beat,
-                                                           midi_rep.bpm_changes),
-                                            ExtraData(i, target_track.notes, midi_rep.bpm_changes))
+                                            1000 * beat_to_s(note.beat, tcs),
+                                            get_bpm_so_far(note.beat, tcs),
+                                            ExtraData(i, target_track.notes, tcs))
                 if tpn is not None:
                     tpn_nn = tpn
-                    fnf_notes.append(tpn_nn)
+                    fnf_notes.append(((li, i), tpn_nn))
+            done += len(target_track.notes)
+        progress.finish()
         return fnf_notes
 
     @final
-    def _generate_section_collection(self, fnf_notes: list[AbstractFNFNote], midi_rep: MidiRepresentation,
-                                     song_length: int) -> list[RawSection]:
-        sections_generated, section_numerator = generate_sections(midi_rep, song_length)
+    def _generate_empty_sections(self, midi_rep: MidiRepresentation,
+                                 song_length: int) -> tuple[list[float], list[RawSection], list[float]]:
+        """Return the beat each section starts at, the sections without their notes and when
+        each section starts in ms."""
+        grid = section_grid(midi_rep, song_length)
+        sections_generated, section_numerator = grid.starts, grid.lengths
         camera_pointing_to_bf = flagged_sections(self.cam_track, midi_rep, sections_generated)
         gf_section = flagged_sections(self.gf_track, midi_rep, sections_generated)
         alt_anim_sections = flagged_sections(self.alt_anim, midi_rep, sections_generated)
         integrated_tempo_changes = integrate_tempo_changes(
             sections_generated, midi_rep.bpm_changes
         )
-        sections = sorted([beat_to_s(s, midi_rep.bpm_changes) * 1000 for s in
-                           sections_generated])  # ensure sections is always sorted
+        sections = grid.starts_ms  # always sorted
         ses_col = [RawSection(bf_cam=camera_pointing_to_bf[i], notes=[], gf_section=gf_section[i],
                               alt_anim=alt_anim_sections[i],
                               section_beats=section_numerator[i],
                               new_bpm=integrated_tempo_changes[i]
                               ) for i in
                    range(len(sections_generated))]
-        for note in fnf_notes:
-            ses_idx = find_index_first_above(sections, note.time)
-            ses_col[ses_idx].notes.append(note)
+        return sections_generated, ses_col, sections
+
+    @final
+    def _generate_section_collection(self, fnf_notes: list[AbstractFNFNote], midi_rep: MidiRepresentation,
+                                     song_length: int, progress: Optional[Progress] = None) -> list[RawSection]:
+        """Make the sections and put the notes into them. Notes put are counted to
+        ``progress`` as the ``sections`` stage."""
+        if progress is None:
+            progress = Progress()
+        progress.start(SECTIONS, len(fnf_notes))
+        _, ses_col, _ = self._generate_empty_sections(midi_rep, song_length)
+        ses_indices = section_grid(midi_rep, song_length).bars_at_ms([note.time for note in fnf_notes])
+        for i, note in enumerate(fnf_notes):
+            progress.update(i)
+            ses_col[ses_indices[i]].notes.append(note)
+        progress.finish()
         return ses_col
 
 
+@dataclass
+class _ShardJob:
+    midi_conv: MidiConv
+    midi_rep: Optional[MidiRepresentation]  # only the tracks the listeners need
+    shared_rep: Optional[SharedBlock]  # the same, in shared memory, if midi_rep is None
+    sections: list[RawSection]  # the sections of this shard, without notes
+    first_section: int  # index of sections[0] in the whole song
+    sections_ms: list[float]  # start of every section of the whole song
+    beat_window: tuple[float, float]  # only MIDI notes starting in [b, e)
+    with_events: bool = True
+
+
+@dataclass
+class _ShardResult:
+    sections: list[RawSection]
+    note_keys: list[list[tuple[int, int]]]  # (listener index, note index) of every note in sections
+    strays: list[tuple[tuple[int, int], AbstractFNFNote]]  # notes belonging to another shard's section
+    events: list[tuple[tuple[int, int], AbstractFNFEvent]]
+
+
+def _process_shard(job: _ShardJob) -> _ShardResult:
+    """Run the listeners over one window of the song and put the notes into their sections.
+    This runs in a worker process."""
+    conv = job.midi_conv
+    midi_rep = job.midi_rep if job.midi_rep is not None else attach_representation(job.shared_rep)
+    note_keys: list[list[tuple[int, int]]] = [[] for _ in job.sections]
+    strays: list[tuple[tuple[int, int], AbstractFNFNote]] = []
+    for key, note in conv._get_keyed_fnf_notes(midi_rep, job.beat_window):
+        ses_idx = find_index_first_above(job.sections_ms, note.time)
+        if ses_idx == -1:
+            ses_idx = len(job.sections_ms) - 1
+        local_idx = ses_idx - job.first_section
+        if local_idx in range(len(job.sections)):
+            job.sections[local_idx].notes.append(note)
+            note_keys[local_idx].append(key)
+        else:
+            strays.append((key, note))
+    events = conv._get_keyed_event_notes(midi_rep, job.beat_window) if job.with_events else []
+    return _ShardResult(sections=job.sections, note_keys=note_keys, strays=strays, events=events)
+
+
+def _collect_shards(executor: Executor, jobs: list[_ShardJob], progress: Progress) -> list[_ShardResult]:
+    """Run every job, in order, counting finished ones to ``progress``. If it cancels,
+    jobs that have not started yet are cancelled too."""
+    futures = [executor.submit(_process_shard, job) for job in jobs]
+    results: list[_ShardResult] = []
+    try:
+        for future in futures:
+            results.append(future.result())
+            progress.report(len(results))
+    except ConversionCancelled:
+        for future in futures:
+            future.cancel()
+        raise
+    return results
+
+
+def get_initial_bpm(midi_rep: MidiRepresentation) -> float:
+    return midi_rep.bpm_changes[0].new_bpm_rounded if midi_rep.bpm_changes else 120
+
+
+def get_chart_song_length(midi_rep: MidiRepresentation) -> int:
+    """An upper bound for how long the song is, in beats, with nudges added
+    so the last section is never cut off."""
+    return max(
+        math.ceil(midi_rep.max_note_end() + 1),
+        math.ceil(max(bc.beat + 14 for bc in midi_rep.bpm_changes)),
+        math.ceil(max(tcc.beat + 14 for tcc in midi_rep.time_signature_changes)))
+
+
+def build_chart_json(metadata: FNFMetadata, initial_bpm: float, json_notes_list: list[dict[str, Any]],
+                     json_events: list[list[Any]]) -> dict[str, Any]:
+    """Wrap exported sections and events into a chart."""
+    song_data = {
+        "player1": metadata.bf,
+        "events": json_events,
+        "player2": metadata.en,
+        "gfVersion": metadata.gf,
+        "song": metadata.song,
+        "stage": metadata.stage,
+        "needsVoices": metadata.needs_voices,
+        "validScore": metadata.valid_score,
+        "bpm": initial_bpm,
+        "speed": metadata.scroll_speed,
+        "notes": json_notes_list,
+        "generatedBy": "chart-gen-10-5"
+    }
+    if metadata.splash_skin:
+        song_data["splashSkin"] = metadata.splash_skin
+
+    json_data = {
+        "song": song_data
+    }
+    return json_data
+
+
+def build_events_json(json_events: list[list[Any]]) -> dict[str, Any]:
+    """Wrap exported events into the ``events.json`` Psych Engine loads for every difficulty
+    of a song, as its chart editor saves it."""
+    return {"song": {"events": json_events}}
+
+
 def generate_sections(midi_rep: MidiRepresentation, song_length: int) -> tuple[list[float], list[float]]:
     """Song length is the upper bound for how long the song is, in beats (with more nudges added).
     Return the beat markers for when a new section should be created.
@@ -481,36 +883,17 @@ def generate_sections(midi_rep: MidiRepresentation, song_length: int) -> tuple[l
     The first list returned is always sorted
     The second list represents the section's beats
 
-    This really should NOT be returning two values
+    This really should NOT be returning two values (see ``section_grid``, which has both)
     """
-    tc_changes = midi_rep.time_signature_changes
-    if not tc_changes:
-        tc_changes = [TimeSignature(4, 4, 0)]
-    current_tc: int = 0
-    current_beat: float = 0.0
-
-    beat_markers: list[float] = [0]
-    section_beats: list[float] = [4]
-
-    while current_beat <= song_length:
-        next_candidate_1 = current_beat + tc_changes[current_tc].numerator
-        next_candidate_2 = math.inf
-        target_tc = tc_changes[current_tc]
-        if (current_tc + 1) in range(0, len(tc_changes)):
-            next_candidate_2 = tc_changes[current_tc + 1].beat
+    grid = section_grid(midi_rep, song_length)
+    return list(grid.starts), list(grid.lengths)
 
-        next_beat = min(next_candidate_1, next_candidate_2)
-        if next_candidate_2 <= next_candidate_1:
-            target_tc = tc_changes[current_tc + 1]
-            current_tc += 1
-            section_beats[-1] = next_beat - current_beat
 
-        beat_markers.append(next_beat)
-        section_beats.append(target_tc.numerator)
-
-        current_beat = next_beat
-
-    return beat_markers, section_beats
+def section_grid(midi_rep: MidiRepresentation, song_length: int) -> BarGrid:
+    """The sections of the chart, with when they start in ms, built once per representation
+    (see ``BarGrid.for_chart_sections``). Do not mutate."""
+    tcs = midi_rep.sorted_bpm_changes()
+    return midi_rep.chart_section_grid(song_length, lambda b: beat_to_s(b, tcs) * 1000)
 
 
 def integrate_tempo_changes(section_beat_markers: list[float], tempo_changes: list[TempoChange]) -> list[
@@ -527,15 +910,24 @@ def integrate_tempo_changes(section_beat_markers: list[float], tempo_changes: li
     unaccounted for tempo changes.
     """
     tc_indices: set[int] = set()
+    # for every section, the first tempo change on it
+    first_tc: list[Optional[int]] = [None for _ in section_beat_markers]
+    by_beat = sorted(range(len(section_beat_markers)), key=section_beat_markers.__getitem__)
+    sorted_markers = [section_beat_markers[i] for i in by_beat]
+    for tc_idx, tc in enumerate(tempo_changes):
+        # markers close to tc.beat are next to each other once sorted
+        lo = hi = bisect.bisect_left(sorted_markers, tc.beat)
+        while lo > 0 and math.isclose(tc.beat, sorted_markers[lo - 1]):
+            lo -= 1
+        while hi < len(sorted_markers) and math.isclose(tc.beat, sorted_markers[hi]):
+            hi += 1
+        for k in range(lo, hi):
+            if first_tc[by_beat[k]] is None:
+                first_tc[by_beat[k]] = tc_idx
     tc_stuff: list[Optional[float]] = []
-    for sbm in section_beat_markers:
-        tc_found = next(((i, tc) for i, tc in enumerate(tempo_changes) if math.isclose(tc.beat, sbm)), (-1, None))
-        tc_idx = tc_found[0]
-        tc_inst = tc_found[1]
-        if tc_inst is not None:
-            assert tc_idx != -1
-            tc_inst_v = cast(TempoChange, tc_inst)
-            tc_stuff.append(tc_inst_v.new_bpm_rounded)
+    for tc_idx in first_tc:
+        if tc_idx is not None:
+            tc_stuff.append(tempo_changes[tc_idx].new_bpm_rounded)
             tc_indices.add(tc_idx)
         else:
             tc_stuff.append(None)
@@ -546,3 +938,36 @@ def integrate_tempo_changes(section_beat_markers: list[float], tempo_changes: li
             "bypass this, add a respectful time signature marker at your tempo change.")
 
     return tc_stuff
+
+
+def _benchmark_memory(note_count: int = 50_000) -> None:
+    """Print how much memory the objects behind a chart with ``note_count`` notes take."""
+    import tracemalloc
+
+    def measure(make: Any) -> tuple[Any, float]:
+        tracemalloc.start()
+        made = make()
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return made, used / 1e6
+
+    midi_notes, midi_mb = measure(lambda: [Note(channel=0, note=60 + j % 4, velocity=100, beat=j / 4, duration=0.25)
+                                           for j in range(note_count)])
+    fnf_notes, fnf_mb = measure(lambda: [FNFNote(char=j % 2, time=j * 100.0, arrow=j % 4, hold=0.0)
+                                         for j in range(note_count)])
+    _, sections_mb = measure(lambda: [RawSection(bf_cam=False, notes=fnf_notes[k:k + 16], gf_section=False,
+                                                 alt_anim=False, section_beats=4, new_bpm=None)
+                                      for k in range(0, note_count, 16)])
+    _, events_mb = measure(lambda: [FNFEvent(j * 100.0, "Add Camera Zoom", "0.015", "0.03")
+                                    for j in range(note_count)])
+    _, extra_mb = measure(lambda: [ExtraData(j, midi_notes, []) for j in range(note_count)])
+    print(f"{note_count} of each, in MB")
+    print(f"midi_processing.Note: {midi_mb:8.2f}")
+    print(f"FNFNote:              {fnf_mb:8.2f}")
+    print(f"RawSection (16 notes): {sections_mb:7.2f}")
+    print(f"FNFEvent:             {events_mb:8.2f}")
+    print(f"ExtraData:            {extra_mb:8.2f}")
+
+
+if __name__ == '__main__':
+    _benchmark_memory()
@@ -0,0 +1,213 @@
+"""Find notes that play badly in a chart: stacked notes, notes hidden in a sustain, notes
+too close after the one before, and sustains running over a BPM change.
+
+Notes are grouped by lane (the arrow as written with ``mustHitSection`` false: 0-3 en,
+4-7 bf), every lane is sorted once and swept in time order, remembering until when the
+lane is held, so a chart is linted in O(n log n). Sustains are looked up in the sorted
+BPM changes with a bisect.
+
+```
+py chart_lint.py chart.json
+py chart_lint.py charts/
+py chart_lint.py song.mid -v events.json -n note_types.txt
+```
+
+A MIDI is linted as the notes ``BasicConverter`` would make of it, before they are
+written. Give a folder to lint every chart in it, in parallel. The exit code is 1 if
+anything was found.
+"""
+import argparse
+import bisect
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Optional, Sequence, Union
+
+from chart_gen import AbstractFNFNote, MidiConv, RawSection, get_chart_song_length, get_initial_bpm, section_grid
+from chart_reader import read_chart, rebuild_tempo
+from midi_processing import MidiRepresentation
+
+DEFAULT_TOLERANCE_MS = 1.0
+DEFAULT_MIN_GAP_MS = 40.0
+
+# kinds of issues
+STACKED_NOTE = "stacked_note"  # starts at the same time as the note before it on the lane
+INSIDE_SUSTAIN = "inside_sustain"  # starts while an earlier note of the lane is still held
+SHORT_GAP = "short_gap"  # starts less than min_gap_ms after the note before it ends
+CROSSES_BPM_CHANGE = "crosses_bpm_change"  # held past a section that changes the BPM
+
+
+@dataclass(frozen=True)
+class LintIssue:
+    """FIELDS:
+
+    - kind: str
+    - time: float  # of the note the issue is about
+    - lane: int  # 0-3 en, 4-7 bf with the default 4 keys
+    - section: int  # the note is in
+    - other_time: float  # the note it clashes with, or the BPM change it is held over
+    """
+    kind: str
+    time: float
+    lane: int
+    section: int
+    other_time: float
+
+
+@dataclass
+class LintReport:
+    """Every issue found in one chart, in time order."""
+    notes: int = 0
+    issues: list[LintIssue] = field(default_factory=list)
+
+    def counts(self) -> dict[str, int]:
+        counts: dict[str, int] = {}
+        for issue in self.issues:
+            counts[issue.kind] = counts.get(issue.kind, 0) + 1
+        return counts
+
+    @property
+    def clean(self) -> bool:
+        return not self.issues
+
+    def describe(self, limit: int = 10) -> str:
+        """A readable report, showing up to ``limit`` issues of each kind."""
+        lines: list[str] = []
+        for kind, count in self.counts().items():
+            lines.append(f"{kind.replace('_', ' ')}: {count}")
+            shown = [i for i in self.issues if i.kind == kind][:limit]
+            lines.extend(f"    {i.time:.3f} ms lane {i.lane} section {i.section} (other at {i.other_time:.3f} ms)"
+                         for i in shown)
+            if count > limit:
+                lines.append(f"    ... and {count - limit} more")
+        return "\n".join(lines) if lines else f"{self.notes} notes, nothing found"
+
+
+def lint_notes(notes: Sequence[AbstractFNFNote], sections_ms: Sequence[float], bpm_changes_ms: Sequence[float],
+               tolerance: float = DEFAULT_TOLERANCE_MS, min_gap: float = DEFAULT_MIN_GAP_MS) -> LintReport:
+    """Lint ``notes``, in any order. ``sections_ms`` is when every section starts and
+    ``bpm_changes_ms`` when the BPM changes, both sorted. Notes less than ``tolerance`` ms
+    apart are at the same time; ``min_gap`` of 0 turns short gaps off."""
+    lanes: dict[int, list[tuple[float, float]]] = {}
+    for note in notes:
+        exported = note.export_note(False)
+        hold = exported[2] if len(exported) > 2 and isinstance(exported[2], (int, float)) else 0.0
+        lanes.setdefault(int(exported[1]), []).append((exported[0], exported[0] + max(0.0, hold)))
+
+    report = LintReport(notes=len(notes))
+
+    def add(kind: str, time: float, lane: int, other_time: float) -> None:
+        section = max(0, bisect.bisect_right(sections_ms, time + tolerance) - 1)
+        report.issues.append(LintIssue(kind=kind, time=time, lane=lane, section=section, other_time=other_time))
+
+    for lane, lane_notes in lanes.items():
+        lane_notes.sort()
+        previous = -math.inf
+        held_until, held_from = -math.inf, -math.inf  # the latest end on the lane so far
+        for time, end in lane_notes:
+            if time - previous <= tolerance:
+                add(STACKED_NOTE, time, lane, previous)
+            elif time < held_until - tolerance:
+                add(INSIDE_SUSTAIN, time, lane, held_from)
+            elif time - held_until < min_gap:
+                add(SHORT_GAP, time, lane, held_from)
+            if end > time:
+                change = bisect.bisect_right(bpm_changes_ms, time + tolerance)
+                if change < len(bpm_changes_ms) and bpm_changes_ms[change] < end - tolerance:
+                    add(CROSSES_BPM_CHANGE, time, lane, bpm_changes_ms[change])
+            if end >= held_until:
+                held_until, held_from = end, time
+            previous = time
+    report.issues.sort(key=lambda i: (i.time, i.lane))
+    return report
+
+
+def _bpm_changes_ms(sections: Sequence[RawSection], sections_ms: Sequence[float], initial_bpm: float) -> list[float]:
+    changes: list[float] = []
+    bpm = initial_bpm
+    for ses, start_ms in zip(sections, sections_ms):
+        if ses.new_bpm is not None and ses.new_bpm != bpm:
+            bpm = ses.new_bpm
+            changes.append(start_ms)
+    return changes
+
+
+def lint_midi(midi_conv: MidiConv, midi_rep: MidiRepresentation, **kwargs: Any) -> LintReport:
+    """Lint the notes ``midi_conv`` makes of ``midi_rep``, without writing the chart."""
+    sections_ms = section_grid(midi_rep, get_chart_song_length(midi_rep)).starts_ms
+    sections: list[RawSection] = []
+    notes: list[AbstractFNFNote] = []
+    for ses in midi_conv.iter_sections(midi_rep):
+        sections.append(ses)
+        notes.extend(ses.notes)
+    return lint_notes(notes, sections_ms, _bpm_changes_ms(sections, sections_ms, get_initial_bpm(midi_rep)), **kwargs)
+
+
+def lint_chart(chart_file: Path, arrow_count: int = 4, **kwargs: Any) -> LintReport:
+    chart = read_chart(chart_file, arrow_count)
+    tempo_map, _, _ = rebuild_tempo(chart)
+    notes = [n for ses in chart.sections for n in ses.notes]
+    changes = [t for i, t in enumerate(tempo_map.starts_ms) if i and tempo_map.bpms[i] != tempo_map.bpms[i - 1]]
+    return lint_notes(notes, tempo_map.starts_ms, changes, **kwargs)
+
+
+def _lint_chart_job(job: tuple[Path, dict[str, Any]]) -> Union[LintReport, str]:
+    chart_file, kwargs = job
+    try:
+        return lint_chart(chart_file, **kwargs)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def lint_chart_dir(chart_dir: Path, workers: Optional[int] = None, **kwargs: Any) -> dict[str, Union[LintReport, str]]:
+    """Lint every ``*.json`` chart in ``chart_dir`` in a process pool. Charts that could not
+    be read map to the error."""
+    charts = sorted(p for p in chart_dir.rglob("*.json") if not p.name.endswith(".events.json"))
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        results = list(pool.map(_lint_chart_job, [(p, kwargs) for p in charts], chunksize=8))
+    return {p.relative_to(chart_dir).as_posix(): r for p, r in zip(charts, results)}
+
+
+def _summarize(results: dict[str, Union[LintReport, str]]) -> dict[str, Any]:
+    return {
+        "charts": len(results),
+        "with_issues": {name: r.counts() for name, r in results.items() if isinstance(r, LintReport) and not r.clean},
+        "errors": {name: r for name, r in results.items() if isinstance(r, str)},
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Lint a chart, a MIDI or a folder of charts")
+    parser.add_argument("chart", help="Chart (.json), MIDI (.mid) or folder of charts to lint")
+    parser.add_argument("-t", "--tolerance", type=float, default=DEFAULT_TOLERANCE_MS,
+                        help="Notes this many ms apart are at the same time")
+    parser.add_argument("-g", "--min_gap", type=float, default=DEFAULT_MIN_GAP_MS,
+                        help="Notes of a lane closer than this many ms to the end of the one before are too close")
+    parser.add_argument("-v", "--event_info", help="Event info file (.json) for MIDIs", default=".")
+    parser.add_argument("-n", "--note_types", help="Note types file (.txt) for MIDIs", default=".")
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes for folders", default=None)
+    parser.add_argument("--limit", type=int, default=10, help="Issues of each kind to show")
+    args = parser.parse_args()
+    options = {"tolerance": args.tolerance, "min_gap": args.min_gap}
+    path = Path(args.chart)
+    if path.is_dir():
+        summary = _summarize(lint_chart_dir(path, args.workers, **options))
+        print(json.dumps(summary, indent=2))
+        found = bool(summary["with_issues"] or summary["errors"])
+    else:
+        if path.suffix.lower() == ".mid":
+            from run_with_ui import BasicConverter, load_event_information, load_note_types
+
+            bc = BasicConverter(midi_file=path, output_chart=path.with_suffix(".json"))
+            midi_conv = bc.get_midi_conv(load_event_information(Path(args.event_info)),
+                                         load_note_types(Path(args.note_types)))
+            report = lint_midi(midi_conv, bc.read_midi(midi_conv.required_tracks()), **options)
+        else:
+            report = lint_chart(path, **options)
+        print(report.describe(args.limit))
+        found = not report.clean
+    sys.exit(1 if found else 0)
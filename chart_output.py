@@ -0,0 +1,168 @@
+"""Write charts only when they change, and keep a manifest of what every conversion read
+and wrote.
+
+Charts are always saved as the same text for the same chart (``chart_text``), so a file
+is only replaced when its SHA-256 differs from what would be written (``write_if_changed``,
+or ``StagedFile`` for charts written bit by bit). Unchanged charts keep their mtime, and
+a new chart replaces the old one at once instead of being written over it.
+
+``BuildManifest`` records, for every chart, the hashes of the files it was made from and
+of the files written, which of those changed in its last conversion and how long that
+took, so packaging can skip charts that did not change::
+
+    {"songs": {"charts/song.json": {"inputs": {"songs/song.mid": "ab12..."},
+                                    "outputs": {"charts/song.json": "cd34..."},
+                                    "changed": [], "converted_at": "2024-05-01T12:00:00Z",
+                                    "seconds": 0.412}}}
+
+A manifest is read, updated and saved as a whole, so give every process its own one, or
+update it from one place as ``batch_convert`` does.
+"""
+import hashlib
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def chart_text(data: Any) -> str:
+    """The text a chart (or any JSON written next to it) is saved as: ``json.dumps`` with
+    its defaults, keeping keys in the order the chart was built in, except that NaN and
+    infinities are refused instead of being written as invalid JSON."""
+    return json.dumps(data, allow_nan=False)
+
+
+def file_hash(path: Path) -> Optional[str]:
+    """SHA-256 of a file, None if there is no such file."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+    except (FileNotFoundError, IsADirectoryError):
+        return None
+    return digest.hexdigest()
+
+
+@dataclass(frozen=True)
+class WrittenFile:
+    """FIELDS:
+
+    - path: Path
+    - sha256: str  # of the content it has now
+    - changed: bool  # False if it already had that content and was left alone
+    """
+    path: Path
+    sha256: str
+    changed: bool
+
+
+def write_if_changed(path: Path, text: str) -> WrittenFile:
+    """Save ``text`` to ``path`` (as UTF-8), unless that is what it already holds."""
+    data = text.encode("UTF-8")
+    digest = hashlib.sha256(data).hexdigest()
+    if path.is_file() and path.stat().st_size == len(data) and file_hash(path) == digest:
+        return WrittenFile(path=path, sha256=digest, changed=False)
+    tmp = path.with_name(f"{path.name}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    return WrittenFile(path=path, sha256=digest, changed=True)
+
+
+class StagedFile:
+    """A text file for ``write_if_changed`` that is too big to build in memory first. It
+    is written to ``<path>.tmp`` and hashed on the way, and ``close`` only moves it over
+    ``path`` if the hashes differ. Leaving the ``with`` block with an exception discards
+    it, so a cancelled conversion leaves the previous chart as it was."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.tmp = path.with_name(f"{path.name}.tmp")
+        self.result: Optional[WrittenFile] = None
+        self._digest = hashlib.sha256()
+        self._fp = open(self.tmp, "wb")
+
+    def write(self, text: str) -> int:
+        data = text.encode("UTF-8")
+        self._digest.update(data)
+        self._fp.write(data)
+        return len(text)
+
+    def close(self) -> WrittenFile:
+        self._fp.close()
+        digest = self._digest.hexdigest()
+        changed = file_hash(self.path) != digest
+        if changed:
+            os.replace(self.tmp, self.path)
+        else:
+            os.remove(self.tmp)
+        self.result = WrittenFile(path=self.path, sha256=digest, changed=changed)
+        return self.result
+
+    def discard(self) -> None:
+        self._fp.close()
+        if self.tmp.exists():
+            os.remove(self.tmp)
+
+    def __enter__(self) -> "StagedFile":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+@dataclass
+class ManifestEntry:
+    """FIELDS:
+
+    - inputs: dict[str, str]  # path: SHA-256 of every file the chart was made from
+    - outputs: dict[str, str]  # path: SHA-256 of every file written
+    - changed: list[str]  # outputs whose content changed in the last conversion
+    - converted_at: str  # UTC, ISO 8601
+    - seconds: float  # how long the last conversion took
+    """
+    inputs: dict[str, str] = field(default_factory=dict)
+    outputs: dict[str, str] = field(default_factory=dict)
+    changed: list[str] = field(default_factory=list)
+    converted_at: str = ""
+    seconds: float = 0.0
+
+
+@dataclass
+class BuildManifest:
+    """Every chart converted, by the path of its main output."""
+    songs: dict[str, ManifestEntry] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: Path) -> "BuildManifest":
+        """The manifest saved at ``path``, or an empty one if there is none yet."""
+        if not path.is_file():
+            return cls()
+        with open(path, "r", encoding="UTF-8") as f:
+            data = json.load(f)
+        return cls(songs={k: ManifestEntry(**v) for k, v in data.get("songs", {}).items()})
+
+    def record(self, output_chart: Path, inputs: Iterable[Path], written: Iterable[WrittenFile],
+               seconds: float) -> ManifestEntry:
+        """Note down one conversion of ``output_chart``. Inputs are hashed now."""
+        written = list(written)
+        entry = ManifestEntry(
+            inputs={p.as_posix(): file_hash(p) or "" for p in inputs},
+            outputs={w.path.as_posix(): w.sha256 for w in written},
+            changed=[w.path.as_posix() for w in written if w.changed],
+            converted_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            seconds=round(seconds, 3)
+        )
+        self.songs[output_chart.as_posix()] = entry
+        return entry
+
+    def save(self, path: Path) -> WrittenFile:
+        data = {"songs": {k: asdict(v) for k, v in sorted(self.songs.items())}}
+        return write_if_changed(path, json.dumps(data, indent=1, sort_keys=True, allow_nan=False) + "\n")
@@ -0,0 +1,420 @@
+"""Turn Psych Engine charts back into MIDIs, to bring hand-made charts into the MIDI workflow.
+
+A chart is read section by section without loading the whole file at once (see
+``iter_chart_fields``). Its tempo is rebuilt from the ``bpm`` / ``changeBPM`` and
+``sectionBeats`` of every section, and notes are put back at the beat they were at.
+The MIDI has the tracks ``BasicConverter`` reads:
+
+- ``en`` and ``bf``: the notes, ``C5`` being left. Note types become channels, listed
+  in the note types file written next to the MIDI
+- ``cam``, ``gf`` and ``alt``: a note where ``mustHitSection``, ``gfSection`` or
+  ``altAnim`` changes, at the start of the section before (where the converter looks)
+- ``ev0``, ``ev1``...: one track for every different event, with an events file mapping
+  them back to the event
+
+```
+py chart_reader.py chart.json song.mid
+py chart_reader.py charts/ midis/
+```
+
+Give two folders to convert every chart in the first one, in parallel.
+"""
+import argparse
+import bisect
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterator, Optional, TextIO
+
+from chart_gen import FNFMetadata, FNFNote, FNFEvent, RawSection, DEFAULT_BPM
+from midi_processing import MidiRepresentation, Track, Note, TempoChange, TimeSignature, \
+    representation_to_midi_file_with_conductor
+from run_with_ui import CustomEventMetadata, load_note_types
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+DEFAULT_TICKS_PER_BEAT = 960  # fine enough for notes to land within a millisecond
+STREAMED_FIELDS = frozenset({"notes", "events"})
+SHORT_NOTE_BEATS = 0.25
+SHORT_HOLD_VELOCITY = 40  # under 50, so ``ModifiedFNFNoteListener`` keeps short holds
+VELOCITY = 100
+HOLD_OFFSET_MS = 100  # ``ModifiedFNFNoteListener`` takes this off every hold
+MAX_CHANNELS = 16
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class _JsonStream:
+    """Just enough of an incremental JSON parser to walk the objects and arrays of a
+    chart one value at a time. Values themselves are decoded with ``json``."""
+
+    def __init__(self, fp: TextIO, chunk_size: int) -> None:
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        # read at least as much as is buffered, so a huge value is not decoded over and over
+        chunk = self.fp.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """The next character that is not whitespace, or "" at the end."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch: str) -> None:
+        found = self.peek()
+        if found != ch:
+            raise ValueError(f"Expected {ch!r} in the chart, found {found or 'the end of the file'!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # a number cut off by the end of the buffer decodes too, so read on to be sure
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def _items(self, close: str) -> Iterator[None]:
+        if self.peek() == close:
+            self.pos += 1
+            return
+        while True:
+            yield
+            found = self.peek()
+            self.pos += 1
+            if found == close:
+                return
+            if found != ",":
+                raise ValueError(f"Expected ',' or {close!r} in the chart, found {found or 'the end of the file'!r}")
+
+    def iter_object(self) -> Iterator[str]:
+        """Keys of the object starting here. Read the value of each before asking for the next."""
+        self.expect("{")
+        for _ in self._items("}"):
+            key = self.value()
+            self.expect(":")
+            yield key
+
+    def iter_array(self) -> Iterator[Any]:
+        self.expect("[")
+        for _ in self._items("]"):
+            yield self.value()
+
+
+def iter_chart_fields(fp: TextIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[tuple[str, Any]]:
+    """``(key, value)`` of every field of ``song`` in a chart, in file order. ``notes`` and
+    ``events`` are given one element at a time, as ``("notes", section)`` and
+    ``("events", event)``, so only one section is ever held in memory."""
+    stream = _JsonStream(fp, chunk_size)
+    found_song = False
+    for key in stream.iter_object():
+        if key != "song" or stream.peek() != "{":
+            stream.value()
+            continue
+        found_song = True
+        for song_key in stream.iter_object():
+            if song_key in STREAMED_FIELDS and stream.peek() == "[":
+                for item in stream.iter_array():
+                    yield song_key, item
+            else:
+                yield song_key, stream.value()
+    if not found_song:
+        raise ValueError("Not a chart: there is no song object")
+
+
+@dataclass
+class ChartData:
+    """A chart, read back.
+
+    FIELDS:
+
+    - metadata: FNFMetadata
+    - initial_bpm: float
+    - sections: list[RawSection]  # with FNFNote notes, char 0 being en whatever mustHitSection is
+    - events: list[FNFEvent]  # from ``events`` and from old style events in ``sectionNotes``
+    """
+    metadata: FNFMetadata
+    initial_bpm: float
+    sections: list[RawSection] = field(default_factory=list)
+    events: list[FNFEvent] = field(default_factory=list)
+
+
+def _section_from_json(sd: dict[str, Any], arrow_count: int, events: list[FNFEvent]) -> RawSection:
+    must_hit = bool(sd.get("mustHitSection", True))
+    if "sectionBeats" in sd:
+        section_beats = float(sd["sectionBeats"])
+    else:
+        section_beats = sd.get("lengthInSteps", 16) / 4
+    notes: list[FNFNote] = []
+    for time, arrow, *rest in sd.get("sectionNotes", []):
+        arrow = int(arrow)
+        if arrow < 0:
+            # old style event: [time, -1, name, v1, v2]
+            name, v1, v2 = (list(rest) + ["", "", ""])[:3]
+            events.append(FNFEvent(time=float(time), name=str(name), v1=str(v1), v2=str(v2)))
+            continue
+        pad_up, arrow = divmod(arrow, arrow_count)
+        hold = float(rest[0]) if rest and isinstance(rest[0], (int, float)) else 0.0
+        extra = rest[1] if len(rest) > 1 and isinstance(rest[1], str) and rest[1] else None
+        notes.append(FNFNote(char=pad_up ^ int(must_hit), time=float(time), arrow=arrow, hold=hold, extra=extra,
+                             arrow_count=arrow_count))
+    return RawSection(bf_cam=must_hit, notes=notes, gf_section=bool(sd.get("gfSection", False)),
+                      alt_anim=bool(sd.get("altAnim", False)), section_beats=section_beats,
+                      new_bpm=float(sd["bpm"]) if sd.get("changeBPM") and "bpm" in sd else None)
+
+
+def read_chart(chart_file: Path, arrow_count: int = 4, chunk_size: int = DEFAULT_CHUNK_SIZE) -> ChartData:
+    """Read a Psych Engine chart (``song.json``, any difficulty)."""
+    song: dict[str, Any] = {}
+    sections: list[RawSection] = []
+    events: list[FNFEvent] = []
+    with open(chart_file, "r", encoding="UTF-8") as fp:
+        for key, value in iter_chart_fields(fp, chunk_size):
+            if key == "notes":
+                sections.append(_section_from_json(value, arrow_count, events))
+            elif key == "events":
+                time, evs = value
+                events.extend(FNFEvent(time=float(time), name=str(name), v1=str(v1), v2=str(v2))
+                              for name, v1, v2 in evs)
+            else:
+                song[key] = value
+    metadata = FNFMetadata(en=song.get("player2", "dad"), bf=song.get("player1", "bf"),
+                           gf=song.get("gfVersion", song.get("player3", "gf")) or "gf",
+                           song=song.get("song", chart_file.stem), stage=song.get("stage", "stage"),
+                           scroll_speed=song.get("speed", 1.0), needs_voices=song.get("needsVoices", True),
+                           valid_score=song.get("validScore", True), splash_skin=song.get("splashSkin"))
+    events.sort(key=lambda ev: ev.time)
+    initial_bpm = float(song.get("bpm", DEFAULT_BPM))
+    if not initial_bpm > 0:
+        # rebuild_tempo skips section BPMs like this, but the song's BPM has nothing to fall back on
+        raise ValueError(f"The chart's bpm must be positive, it is {song.get('bpm')!r}")
+    return ChartData(metadata=metadata, initial_bpm=initial_bpm, sections=sections, events=events)
+
+
+@dataclass
+class TempoMap:
+    """Where every section starts, in beats and in ms, and its BPM.
+
+    FIELDS:
+
+    - starts_ms: list[float]
+    - starts_beat: list[float]
+    - bpms: list[float]
+    """
+    starts_ms: list[float]
+    starts_beat: list[float]
+    bpms: list[float]
+
+    def beat_at(self, time_ms: float) -> float:
+        """The beat ``time_ms`` is at, going on at the tempo of the section it is in
+        (the first or last one if it is outside of the song)."""
+        i = max(0, bisect.bisect_right(self.starts_ms, time_ms) - 1)
+        return max(0.0, self.starts_beat[i] + (time_ms - self.starts_ms[i]) * self.bpms[i] / 60000)
+
+
+def rebuild_tempo(chart: ChartData) -> tuple[TempoMap, list[TempoChange], list[TimeSignature]]:
+    """The tempo map of the chart, and the tempo changes and time signatures that give it.
+    A section of ``n`` beats is a bar of ``n``/4, or ``2n``/8 (and so on) if ``n`` is not whole."""
+    bpm = chart.initial_bpm
+    beat = 0.0
+    time_ms = 0.0
+    tempo_map = TempoMap(starts_ms=[], starts_beat=[], bpms=[])
+    tempo_changes = [TempoChange(beat=0, new_bpm=bpm)]
+    time_signatures: list[TimeSignature] = []
+    for ses in chart.sections:
+        if ses.new_bpm is not None and ses.new_bpm > 0 and ses.new_bpm != bpm:
+            bpm = ses.new_bpm
+            if tempo_changes[-1].beat == beat:
+                tempo_changes[-1] = TempoChange(beat=beat, new_bpm=bpm)
+            else:
+                tempo_changes.append(TempoChange(beat=beat, new_bpm=bpm))
+        tempo_map.starts_ms.append(time_ms)
+        tempo_map.starts_beat.append(beat)
+        tempo_map.bpms.append(bpm)
+
+        numerator, denominator = ses.section_beats, 4
+        while numerator != int(numerator) and denominator < 32:
+            numerator, denominator = numerator * 2, denominator * 2
+        numerator = max(1, round(numerator))
+        if not time_signatures or (time_signatures[-1].numerator, time_signatures[-1].denominator) != (
+                numerator, denominator):
+            time_signatures.append(TimeSignature(numerator=numerator, denominator=denominator, beat=beat))
+
+        beat += ses.section_beats
+        time_ms += ses.section_beats * 60000 / bpm
+    if not chart.sections:
+        tempo_map = TempoMap(starts_ms=[0.0], starts_beat=[0.0], bpms=[bpm])
+        time_signatures.append(TimeSignature(numerator=4, denominator=4, beat=0))
+    return tempo_map, tempo_changes, time_signatures
+
+
+@dataclass
+class ChartMidi:
+    """A chart made into a MIDI, with what it takes to convert it back.
+
+    FIELDS:
+
+    - midi_rep: MidiRepresentation
+    - events: list[CustomEventMetadata]  # the events file for the ``ev`` tracks
+    - note_types: list[str]  # the note types file; the note type of every channel
+    """
+    midi_rep: MidiRepresentation
+    events: list[CustomEventMetadata]
+    note_types: list[str]
+
+
+def chart_to_representation(chart: ChartData, note_types: Optional[list[str]] = None,
+                            ticks_per_beat: int = DEFAULT_TICKS_PER_BEAT) -> ChartMidi:
+    """Make the MIDI of a chart. ``note_types`` are the note types to keep on the same
+    channels; note types not in it are given the next free channels."""
+    tempo_map, tempo_changes, time_signatures = rebuild_tempo(chart)
+    note_types = list(note_types) if note_types else [""]
+
+    def snap(beat: float) -> float:
+        return round(beat * ticks_per_beat) / ticks_per_beat
+
+    def channel_of(extra: Any) -> int:
+        note_type = extra if isinstance(extra, str) else ""
+        if note_type not in note_types:
+            if len(note_types) >= MAX_CHANNELS:
+                raise ValueError(f"The chart has over {MAX_CHANNELS} note types, there are not enough channels")
+            note_types.append(note_type)
+        return note_types.index(note_type)
+
+    chars: list[list[Note]] = [[], []]
+    for ses in chart.sections:
+        for fnf_note in ses.notes:
+            beat = snap(tempo_map.beat_at(fnf_note.time))
+            if fnf_note.hold > 0:
+                end = snap(tempo_map.beat_at(fnf_note.time + fnf_note.hold + HOLD_OFFSET_MS))
+                duration = max(end - beat, 1 / ticks_per_beat)
+                velocity = VELOCITY if fnf_note.hold >= 350 else SHORT_HOLD_VELOCITY
+            else:
+                duration, velocity = SHORT_NOTE_BEATS, VELOCITY
+            chars[min(fnf_note.char, 1)].append(Note(channel=channel_of(fnf_note.extra), note=60 + fnf_note.arrow,
+                                                     velocity=velocity, beat=beat, duration=duration))
+
+    def flag_notes(flags: list[bool]) -> list[Note]:
+        # flagged_sections takes the last note starting before a section, so the note setting
+        # a section goes at the start of the one before it. Flags carry on until changed, starting
+        # off, so the first section can not be flagged.
+        notes: list[Note] = []
+        previous = False
+        for flag, beat in zip(flags[1:], tempo_map.starts_beat):
+            if flag != previous:
+                notes.append(Note(channel=0, note=61 if flag else 60, velocity=VELOCITY, beat=snap(beat),
+                                  duration=SHORT_NOTE_BEATS))
+                previous = flag
+        return notes
+
+    tracks = {
+        1: Track(notes=chars[0], track_name="en"),
+        2: Track(notes=chars[1], track_name="bf"),
+        3: Track(notes=flag_notes([ses.bf_cam for ses in chart.sections]), track_name="cam"),
+        4: Track(notes=flag_notes([ses.gf_section for ses in chart.sections]), track_name="gf"),
+        5: Track(notes=flag_notes([ses.alt_anim for ses in chart.sections]), track_name="alt"),
+    }
+    events: list[CustomEventMetadata] = []
+    event_tracks: dict[tuple[str, str, str], Track] = {}
+    for ev in chart.events:
+        key = (ev.name, ev.v1, ev.v2)
+        if key not in event_tracks:
+            name = f"ev{len(event_tracks)}"
+            event_tracks[key] = tracks[len(tracks) + 1] = Track(notes=[], track_name=name)
+            events.append({"track_name": name, "event_name": ev.name, "v1": ev.v1, "v2": ev.v2})
+        event_tracks[key].notes.append(Note(channel=0, note=60, velocity=VELOCITY,
+                                            beat=snap(tempo_map.beat_at(ev.time)), duration=SHORT_NOTE_BEATS))
+
+    midi_rep = MidiRepresentation(tracks=tracks, channel_instrument_map={}, bpm_changes=tempo_changes,
+                                  time_signature_changes=time_signatures)
+    return ChartMidi(midi_rep=midi_rep, events=events, note_types=note_types)
+
+
+def convert_chart(chart_file: Path, midi_file: Path, note_types: Optional[list[str]] = None,
+                  ticks_per_beat: int = DEFAULT_TICKS_PER_BEAT) -> ChartMidi:
+    """Read ``chart_file`` and write its MIDI to ``midi_file``. If it has events or note types,
+    ``<midi name>.events.json`` and ``<midi name>.note_types.txt`` are written next to it."""
+    chart_midi = chart_to_representation(read_chart(chart_file), note_types, ticks_per_beat)
+    # midi_to_representation reads tempo changes one tick late (see augment_total_time), so they are
+    # written one tick early to land on the start of their section again
+    early = chart_midi.midi_rep.copy(update={"bpm_changes": [
+        tc.copy(update={"beat": tc.beat - 1 / ticks_per_beat}) if tc.beat > 0 else tc
+        for tc in chart_midi.midi_rep.bpm_changes]})
+    representation_to_midi_file_with_conductor(early, ticks_per_beat).save(midi_file.__str__())
+    stem = midi_file.with_suffix("")
+    if chart_midi.events:
+        with open(f"{stem}.events.json", "w", encoding="UTF-8") as f:
+            json.dump(chart_midi.events, f, indent=2)
+    if chart_midi.note_types != [""]:
+        with open(f"{stem}.note_types.txt", "w", encoding="UTF-8") as f:
+            f.write("\n".join(chart_midi.note_types))
+    return chart_midi
+
+
+def _convert_chart_job(job: tuple[Path, Path, Optional[list[str]]]) -> Optional[str]:
+    chart_file, midi_file, note_types = job
+    try:
+        convert_chart(chart_file, midi_file, note_types)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def convert_chart_dir(chart_dir: Path, midi_dir: Path, note_types: Optional[list[str]] = None,
+                      workers: Optional[int] = None) -> dict[str, Optional[str]]:
+    """Convert every ``*.json`` chart under ``chart_dir`` into a MIDI at the same place under
+    ``midi_dir``, on ``workers`` processes. Return the error of every chart, None if it worked."""
+    charts = sorted(chart_dir.rglob("*.json"))
+    charts = [c for c in charts if not c.name.endswith(".events.json")]
+    jobs = []
+    for chart_file in charts:
+        midi_file = midi_dir / chart_file.relative_to(chart_dir).with_suffix(".mid")
+        midi_file.parent.mkdir(parents=True, exist_ok=True)
+        jobs.append((chart_file, midi_file, note_types))
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        errors = list(pool.map(_convert_chart_job, jobs, chunksize=8))
+    return {str(chart_file): error for chart_file, error in zip(charts, errors)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Turn Psych Engine charts back into MIDIs")
+    parser.add_argument("chart", help="Chart (.json) or folder of charts to read")
+    parser.add_argument("midi", help="MIDI (.mid) or folder of MIDIs to write")
+    parser.add_argument("-n", "--note_types", help="Note types file (.txt) whose channels to keep", default=".")
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes for folders", default=None)
+    args = parser.parse_args()
+    note_types_path = Path(args.note_types)
+    known_note_types = load_note_types(note_types_path) if note_types_path.is_file() else None
+    chart_path, midi_path = Path(args.chart), Path(args.midi)
+    if chart_path.is_dir():
+        results = convert_chart_dir(chart_path, midi_path, known_note_types, args.workers)
+        failed = {k: v for k, v in results.items() if v is not None}
+        print(json.dumps({"charts": len(results), "failed": len(failed), "errors": failed}, indent=2))
+    else:
+        convert_chart(chart_path, midi_path, known_note_types)
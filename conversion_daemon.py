@@ -0,0 +1,343 @@
+"""A long-running conversion daemon for editor integrations.
+
+Instead of shelling out to ``run_cmdline.py`` on every save (and paying
+interpreter and import startup every time), start this once:
+
+```
+py conversion_daemon.py --port 8765 --workers 2
+```
+
+and POST conversion jobs to ``http://127.0.0.1:8765/convert``. A job is a JSON
+object with the same fields as ``BasicConverter`` (``midi_file`` and
+``output_chart`` are required), plus an optional ``write`` (default ``true``).
+If ``write`` is false, the chart is returned in the response instead of being
+written to ``output_chart``. If ``only_required_tracks`` (default ``false``) is true,
+only the tracks the chart uses are parsed (see ``BasicConverter.read_midi``).
+If ``cancel_if_changed`` (default ``false``) is true, the job is dropped as soon as
+``midi_file`` changes on disk, since a newer job for it is surely on its way; the
+response is then a 409.
+
+``GET /stats`` returns latency histograms for every request and
+for each stage (parse, convert, write) of the conversion, and how many
+requests failed with each status code. A job that fails because of a bug
+in the converter gets a 500 and leaves the daemon running.
+
+Jobs run in a pool of warm worker processes, each of which caches the parsed
+event information and note types files until they change on disk.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, fields
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Any, Callable, Optional, TypeVar, get_type_hints
+
+from midi_processing import Progress, ConversionCancelled, source_changed
+from run_with_ui import BasicConverter, load_event_information, load_note_types
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+LATENCY_BUCKETS_MS: tuple[float, ...] = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+STAGES = ("parse", "convert", "write")
+WARM_UP_TIMEOUT_S = 60.0
+
+_T = TypeVar("_T")
+
+# (kind, resolved path) -> ((mtime_ns, size), loaded value). One per worker process.
+_config_cache: dict[tuple[str, str], tuple[tuple[int, int], Any]] = {}
+
+
+@dataclass
+class LatencyHistogram:
+    """Latency histogram, in milliseconds. Thread safe. Every observation is counted once,
+    in the first bucket whose bound it does not exceed (the counts are not cumulative)."""
+    buckets: tuple[float, ...] = LATENCY_BUCKETS_MS
+    counts: list[int] = field(default_factory=list)  # one more than buckets, the last one is +inf
+    count: int = 0
+    total_ms: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if not self.counts:
+            self.counts = [0 for _ in range(len(self.buckets) + 1)]
+
+    def observe(self, ms: float) -> None:
+        with self._lock:
+            idx = next((i for i, b in enumerate(self.buckets) if ms <= b), len(self.buckets))
+            self.counts[idx] += 1
+            self.count += 1
+            self.total_ms += ms
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "buckets_ms": list(self.buckets),
+                "counts": list(self.counts),
+                "count": self.count,
+                "mean_ms": self.total_ms / self.count if self.count else 0.0
+            }
+
+
+@dataclass
+class FailureCounter:
+    """Failed requests by HTTP status code. Thread safe."""
+    counts: dict[int, int] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def add(self, status: int) -> None:
+        with self._lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return {str(status): count for status, count in sorted(self.counts.items())}
+
+
+def new_histograms() -> dict[str, LatencyHistogram]:
+    """One histogram for whole requests, one per stage."""
+    return {name: LatencyHistogram() for name in ("request",) + STAGES}
+
+
+def record_latencies(histograms: dict[str, LatencyHistogram], result: dict[str, Any], request_ms: float) -> None:
+    histograms["request"].observe(request_ms)
+    for stage, ms in result["timings_ms"].items():
+        histograms[stage].observe(ms)
+
+
+def _cached_config(kind: str, path: Path, loader: Callable[[Path], _T]) -> _T:
+    """Return ``loader(path)``, reusing the last result while the file is unchanged."""
+    if path.is_dir() or not path.exists():
+        return loader(path)
+    stat = path.stat()
+    key = (kind, str(path.resolve()))
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = _config_cache.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    value = loader(path)
+    _config_cache[key] = (stamp, value)
+    return value
+
+
+def converter_from_job(job: dict[str, Any]) -> BasicConverter:
+    """Build a ``BasicConverter`` from a job. ``Path`` fields may be given as strings.
+    Unknown keys are rejected."""
+    type_hints = get_type_hints(BasicConverter)
+    bc_fields = {f.name for f in fields(BasicConverter)}
+    unknown = set(job.keys()).difference(bc_fields)
+    if unknown:
+        raise ValueError(f"Unknown job fields: {sorted(unknown)}")
+    return BasicConverter(**{k: Path(v) if type_hints[k] is Path else v for k, v in job.items()})
+
+
+def _warm_worker() -> None:
+    """Runs once per worker process; everything heavy is imported with this module."""
+    _config_cache.clear()
+
+
+def _wait_for_workers(barrier: Any) -> int:
+    """Keep a worker busy until every worker is running one of these."""
+    barrier.wait()
+    return os.getpid()
+
+
+def run_job(job: dict[str, Any]) -> dict[str, Any]:
+    """Run one conversion job. This runs inside a worker process.
+
+    Return the output path, the chart (only if it was not written)
+    and how long each stage took in ms.
+    """
+    job = dict(job)
+    write = bool(job.pop("write", True))
+    only_required_tracks = bool(job.pop("only_required_tracks", False))
+    cancel_if_changed = bool(job.pop("cancel_if_changed", False))
+    bc = converter_from_job(job)
+    progress = Progress(is_cancelled=source_changed(bc.midi_file)) if cancel_if_changed else None
+    timings: dict[str, float] = {}
+
+    t0 = time.perf_counter()
+    evs = _cached_config("events", bc.event_information, load_event_information)
+    note_types = _cached_config("note_types", bc.note_types, load_note_types)
+    bc.resolve_song_name()
+    required_tracks = bc.get_midi_conv(evs, note_types).required_tracks() if only_required_tracks else None
+    midi_representation = bc.read_midi(required_tracks, progress)
+    t1 = time.perf_counter()
+    timings["parse"] = (t1 - t0) * 1000
+
+    c_json = bc.convert(midi_representation, evs, note_types, progress=progress)
+    t2 = time.perf_counter()
+    timings["convert"] = (t2 - t1) * 1000
+
+    if write:
+        bc.save_chart(c_json)
+        timings["write"] = (time.perf_counter() - t2) * 1000
+
+    return {
+        "output_chart": str(bc.output_chart),
+        "chart": None if write else c_json,
+        "timings_ms": timings
+    }
+
+
+class ConversionDaemon:
+    """Owns the worker pool and the latency histograms."""
+
+    def __init__(self, workers: Optional[int] = None, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.host = host
+        self.port = port
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+        self.histograms = new_histograms()
+        self.failures = FailureCounter()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def warm_up(self) -> None:
+        """Start every worker now rather than on the first requests. Each worker gets a job
+        that waits for all the others to run, so no worker can take two of them."""
+        with multiprocessing.Manager() as manager:
+            barrier = manager.Barrier(self.workers, timeout=WARM_UP_TIMEOUT_S)
+            for fut in [self.executor.submit(_wait_for_workers, barrier) for _ in range(self.workers)]:
+                fut.result()
+
+    def submit(self, job: dict[str, Any]) -> dict[str, Any]:
+        """Run a job on the pool and block until it is done."""
+        t0 = time.perf_counter()
+        result = self.executor.submit(run_job, job).result()
+        record_latencies(self.histograms, result, (time.perf_counter() - t0) * 1000)
+        return result
+
+    def stats(self) -> dict[str, Any]:
+        return {**{name: h.snapshot() for name, h in self.histograms.items()}, "failures": self.failures.snapshot()}
+
+    def serve_forever(self) -> None:
+        self.warm_up()
+        self._server = ThreadingHTTPServer((self.host, self.port), _make_handler(self))
+        print(f"Conversion daemon listening on http://{self.host}:{self.server_port} "
+              f"with {self.workers} workers")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self.executor.shutdown()
+
+    @property
+    def server_port(self) -> int:
+        """The port actually bound, useful if ``port`` was 0."""
+        return self._server.server_address[1] if self._server is not None else self.port
+
+    def shutdown(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def _make_handler(daemon: ConversionDaemon) -> type[BaseHTTPRequestHandler]:
+    class _Handler(BaseHTTPRequestHandler):
+        def _send_json(self, code: int, payload: Any) -> None:
+            body = json.dumps(payload).encode("UTF-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_failure(self, code: int, e: Exception) -> None:
+            daemon.failures.add(code)
+            self._send_json(code, {"error": f"{type(e).__name__}: {e}"})
+
+        def do_GET(self) -> None:
+            if self.path == "/stats":
+                self._send_json(200, daemon.stats())
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self) -> None:
+            if self.path != "/convert":
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                job = json.loads(self.rfile.read(length).decode("UTF-8"))
+                if not isinstance(job, dict):
+                    raise ValueError("A job must be a JSON object")
+                self._send_json(200, daemon.submit(job))
+            except ConversionCancelled as e:
+                self._send_failure(409, e)
+            except (ValueError, KeyError, TypeError, OSError) as e:
+                self._send_failure(400, e)
+            except Exception as e:
+                # not the job's fault: answer anyway, so the client is not left hanging
+                self.log_error("Job failed with %s", type(e).__name__)
+                traceback.print_exc()
+                self._send_failure(500, e)
+
+    return _Handler
+
+
+class DaemonError(Exception):
+    """The daemon rejected a job."""
+
+
+@dataclass
+class DaemonClient:
+    """Client for a running ``ConversionDaemon``."""
+    host: str = DEFAULT_HOST
+    port: int = DEFAULT_PORT
+    timeout: float = 600.0
+
+    def _request(self, path: str, payload: Optional[dict[str, Any]] = None) -> Any:
+        data = json.dumps(payload).encode("UTF-8") if payload is not None else None
+        req = urllib.request.Request(f"http://{self.host}:{self.port}{path}", data=data,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return json.loads(resp.read().decode("UTF-8"))
+        except urllib.error.HTTPError as e:
+            raise DaemonError(json.loads(e.read().decode("UTF-8")).get("error", str(e))) from e
+
+    def convert(self, **job: Any) -> dict[str, Any]:
+        """Same keyword arguments as ``BasicConverter``, plus ``write``, ``only_required_tracks``
+        and ``cancel_if_changed``."""
+        return self._request("/convert", {k: str(v) if isinstance(v, Path) else v for k, v in job.items()})
+
+    def stats(self) -> dict[str, Any]:
+        return self._request("/stats")
+
+
+@dataclass
+class LocalDaemonClient:
+    """Stand-in for ``DaemonClient`` that runs jobs in this process,
+    with no server or worker pool. Meant for tests."""
+    histograms: dict[str, LatencyHistogram] = field(default_factory=new_histograms)
+    failures: FailureCounter = field(default_factory=FailureCounter)
+
+    def convert(self, **job: Any) -> dict[str, Any]:
+        t0 = time.perf_counter()
+        try:
+            result = run_job(job)
+        except Exception as e:
+            self.failures.add(409 if isinstance(e, ConversionCancelled) else
+                              400 if isinstance(e, (ValueError, KeyError, TypeError, OSError)) else 500)
+            raise DaemonError(f"{type(e).__name__}: {e}") from e
+        record_latencies(self.histograms, result, (time.perf_counter() - t0) * 1000)
+        # the real client gets this through JSON
+        return json.loads(json.dumps(result))
+
+    def stats(self) -> dict[str, Any]:
+        return {**{name: h.snapshot() for name, h in self.histograms.items()}, "failures": self.failures.snapshot()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", help="Host to listen on", default=DEFAULT_HOST)
+    parser.add_argument("-p", "--port", type=int, help="Port to listen on", default=DEFAULT_PORT)
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes", default=None)
+    args = parser.parse_args()
+    ConversionDaemon(workers=args.workers, host=args.host, port=args.port).serve_forever()
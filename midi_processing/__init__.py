@@ -1 +1,8 @@
-from .midi_processor import *
\ No newline at end of file
+from .diagnostics import *
+from .progress import *
+from .midi_processor import *
+from .mrep import *
+from .parallel_parse import *
+from .shared_transport import *
+from .selective_parse import *
+from .pipeline import *
@@ -0,0 +1,54 @@
+"""Counters for the odd things found while parsing a MIDI.
+
+A messy MIDI can have thousands of overlapping notes or note_offs without a note_on.
+Instead of one log record per occurrence, every parse counts them in a
+``ParseDiagnostics`` and keeps a few examples of each, and logs one summary (through the
+``midi_processing`` logger, only if DEBUG is enabled for it). Logging is not configured
+here; call ``logging.basicConfig`` yourself to see it.
+"""
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
+
+logger = logging.getLogger("midi_processing")
+
+DEFAULT_MAX_EXAMPLES = 3
+
+# kinds of things counted
+OVERLAPPING_NOTE = "overlapping_note"  # note_on while the same note was still on; the first note was cut
+DROPPED_NOTE = "dropped_note"  # ... and it was cut to nothing, so it was removed
+ORPHAN_NOTE_OFF = "orphan_note_off"  # note_off without a note_on; ignored
+PROGRAM_CHANGE = "program_change"
+
+
+@dataclass
+class ParseDiagnostics:
+    """How many times each kind of thing happened, with the first ``max_examples`` of each.
+    Examples are only formatted when ``summary`` is asked for."""
+    counts: Counter[str] = field(default_factory=Counter)
+    examples: dict[str, list[tuple[str, tuple[Any, ...]]]] = field(default_factory=dict)
+    max_examples: int = DEFAULT_MAX_EXAMPLES
+
+    def record(self, kind: str, msg: str = "", *args: Any) -> None:
+        """Count one ``kind``, described by ``msg % args``."""
+        self.counts[kind] += 1
+        kept = self.examples.setdefault(kind, [])
+        if msg and len(kept) < self.max_examples:
+            kept.append((msg, args))
+
+    def merge(self, other: "ParseDiagnostics") -> None:
+        self.counts.update(other.counts)
+        for kind, kept in other.examples.items():
+            mine = self.examples.setdefault(kind, [])
+            mine.extend(kept[:max(0, self.max_examples - len(mine))])
+
+    def summary(self) -> dict[str, Any]:
+        """``{kind: {"count": n, "examples": [...]}}``"""
+        return {kind: {"count": n, "examples": [msg % args for msg, args in self.examples.get(kind, [])]}
+                for kind, n in sorted(self.counts.items())}
+
+    def log(self, what: str, level: int = logging.DEBUG) -> None:
+        """Log one line summing up the counts, if ``level`` is enabled."""
+        if self.counts and logger.isEnabledFor(level):
+            logger.log(level, "%s: %s", what, ", ".join(f"{n} {kind}" for kind, n in sorted(self.counts.items())))
@@ -1,11 +1,15 @@
 import math
-from dataclasses import dataclass
-from typing import Callable, Any, Optional, TypeVar
+import bisect
+from dataclasses import dataclass, field, astuple
+from typing import Callable, Any, Optional, TypeVar, Iterable, Union
 from collections import Counter
 import mido
-import logging
 from copy import copy, deepcopy
 
+from .diagnostics import (ParseDiagnostics, logger, OVERLAPPING_NOTE, DROPPED_NOTE, ORPHAN_NOTE_OFF,
+                          PROGRAM_CHANGE)
+from .progress import Progress, PARSE
+
 EPSILON = 1e-7
 
 
@@ -30,16 +34,16 @@ def sandwiched(a: float, b: float, c: float) -> bool:
     return float_lte(a, b) and float_lt(b, c)
 
 
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    )
-
 _DEFAULT_TICKS_PER_BEAT = 96
 _DEFAULT_BPM = 120
 _CO = TypeVar("_CO", bound="Copyable")
+_V = TypeVar("_V")
+_B = TypeVar("_B")
 
 
 class Copyable:
+    __slots__ = ()
+
     def copy(self: _CO, update: Optional[dict[str, Any]] = None, deep: bool = False) -> _CO:
         copy_of = deepcopy(self) if deep else copy(self)
         if update:
@@ -48,7 +52,66 @@ class Copyable:
         return copy_of
 
 
-@dataclass
+class DerivedDataCache:
+    """Caches data derived from some list or dict fields of a dataclass (``_watched_fields``),
+    such as a sorted copy or a maximum.
+
+    The cache is dropped when a watched field is reassigned, when a watched list changes
+    length or when an entry of a watched dict is replaced. Lists in ``_watched_by_value``
+    (short lists of dataclasses) are also compared item by item, so replacing or changing
+    one of their items in place is noticed too. Other lists are too long for that: changing
+    notes in place (like ``note.beat += 1``) is NOT noticed, so call ``invalidate_cache``
+    after doing that.
+    """
+    _watched_fields: tuple[str, ...] = ()
+    _watched_by_value: tuple[str, ...] = ()
+
+    def __setattr__(self, key: str, value: Any) -> None:
+        super().__setattr__(key, value)
+        if key in self._watched_fields:
+            self.__dict__.pop("_derived_cache", None)
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = dict(self.__dict__)
+        state.pop("_derived_cache", None)
+        return state
+
+    def _stamp(self) -> tuple[Any, ...]:
+        stamp: list[Any] = []
+        for f in self._watched_fields:
+            value = getattr(self, f)
+            if f in self._watched_by_value:
+                stamp.append((id(value), tuple(astuple(item) for item in value)))
+            elif isinstance(value, dict):
+                stamp.append((id(value), tuple((k, id(v)) for k, v in value.items())))
+            else:
+                stamp.append((id(value), len(value)))
+        return tuple(stamp)
+
+    def _cached(self, key: str, compute: Callable[[], _V]) -> _V:
+        stamp = self._stamp()
+        cache = self.__dict__.get("_derived_cache")
+        if cache is None or cache[0] != stamp:
+            cache = (stamp, {})
+            self.__dict__["_derived_cache"] = cache
+        if key not in cache[1]:
+            cache[1][key] = compute()
+        return cache[1][key]
+
+    def invalidate_cache(self) -> None:
+        self.__dict__.pop("_derived_cache", None)
+
+
+def is_sorted_by_beat(items: list[Any]) -> bool:
+    return all(items[i].beat <= items[i + 1].beat for i in range(len(items) - 1))
+
+
+def sorted_by_beat(items: list[_B]) -> list[_B]:
+    """items if it is already sorted by beat, else a sorted copy."""
+    return items if is_sorted_by_beat(items) else sorted(items, key=lambda s: s.beat)
+
+
+@dataclass(slots=True)
 class Note(Copyable):
     """FIELDS:
 
@@ -96,18 +159,37 @@ class TimeSignature(Copyable):
 
 
 @dataclass
-class Track(Copyable):
+class Track(DerivedDataCache, Copyable):
     """Fields:
 
     - notes: list[Note]
     - track_name: str
     """
+    _watched_fields = ("notes",)
 
     notes: list[Note]
     track_name: str
 
+    def sorted_notes(self) -> list[Note]:
+        """The notes, sorted by beat. Do not mutate."""
+        return self._cached("sorted_notes", lambda: sorted_by_beat(self.notes))
+
+    def sorted_beats(self) -> list[float]:
+        """The beat of every note in ``sorted_notes``."""
+        return self._cached("sorted_beats", lambda: [n.beat for n in self.sorted_notes()])
+
+    def channel_histogram(self) -> Counter[int]:
+        """How many notes use each channel. Do not mutate."""
+        return self._cached("channel_histogram", lambda: Counter(n.channel for n in self.notes))
+
+    def max_note_end(self) -> float:
+        """The beat the last note ends on, or -inf if there are no notes."""
+        return self._cached("max_note_end", lambda: max((n.beat + n.duration for n in self.notes),
+                                                        default=-math.inf))
+
     def clamp_notes(self) -> None:
         self.notes.sort(key=lambda s: s.beat)
+        self.invalidate_cache()
         previous_note_dict: dict[int, Note] = {}
         for i in range(len(self.notes)):
             cur_note = self.notes[i]
@@ -131,10 +213,12 @@ class Track(Copyable):
         """ -> """
         for note in self.notes:
             note.beat += beats
+        self.invalidate_cache()
 
     def scale(self, factor: float) -> None:
         for note in self.notes:
             note.beat *= factor
+        self.invalidate_cache()
 
     def slice_with_time_signature(self, b: float, e: float, time_sig: TimeSignature) -> "Track":
         """Return a copy of self with only notes that start in [b, e), and adjust according to time signature.
@@ -151,10 +235,130 @@ class Track(Copyable):
         of this track, or -1 if there is none."""
         if len(self.notes) == 0:
             return -1
-        channels = [n.channel for n in self.notes]
-        most_common, _ = Counter(channels).most_common(1)[0]
+        most_common, _ = self.channel_histogram().most_common(1)[0]
         return most_common
 
+    def view(self) -> "TrackView":
+        """A lazy view of every note of this track, see ``TrackView``."""
+        store = self.sorted_notes()
+        return TrackView(store=store, begin=0, end=len(store), track_name=self.track_name)
+
+
+@dataclass
+class TrackView(Copyable):
+    """A lazy version of a Track: the notes ``store[begin:end]``, with ``transform`` applied
+    to their beats. ``slice``, ``slice_with_time_signature``, ``offset`` and ``scale`` work like
+    they do on a Track, but only record what to do; notes are copied once, when ``notes``
+    is first read.
+
+    From then on the view holds its own notes and acts like a Track: they can be edited in
+    place or assigned, the methods above work on them and ``copy`` copies them.
+
+    ``store`` is shared between views, must be sorted by beat and must not be changed.
+    Notes come out in beat order.
+
+    FIELDS:
+
+    - store: list[Note]
+    - begin: int
+    - end: int
+    - track_name: str
+    - transform: tuple[tuple[str, float], ...]  # ("slice", b), ("scale", f) or ("offset", d), applied in order
+    """
+    store: list[Note]
+    begin: int
+    end: int
+    track_name: str
+    transform: tuple[tuple[str, float], ...] = ()
+    _notes: Optional[list[Note]] = field(default=None, repr=False, compare=False)
+
+    def map_beat(self, beat: float) -> float:
+        """Where a note of the store starting at ``beat`` ends up in this view"""
+        # same operations, in the same order, as the Track methods so results are identical
+        for op, value in self.transform:
+            if op == "slice":
+                beat = max(0.0, beat - value)
+            elif op == "scale":
+                beat *= value
+            else:
+                beat += value
+        return beat
+
+    def __len__(self) -> int:
+        return self.end - self.begin
+
+    @property
+    def notes(self) -> list[Note]:
+        if self._notes is None:
+            self._notes = [note.copy(update={"beat": self.map_beat(note.beat)})
+                           for note in self.store[self.begin:self.end]]
+        return self._notes
+
+    @notes.setter
+    def notes(self, notes: list[Note]) -> None:
+        self._notes = notes
+
+    def to_track(self) -> Track:
+        """A Track holding the same list of notes as self."""
+        return Track(notes=self.notes, track_name=self.track_name)
+
+    def copy(self, update: Optional[dict[str, Any]] = None, deep: bool = False) -> "TrackView":
+        """Like ``Copyable.copy``, but ``store`` is always shared and notes already read are
+        always copied, so the copy can be moved without moving self."""
+        copy_of = copy(self)
+        if self._notes is not None:
+            copy_of._notes = [note.copy() for note in self._notes]
+        if update:
+            for attr, value in update.items():
+                setattr(copy_of, attr, value)
+        return copy_of
+
+    def sorted_notes(self) -> list[Note]:
+        return self.to_track().sorted_notes()
+
+    def channel_histogram(self) -> Counter[int]:
+        return self.to_track().channel_histogram()
+
+    def max_note_end(self) -> float:
+        return self.to_track().max_note_end()
+
+    def clamp_notes(self) -> None:
+        self.to_track().clamp_notes()
+
+    def most_used_channel(self) -> int:
+        return self.to_track().most_used_channel()
+
+    def slice(self, b: float, e: float) -> "TrackView":
+        """Like ``Track.slice``"""
+        if self._notes is not None:
+            return Track(notes=[note.copy() for note in self._notes], track_name=self.track_name).view().slice(b, e)
+        begin = bisect.bisect_left(self.store, True, self.begin, self.end,
+                                   key=lambda n: float_lte(b, self.map_beat(n.beat)))
+        end = bisect.bisect_left(self.store, True, begin, self.end,
+                                 key=lambda n: not float_lt(self.map_beat(n.beat), e))
+        return TrackView(store=self.store, begin=begin, end=end, track_name=self.track_name,
+                         transform=self.transform + (("slice", b),))
+
+    def slice_with_time_signature(self, b: float, e: float, time_sig: TimeSignature) -> "TrackView":
+        """Like ``Track.slice_with_time_signature``"""
+        sliced = self.slice(b, e)
+        sliced.transform += (("scale", time_sig.get_absolute_tempo_squish_factor()),)
+        return sliced
+
+    def offset(self, beats: float) -> None:
+        if self._notes is not None:
+            self.to_track().offset(beats)
+        else:
+            self.transform += (("offset", beats),)
+
+    def scale(self, factor: float) -> None:
+        if self._notes is not None:
+            self.to_track().scale(factor)
+        elif factor < 0:
+            raise ValueError("Views can only be scaled by non-negative factors")
+        else:
+            self.transform += (("scale", factor),)
+
 
 @dataclass
 class TempoChange(Copyable):
@@ -189,12 +393,12 @@ class MidiEvent(Copyable):
 class Bar(Copyable):
     """FIELDS:
 
-    - tracks: dict[int, Track]
+    - tracks: dict[int, Track | TrackView]
     - time_signature: TimeSignature
     - tempo_changes: list[TempoChange]
     - starting_tempo: float
     """
-    tracks: dict[int, Track]
+    tracks: dict[int, Union[Track, TrackView]]
     time_signature: TimeSignature
     tempo_changes: list[TempoChange]
     starting_tempo: float
@@ -204,6 +408,129 @@ def generate_4_4_time_sig() -> TimeSignature:
     return TimeSignature(numerator=4, denominator=4, beat=0)
 
 
+@dataclass
+class TimeSignatureRun:
+    """FIELDS:
+
+    - first_bar: int
+    - bar_count: int
+    - time_signature: TimeSignature  # of every bar in the run
+    """
+    first_bar: int
+    bar_count: int
+    time_signature: TimeSignature
+
+
+@dataclass
+class BarGrid:
+    """Where every bar starts, how long it is and its time signature, walked once and then
+    searched with bisect. Build one with ``for_bars`` (the bars of ``generate_bars``) or
+    ``for_chart_sections`` (the sections of a chart), or get the cached one from
+    ``MidiRepresentation.bar_grid`` / ``chart_section_grid``. Do not mutate.
+
+    FIELDS:
+
+    - starts: list[float]  # beat each bar starts on
+    - lengths: list[float]  # beats in each bar
+    - runs: list[TimeSignatureRun]  # bars in a row sharing a time signature
+    - starts_ms: list[float]  # when each bar starts, sorted. Empty unless built with beat_to_ms
+    """
+    starts: list[float]
+    lengths: list[float]
+    runs: list[TimeSignatureRun]
+    starts_ms: list[float] = field(default_factory=list)
+
+    @classmethod
+    def for_bars(cls, time_signatures: list[TimeSignature], song_length: float) -> "BarGrid":
+        """Bars as ``generate_bars`` cuts them, up to ``song_length``. ``time_signatures`` must be
+        sorted. A bar lasts ``get_absolute_bar_length`` beats, and a time signature starts at
+        the first bar starting on or after its beat, rounded."""
+        if not time_signatures:
+            time_signatures = [generate_4_4_time_sig()]
+        grid = cls(starts=[], lengths=[], runs=[])
+        time_sig_index = 0
+        b: float = 0
+        while float_lt(b, song_length):
+            # nudge the time_sig_index forward
+            while (time_sig_index < len(time_signatures) - 1 and
+                   # b >= round(time_signatures[time_sig_index + 1].beat)
+                   float_gte(b, round(time_signatures[time_sig_index + 1].beat))):
+                time_sig_index += 1
+            length = time_signatures[time_sig_index].get_absolute_bar_length()
+            grid._append(b, length, time_signatures[time_sig_index])
+            b = b + length
+        return grid
+
+    @classmethod
+    def for_chart_sections(cls, time_signatures: list[TimeSignature], song_length: float,
+                           beat_to_ms: Optional[Callable[[float], float]] = None) -> "BarGrid":
+        """Sections of a chart, as ``chart_gen.generate_sections`` makes them. A section lasts
+        ``numerator`` beats, except that one is cut short where the next time signature
+        starts (not rounded), and the first one is always given 4 beats. There is one more
+        section than needed to reach ``song_length``. If ``beat_to_ms`` is given,
+        ``starts_ms`` is filled with it."""
+        tc_changes = time_signatures or [TimeSignature(4, 4, 0)]
+        current_tc: int = 0
+        current_beat: float = 0.0
+
+        grid = cls(starts=[], lengths=[], runs=[])
+        grid._append(0, 4, tc_changes[0])
+        while current_beat <= song_length:
+            next_candidate_1 = current_beat + tc_changes[current_tc].numerator
+            next_candidate_2 = math.inf
+            target_tc = tc_changes[current_tc]
+            if (current_tc + 1) in range(0, len(tc_changes)):
+                next_candidate_2 = tc_changes[current_tc + 1].beat
+
+            next_beat = min(next_candidate_1, next_candidate_2)
+            if next_candidate_2 <= next_candidate_1:
+                target_tc = tc_changes[current_tc + 1]
+                current_tc += 1
+                grid.lengths[-1] = next_beat - current_beat
+
+            grid._append(next_beat, target_tc.numerator, target_tc)
+            current_beat = next_beat
+        if beat_to_ms is not None:
+            grid.starts_ms = sorted([beat_to_ms(s) for s in grid.starts])
+        return grid
+
+    def _append(self, start: float, length: float, time_signature: TimeSignature) -> None:
+        if self.runs and self.runs[-1].time_signature is time_signature:
+            self.runs[-1].bar_count += 1
+        else:
+            self.runs.append(TimeSignatureRun(first_bar=len(self.starts), bar_count=1,
+                                              time_signature=time_signature))
+        self.starts.append(start)
+        self.lengths.append(length)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def time_signature(self, bar: int) -> TimeSignature:
+        run = bisect.bisect_right(self.runs, bar, key=lambda r: r.first_bar) - 1
+        return self.runs[run].time_signature
+
+    def bar_at_beat(self, beat: float) -> int:
+        """Index of the last bar starting at or before ``beat``, or -1 if there is none."""
+        return bisect.bisect_right(self.starts, beat + EPSILON) - 1
+
+    def bar_at_ms(self, time_ms: float) -> int:
+        """Like ``bar_at_beat``, searching ``starts_ms``."""
+        return bisect.bisect_right(self.starts_ms, time_ms + EPSILON) - 1
+
+    def bars_at_ms(self, times_ms: list[float]) -> list[int]:
+        """``bar_at_ms`` of every time, found with a single sweep over the times in order."""
+        bars = [-1 for _ in times_ms]
+        starts = self.starts_ms
+        bar = -1
+        for i in sorted(range(len(times_ms)), key=times_ms.__getitem__):
+            limit = times_ms[i] + EPSILON
+            while bar + 1 < len(starts) and starts[bar + 1] <= limit:
+                bar += 1
+            bars[i] = bar
+        return bars
+
+
 @dataclass
 class BarMidiRepresentation(Copyable):
     """A variant of MidiRepresentation that splits all notes into their own
@@ -227,7 +554,7 @@ class BarMidiRepresentation(Copyable):
         last_absolute_beat = 0.0
         for b in self.bars:
             for i, track in b.tracks.items():
-                track2 = track.copy(deep=True)
+                track2 = track.copy() if isinstance(track, TrackView) else track.copy(deep=True)
                 track2.scale(1 / b.time_signature.get_absolute_tempo_squish_factor())
                 track2.offset(last_absolute_beat)
                 if i not in aggregate_tracks:
@@ -259,19 +586,114 @@ def generate_bar_midi_representation(mr: "MidiRepresentation") -> BarMidiReprese
 
 
 @dataclass
-class MidiRepresentation(Copyable):
+class MidiRepresentation(DerivedDataCache, Copyable):
     """FIELDS:
 
     - tracks: dict[int, Track]  # maps track numbers to track names
     - channel_instrument_map: dict[int, int]
     - bpm_changes: list[TempoChange]
     - time_signature_changes: list[TimeSignature]
+
+    Sorted tempo changes, time signatures and song bounds are cached; see
+    ``DerivedDataCache``. ``invalidate_cache`` also clears the cache of every track.
+
+    ``snapshot`` makes cheap copy-on-write copies. After taking one, get whatever you are
+    about to change through ``edit_track``, ``edit_bpm_changes`` or
+    ``edit_time_signature_changes``, which copy it the first time if it is shared.
     """
+    _watched_fields = ("tracks", "bpm_changes", "time_signature_changes")
+    _watched_by_value = ("bpm_changes", "time_signature_changes")
+
     tracks: dict[int, Track]  # maps track numbers to track names
     channel_instrument_map: dict[int, int]
     bpm_changes: list[TempoChange]
     time_signature_changes: list[TimeSignature]
 
+    def invalidate_cache(self) -> None:
+        super().invalidate_cache()
+        for track in self.tracks.values():
+            track.invalidate_cache()
+
+    def sorted_bpm_changes(self) -> list[TempoChange]:
+        """``bpm_changes`` sorted by beat. Do not mutate."""
+        return self._cached("sorted_bpm_changes", lambda: sorted_by_beat(self.bpm_changes))
+
+    def sorted_time_signature_changes(self) -> list[TimeSignature]:
+        """``time_signature_changes`` sorted by beat. Do not mutate."""
+        return self._cached("sorted_time_signature_changes",
+                            lambda: sorted_by_beat(self.time_signature_changes))
+
+    def max_note_end(self) -> float:
+        """The beat the last note of any track ends on, or -inf if there are no notes.
+        Cached per track: call ``invalidate_cache`` after moving notes in place."""
+        return max((t.max_note_end() for t in self.tracks.values()), default=-math.inf)
+
+    def bar_grid(self) -> BarGrid:
+        """The bars ``generate_bars`` makes (see ``BarGrid.for_bars``), cached. Do not mutate.
+        Moving notes in place is not noticed, call ``invalidate_cache`` after doing that."""
+        song_length_safe = self.get_song_length() + 1  # adding 1 to prevent issues
+        return self._cached(f"bar_grid {song_length_safe}",
+                            lambda: BarGrid.for_bars(self.sorted_time_signature_changes(), song_length_safe))
+
+    def chart_section_grid(self, song_length: int, beat_to_ms: Callable[[float], float]) -> BarGrid:
+        """The sections of a chart ``song_length`` beats long (see ``BarGrid.for_chart_sections``),
+        cached. ``beat_to_ms`` must only depend on ``bpm_changes``. Do not mutate."""
+        return self._cached(f"chart_section_grid {song_length}",
+                            lambda: BarGrid.for_chart_sections(self.time_signature_changes, song_length, beat_to_ms))
+
+    def _shared(self) -> frozenset[Union[int, str]]:
+        # track numbers and field names that may be shared with a snapshot
+        return self.__dict__.get("_cow_shared", frozenset())
+
+    def _set_shared(self, shared: frozenset[Union[int, str]]) -> None:
+        self.__dict__["_cow_shared"] = shared
+
+    def snapshot(self) -> "MidiRepresentation":
+        """A copy that shares every track, tempo change and time signature with self.
+        Only the dicts holding them are copied. From now on, both self and the snapshot
+        must only be changed through the ``edit_*`` methods (or by assigning new objects).
+        """
+        shared = frozenset(self.tracks) | {"bpm_changes", "time_signature_changes"}
+        snap = MidiRepresentation(
+            tracks=dict(self.tracks),
+            channel_instrument_map=dict(self.channel_instrument_map),
+            bpm_changes=self.bpm_changes,
+            time_signature_changes=self.time_signature_changes
+        )
+        self._set_shared(shared)
+        snap._set_shared(shared)
+        return snap
+
+    def restore(self, snapshot: "MidiRepresentation") -> None:
+        """Make self the same as ``snapshot`` again, still sharing with it."""
+        snap = snapshot.snapshot()
+        self.tracks = snap.tracks
+        self.channel_instrument_map = snap.channel_instrument_map
+        self.bpm_changes = snap.bpm_changes
+        self.time_signature_changes = snap.time_signature_changes
+        self._set_shared(snap._shared())
+
+    def edit_track(self, track_no: int) -> Track:
+        """Track ``track_no``, copied first if it is shared with a snapshot, so it can be changed."""
+        if track_no in self._shared():
+            self.tracks[track_no] = self.tracks[track_no].copy(deep=True)
+            self._set_shared(self._shared() - {track_no})
+        return self.tracks[track_no]
+
+    def edit_bpm_changes(self) -> list[TempoChange]:
+        """``bpm_changes``, copied first if it is shared with a snapshot, so it can be changed."""
+        if "bpm_changes" in self._shared():
+            self.bpm_changes = [tc.copy() for tc in self.bpm_changes]
+            self._set_shared(self._shared() - {"bpm_changes"})
+        return self.bpm_changes
+
+    def edit_time_signature_changes(self) -> list[TimeSignature]:
+        """``time_signature_changes``, copied first if it is shared with a snapshot, so it can be changed."""
+        if "time_signature_changes" in self._shared():
+            self.time_signature_changes = [ts.copy() for ts in self.time_signature_changes]
+            self._set_shared(self._shared() - {"time_signature_changes"})
+        return self.time_signature_changes
+
     def clear_empty_tracks(self) -> None:
         to_pop: list[int] = []
         for i, track in self.tracks.items():
@@ -281,12 +703,12 @@ class MidiRepresentation(Copyable):
             self.tracks.pop(i)
 
     def get_song_length(self) -> int:
-        """Get the length of the track in beats, rounded up."""
-        highest_beat = 0
-        for v in self.tracks.values():
-            for n in v.notes:
-                highest_beat = max(highest_beat, math.ceil(n.beat + n.duration))
-        return highest_beat
+        """Get the length of the track in beats, rounded up, or 0 if there are no notes.
+        Cached: call ``invalidate_cache`` after moving notes in place."""
+        end = self.max_note_end()
+        if end == -math.inf:
+            return 0
+        return max(0, math.ceil(end))
 
     def generate_bars(self) -> list[Bar]:
         """Some assumptions about our MIDI:
@@ -299,44 +721,41 @@ class MidiRepresentation(Copyable):
         takes effect.
 
         No floating point operations are done to check time signature bounds apart from rounding.
+
+        The tracks of each bar are ``TrackView``s, so notes are only copied when they are read.
+        Notes read from them can be edited, and ``BarMidiRepresentation.to_regular_midi_representation``
+        keeps the edits.
         """
-        local_tempo_changes = sorted(self.bpm_changes, key=lambda s: s.beat)
+        local_tempo_changes = self.sorted_bpm_changes()
         tempos_as_beats = [t.beat for t in local_tempo_changes]
-        time_sig_changes = sorted(self.time_signature_changes, key=lambda s: s.beat)
-        if not time_sig_changes:
-            time_sig_changes = [generate_4_4_time_sig()]
+        grid = self.bar_grid()
         bars: list[Bar] = []
-        song_length_safe = self.get_song_length() + 1  # adding 1 to prevent issues
 
-        time_sig_index = 0
-        b: float = 0
+        track_views = {i: v.view() for i, v in self.tracks.items()}
 
         current_tempo: float = local_tempo_changes[0].new_bpm if local_tempo_changes == [] else 120
 
-        while float_lt(b, song_length_safe):
-            # nudge the time_sig_index forward
-            while (time_sig_index < len(time_sig_changes) - 1 and
-                   # b >= round(time_sig_changes[time_sig_index + 1].beat)
-                   float_gte(b, round(time_sig_changes[time_sig_index + 1].beat))):
-                time_sig_index += 1
-            e = b + time_sig_changes[time_sig_index].get_absolute_bar_length()
-            new_tracks: dict[int, Track] = {
-                i: v.slice_with_time_signature(b, e, time_sig_changes[time_sig_index]) for i, v in self.tracks.items()
-            }
-            tempo_changes: list[TempoChange] = []
-            first_tempo, last_tempo = clamp_sorted(tempos_as_beats, b, e)
-            for i in range(first_tempo, last_tempo):
-                new_tempo_change = local_tempo_changes[i].copy(
-                    update={"beat": max(0.0, local_tempo_changes[i].beat - b) * time_sig_changes[
-                        time_sig_index].get_absolute_tempo_squish_factor()}, deep=True)
-                tempo_changes.append(new_tempo_change)
-
-            new_bar = Bar(tracks=new_tracks, time_signature=time_sig_changes[time_sig_index],
-                          tempo_changes=tempo_changes, starting_tempo=current_tempo)
-            bars.append(new_bar)
-            if tempo_changes:
-                current_tempo = tempo_changes[-1].new_bpm
-            b = e
+        for run in grid.runs:
+            time_sig = run.time_signature
+            for bar in range(run.first_bar, run.first_bar + run.bar_count):
+                b = grid.starts[bar]
+                e = b + grid.lengths[bar]
+                new_tracks: dict[int, Union[Track, TrackView]] = {
+                    i: v.slice_with_time_signature(b, e, time_sig) for i, v in track_views.items()
+                }
+                tempo_changes: list[TempoChange] = []
+                first_tempo, last_tempo = clamp_sorted(tempos_as_beats, b, e)
+                for i in range(first_tempo, last_tempo):
+                    new_tempo_change = local_tempo_changes[i].copy(
+                        update={"beat": max(0.0, local_tempo_changes[i].beat - b) *
+                                time_sig.get_absolute_tempo_squish_factor()}, deep=True)
+                    tempo_changes.append(new_tempo_change)
+
+                new_bar = Bar(tracks=new_tracks, time_signature=time_sig,
+                              tempo_changes=tempo_changes, starting_tempo=current_tempo)
+                bars.append(new_bar)
+                if tempo_changes:
+                    current_tempo = tempo_changes[-1].new_bpm
         return bars
 
     def get_starting_bpm(self) -> float:
@@ -381,7 +800,8 @@ def clamp_sorted(li: list[float], a: float, b: float) -> tuple[int, int]:
     return p, q
 
 
-def representation_to_midi_file(midi_representation: MidiRepresentation) -> mido.MidiFile:
+def representation_to_midi_file(midi_representation: MidiRepresentation,
+                                ticks_per_beat: int = _DEFAULT_TICKS_PER_BEAT) -> mido.MidiFile:
     """Convert a MidiRepresentation instance to a mido.MidiFile instance that can be
     exported to a new Midi file.
     NOTHING IN midi_representation NEEDS TO BE SORTED
@@ -391,7 +811,6 @@ def representation_to_midi_file(midi_representation: MidiRepresentation) -> mido
     #     t.clamp_notes()
 
     midi_file = mido.MidiFile()
-    ticks_per_beat = _DEFAULT_TICKS_PER_BEAT
     midi_file.ticks_per_beat = ticks_per_beat
 
     # TEMPO TRACK START
@@ -400,7 +819,7 @@ def representation_to_midi_file(midi_representation: MidiRepresentation) -> mido
     tempo_track.append(tempo_track_name_message)
 
     accumulated_ticks = 0
-    for bpm_change in sorted(midi_representation.bpm_changes, key=lambda s: s.beat):
+    for bpm_change in midi_representation.sorted_bpm_changes():
         tempo_in_microseconds = int(60000000 / bpm_change.new_bpm)
         accumulated_ticks += int(bpm_change.beat * ticks_per_beat)
         tempo_message = mido.MetaMessage('set_tempo', tempo=tempo_in_microseconds, time=accumulated_ticks)
@@ -428,8 +847,7 @@ def representation_to_midi_file(midi_representation: MidiRepresentation) -> mido
                                                      program=track_instrument)
                 midi_track.append(track_channel_message)
 
-        sorted_notes = sorted(track.notes, key=lambda s: s.beat)
-        for note in sorted_notes:
+        for note in track.sorted_notes():
             midi_events.append(MidiEvent(note=note, event_time=note.beat, on=True))
             midi_events.append(MidiEvent(note=note, event_time=note.beat + note.duration, on=False))
         midi_events.sort(key=lambda t: t.event_time)
@@ -448,59 +866,48 @@ def representation_to_midi_file(midi_representation: MidiRepresentation) -> mido
     return midi_file
 
 
-def midi_to_representation(midi_file: mido.MidiFile) -> MidiRepresentation:
+def representation_to_midi_file_with_conductor(midi_representation: MidiRepresentation,
+                                               ticks_per_beat: int = _DEFAULT_TICKS_PER_BEAT) -> mido.MidiFile:
+    """``representation_to_midi_file``, with its tempo track swapped for one that also has the
+    time signatures (which it does not write) and puts every tempo change on its own tick."""
+    midi_file = representation_to_midi_file(midi_representation, ticks_per_beat)
+    events = [(round(tc.beat * ticks_per_beat), mido.MetaMessage('set_tempo', tempo=int(60000000 / tc.new_bpm)))
+              for tc in midi_representation.bpm_changes]
+    events += [(round(ts.beat * ticks_per_beat), mido.MetaMessage('time_signature', numerator=ts.numerator,
+                                                                  denominator=ts.denominator))
+               for ts in midi_representation.time_signature_changes]
+    events.sort(key=lambda e: e[0])
+    conductor = mido.MidiTrack([mido.MetaMessage('track_name', name="Tempo changes")])
+    last_tick = 0
+    for tick, message in events:
+        conductor.append(message.copy(time=tick - last_tick))
+        last_tick = tick
+    midi_file.tracks[0] = conductor
+    return midi_file
+
+
+def midi_to_representation(midi_file: mido.MidiFile,
+                           diagnostics: Optional[ParseDiagnostics] = None,
+                           progress: Optional[Progress] = None) -> MidiRepresentation:
     """Create a MidiRepresentation instance from midi_file.
+    Anything odd found on the way is counted in ``diagnostics``, if given.
+    Messages read are reported to ``progress`` as the ``parse`` stage.
     """
+    if diagnostics is None:
+        diagnostics = ParseDiagnostics()
+    if progress is None:
+        progress = Progress()
+    progress.start(PARSE, sum(len(track) for track in midi_file.tracks))
     tracks = {}
-    channel_ins_mapping = _get_channel_to_instrument_mapping(midi_file)
+    channel_ins_mapping = _get_channel_to_instrument_mapping(midi_file, diagnostics)
     track_names: dict[int, str] = _get_track_names(midi_file)
+    done = 0
     for i, track in enumerate(midi_file.tracks):
-        notes: list[Note] = []
-        accumulated_time = 0
-        # [PITCH, CHANNEL]
-        note_look_behind: dict[tuple[int, int], Note] = {}
-        for msg in track:
-
-            accumulated_time += msg.time
-
-            if msg.type == 'note_on':
-                beat = accumulated_time / midi_file.ticks_per_beat
-                note = Note(
-                    channel=msg.channel,
-                    note=msg.note,
-                    velocity=msg.velocity,
-                    beat=beat,
-                    duration=0
-                )
-                notes.append(note)
-
-                behind_note = note_look_behind.pop((msg.note, msg.channel), None)
-                if behind_note is not None:
-                    logging.debug("Correcting behind note")
-                    behind_note_dur = beat - behind_note.beat
-                    if behind_note_dur <= 0:
-                        for k, cur_note in enumerate(notes):
-                            if cur_note is behind_note:
-                                notes.pop(k)
-                                break
-                        else:  # no break
-                            logging.error("Should never get here.")
-                            assert False
-                    else:
-                        behind_note.duration = behind_note_dur
-                note_look_behind[(msg.note, msg.channel)] = note
-
-            elif msg.type == 'note_off':
-                fetched_note = note_look_behind.pop((msg.note, msg.channel), None)
-                if fetched_note is not None:
-                    assert (fetched_note.duration == 0)
-                    beat = accumulated_time / midi_file.ticks_per_beat
-                    duration = beat - fetched_note.beat
-                    fetched_note.duration = max(0, duration)
-                else:
-                    logging.debug("note_off has no corresponding note_on; ignoring.")
+        notes = _track_to_notes(track, midi_file.ticks_per_beat, diagnostics, progress, done)
+        done += len(track)
         track_name = track_names.get(i, "")
         tracks[i] = Track(notes=notes, track_name=track_name)
+    progress.finish()
 
     midi_representation = MidiRepresentation(
         tracks=tracks,
@@ -510,23 +917,100 @@ def midi_to_representation(midi_file: mido.MidiFile) -> MidiRepresentation:
     )
 
     midi_representation.clear_empty_tracks()
+    diagnostics.log("Parsed MIDI")
 
     return midi_representation
 
 
+def midi_to_representation_with_diagnostics(
+        midi_file: mido.MidiFile) -> tuple[MidiRepresentation, ParseDiagnostics]:
+    """``midi_to_representation``, also returning what was counted while parsing."""
+    diagnostics = ParseDiagnostics()
+    return midi_to_representation(midi_file, diagnostics), diagnostics
+
+
+def _track_to_notes(track: Iterable[mido.Message], ticks_per_beat: int,
+                    diagnostics: Optional[ParseDiagnostics] = None,
+                    progress: Optional[Progress] = None, done_before: int = 0) -> list[Note]:
+    """Pair up the note_on and note_off messages of one track into notes.
+    Messages are reported to ``progress`` counting on from ``done_before``."""
+    if diagnostics is None:
+        diagnostics = ParseDiagnostics()
+    notes: list[Note] = []
+    accumulated_time = 0
+    # [PITCH, CHANNEL]
+    note_look_behind: dict[tuple[int, int], Note] = {}
+    for k, msg in enumerate(track, done_before):
+        if progress is not None:
+            progress.update(k)
+
+        accumulated_time += msg.time
+
+        if msg.type == 'note_on':
+            beat = accumulated_time / ticks_per_beat
+            note = Note(
+                channel=msg.channel,
+                note=msg.note,
+                velocity=msg.velocity,
+                beat=beat,
+                duration=0
+            )
+            notes.append(note)
+
+            behind_note = note_look_behind.pop((msg.note, msg.channel), None)
+            if behind_note is not None:
+                diagnostics.record(OVERLAPPING_NOTE, "note %d channel %d at beat %s",
+                                   msg.note, msg.channel, beat)
+                behind_note_dur = beat - behind_note.beat
+                if behind_note_dur <= 0:
+                    diagnostics.record(DROPPED_NOTE, "note %d channel %d at beat %s",
+                                       msg.note, msg.channel, beat)
+                    for note_idx, cur_note in enumerate(notes):
+                        if cur_note is behind_note:
+                            notes.pop(note_idx)
+                            break
+                    else:  # no break
+                        logger.error("Should never get here.")
+                        assert False
+                else:
+                    behind_note.duration = behind_note_dur
+            note_look_behind[(msg.note, msg.channel)] = note
+
+        elif msg.type == 'note_off':
+            fetched_note = note_look_behind.pop((msg.note, msg.channel), None)
+            if fetched_note is not None:
+                assert (fetched_note.duration == 0)
+                beat = accumulated_time / ticks_per_beat
+                duration = beat - fetched_note.beat
+                fetched_note.duration = max(0, duration)
+            else:
+                diagnostics.record(ORPHAN_NOTE_OFF, "note %d channel %d at tick %d",
+                                   msg.note, msg.channel, accumulated_time)
+    return notes
+
+
 def _get_tempo_changes(midi: mido.MidiFile) -> list[TempoChange]:
     """Return a list of tempo changes in this midi.
     """
-    tempo_changes: list[TempoChange] = []
+    tempo_events: list[tuple[int, int]] = []
     total_time = 0
     for track in midi.tracks:
         for msg in track:
             total_time += msg.time
             if msg.type == 'set_tempo':
-                bpm = mido.tempo2bpm(msg.tempo)
-                beats = augment_total_time(total_time) / midi.ticks_per_beat
-                if not any(c.beat == beats and c.new_bpm == bpm for c in tempo_changes):
-                    tempo_changes.append(TempoChange(new_bpm=bpm, beat=beats))
+                tempo_events.append((total_time, msg.tempo))
+    return _tempo_changes_from_events(tempo_events, midi.ticks_per_beat)
+
+
+def _tempo_changes_from_events(tempo_events: Iterable[tuple[int, int]], ticks_per_beat: int) -> list[TempoChange]:
+    """tempo_events are (total time, tempo) of every set_tempo message, in file order.
+    Note that the total time keeps running across tracks."""
+    tempo_changes: list[TempoChange] = []
+    for total_time, tempo in tempo_events:
+        bpm = mido.tempo2bpm(tempo)
+        beats = augment_total_time(total_time) / ticks_per_beat
+        if not any(c.beat == beats and c.new_bpm == bpm for c in tempo_changes):
+            tempo_changes.append(TempoChange(new_bpm=bpm, beat=beats))
     tempo_changes.sort(key=lambda s: s.beat)
 
     # duplicate remover
@@ -547,16 +1031,22 @@ def augment_total_time(tt: int) -> int:
 
 
 def _get_time_signature(midi: mido.MidiFile) -> list[TimeSignature]:
-    time_signature_changes: list[TimeSignature] = []
+    time_signature_events: list[tuple[int, int, int]] = []
     total_time = 0
     for track in midi.tracks:
         for msg in track:
             total_time += msg.time
             if msg.type == 'time_signature':
-                beats = total_time / midi.ticks_per_beat
-                time_signature_changes.append(TimeSignature(numerator=msg.numerator, denominator=msg.denominator,
-                                                            beat=beats))
-    return time_signature_changes
+                time_signature_events.append((total_time, msg.numerator, msg.denominator))
+    return _time_signatures_from_events(time_signature_events, midi.ticks_per_beat)
+
+
+def _time_signatures_from_events(time_signature_events: Iterable[tuple[int, int, int]],
+                                 ticks_per_beat: int) -> list[TimeSignature]:
+    """time_signature_events are (total time, numerator, denominator) of every time_signature
+    message, in file order."""
+    return [TimeSignature(numerator=numerator, denominator=denominator, beat=total_time / ticks_per_beat)
+            for total_time, numerator, denominator in time_signature_events]
 
     # for msg in midi:
     #     if msg.type == 'time_signature':
@@ -575,31 +1065,62 @@ def _get_track_names(midi: mido.MidiFile) -> dict[int, str]:
     return track_names
 
 
-def _get_channel_to_instrument_mapping(midi: mido.MidiFile) -> dict[int, int]:
+def _get_channel_to_instrument_mapping(midi: mido.MidiFile,
+                                       diagnostics: Optional[ParseDiagnostics] = None) -> dict[int, int]:
     """The key of the returned dict is the channel number; the value is the instrument number."""
+    if diagnostics is None:
+        diagnostics = ParseDiagnostics()
     channel_to_instrument = {}
     for ti, track in enumerate(midi.tracks):
         for i, msg in enumerate(track):
             if msg.type == 'program_change':
-                logging.debug(f"Program change in track {ti} message count {i}: {msg.channel} -> {msg.program}")
+                diagnostics.record(PROGRAM_CHANGE, "track %d message count %d: %d -> %d",
+                                   ti, i, msg.channel, msg.program)
                 channel_to_instrument[msg.channel] = msg.program
     return channel_to_instrument
 
 
-def process_and_save_midi(md_path: str, md_opt: str, fn: Callable[[MidiRepresentation], None]) -> None:
+def load_midi(md_path: str, use_cache: bool = False) -> MidiRepresentation:
+    """Load the midi file with md_path. If use_cache, go through its .mrep cache
+    (see ``midi_processing.mrep``), creating or refreshing it if needed."""
+    if use_cache:
+        from .mrep import load_midi_cached  # mrep imports this module
+        return load_midi_cached(md_path)
+    return midi_to_representation(mido.MidiFile(md_path))
+
+
+def process_and_save_midi(md_path: str, md_opt: str, fn: Callable[[MidiRepresentation], None],
+                          use_cache: bool = False) -> None:
     """Process the midi file with md_path using fn, then exports it with name md_out"""
-    midi_file = mido.MidiFile(md_path)
-    midi_representation = midi_to_representation(midi_file)
+    midi_representation = load_midi(md_path, use_cache)
     fn(midi_representation)
+    midi_representation.invalidate_cache()  # fn may have moved notes around
     midi_file_2 = representation_to_midi_file(midi_representation)
     midi_file_2.save(md_opt)
 
 
 def process_and_save_midi_mut(md_path: str, md_opt: str,
-                              fn: Callable[[MidiRepresentation], MidiRepresentation]) -> None:
+                              fn: Callable[[MidiRepresentation], MidiRepresentation],
+                              use_cache: bool = False) -> None:
     """Process the midi file with md_path using fn, then exports it with name md_out"""
-    midi_file = mido.MidiFile(md_path)
-    midi_representation = midi_to_representation(midi_file)
+    midi_representation = load_midi(md_path, use_cache)
     midi_representation_2 = fn(midi_representation)
+    midi_representation_2.invalidate_cache()  # fn may have moved notes around
     midi_file_2 = representation_to_midi_file(midi_representation_2)
     midi_file_2.save(md_opt)
+
+
+def process_and_save_midi_variants(md_path: str, variants: dict[str, Callable[[MidiRepresentation], None]],
+                                   use_cache: bool = False) -> None:
+    """Load the midi file with md_path once, then for every ``md_opt: fn`` in variants,
+    process a snapshot of it using fn and export that with name md_opt.
+
+    Snapshots share the notes they don't change, so fn must get tracks through
+    ``MidiRepresentation.edit_track`` (and friends) before changing them.
+    """
+    original = load_midi(md_path, use_cache)
+    for md_opt, fn in variants.items():
+        variant = original.snapshot()
+        fn(variant)
+        variant.invalidate_cache()
+        representation_to_midi_file(variant).save(md_opt)
@@ -0,0 +1,189 @@
+"""A compact binary cache for ``MidiRepresentation`` (``.mrep`` files), so the same MIDI
+does not have to be parsed through mido over and over.
+
+Layout (all little endian), each table starting where the previous one ends:
+
+- header: ``MREP_HEADER``
+- string table: ``n_strings + 1`` u32 offsets into the string blob, then the UTF-8 blob,
+  padded to 8 bytes. Track names are stored here
+- tracks: ``TRACK_RECORD`` per track (track number, name string index, first note, note count)
+- tempo changes: ``TEMPO_RECORD`` per tempo change (beat, bpm)
+- time signatures: ``TIME_SIGNATURE_RECORD`` per time signature (numerator, denominator, beat)
+- channel to instrument map: ``CHANNEL_RECORD`` per channel (channel, program)
+- notes: ``NOTE_RECORD`` per note (beat, duration, channel, note, velocity), grouped by track
+
+The header records the size and mtime of the MIDI it was made from so stale caches are
+detected. Files are memory mapped and the records are unpacked straight from the mapping.
+"""
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Union
+
+import mido
+
+from .midi_processor import MidiRepresentation, Track, Note, TempoChange, TimeSignature, midi_to_representation
+
+MREP_MAGIC = b"MREP"
+MREP_VERSION = 1
+# magic, version, flags, source mtime_ns, source size, tracks, tempo changes, time signatures,
+# channel map entries, strings, notes
+MREP_HEADER = struct.Struct("<4sHHqqIIIIII")
+TRACK_RECORD = struct.Struct("<iIII")
+TEMPO_RECORD = struct.Struct("<dd")
+TIME_SIGNATURE_RECORD = struct.Struct("<iid")
+CHANNEL_RECORD = struct.Struct("<ii")
+NOTE_RECORD = struct.Struct("<ddBBBxxxxx")
+
+_PathLike = Union[str, "os.PathLike[str]"]
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def representation_to_mrep_bytes(midi_rep: MidiRepresentation, source_mtime_ns: int = 0,
+                                 source_size: int = -1) -> bytes:
+    """Serialize ``midi_rep``. ``source_mtime_ns`` and ``source_size`` describe the MIDI the
+    representation came from, -1 meaning unknown."""
+    track_items = sorted(midi_rep.tracks.items(), key=lambda p: p[0])
+    names = [t.track_name.encode("UTF-8") for _, t in track_items]
+    n_notes = sum(len(t.notes) for _, t in track_items)
+
+    string_offsets = [0]
+    for name in names:
+        string_offsets.append(string_offsets[-1] + len(name))
+    blob = b"".join(names)
+    string_table = struct.pack(f"<{len(string_offsets)}I", *string_offsets) + blob
+    string_table += b"\0" * (_pad8(len(string_table)) - len(string_table))
+
+    chunks = [
+        MREP_HEADER.pack(MREP_MAGIC, MREP_VERSION, 0, source_mtime_ns, source_size, len(track_items),
+                         len(midi_rep.bpm_changes), len(midi_rep.time_signature_changes),
+                         len(midi_rep.channel_instrument_map), len(names), n_notes),
+        string_table
+    ]
+    first_note = 0
+    for i, (track_no, track) in enumerate(track_items):
+        chunks.append(TRACK_RECORD.pack(track_no, i, first_note, len(track.notes)))
+        first_note += len(track.notes)
+    chunks.extend(TEMPO_RECORD.pack(tc.beat, tc.new_bpm) for tc in midi_rep.bpm_changes)
+    chunks.extend(TIME_SIGNATURE_RECORD.pack(ts.numerator, ts.denominator, ts.beat)
+                  for ts in midi_rep.time_signature_changes)
+    chunks.extend(CHANNEL_RECORD.pack(c, p) for c, p in midi_rep.channel_instrument_map.items())
+    for _, track in track_items:
+        chunks.extend(NOTE_RECORD.pack(n.beat, n.duration, n.channel, n.note, n.velocity) for n in track.notes)
+    return b"".join(chunks)
+
+
+def save_mrep(midi_rep: MidiRepresentation, path: _PathLike, source_mtime_ns: int = 0,
+              source_size: int = -1) -> None:
+    with open(path, "wb") as f:
+        f.write(representation_to_mrep_bytes(midi_rep, source_mtime_ns, source_size))
+
+
+def read_mrep_source_stamp(path: _PathLike) -> tuple[int, int]:
+    """Return the (mtime_ns, size) of the MIDI the cache at ``path`` was made from."""
+    with open(path, "rb") as f:
+        header = f.read(MREP_HEADER.size)
+    _, _, _, mtime_ns, size, *_ = _unpack_header(header)
+    return mtime_ns, size
+
+
+def _unpack_header(buf: Union[bytes, mmap.mmap, memoryview]) -> tuple:
+    if len(buf) < MREP_HEADER.size:
+        raise ValueError("Not a .mrep file: too short")
+    header = MREP_HEADER.unpack_from(buf, 0)
+    if header[0] != MREP_MAGIC:
+        raise ValueError("Not a .mrep file: bad magic")
+    if header[1] != MREP_VERSION:
+        raise ValueError(f"Unsupported .mrep version {header[1]}, expected {MREP_VERSION}")
+    return header
+
+
+def mrep_buffer_to_representation(buf: Union[bytes, mmap.mmap, memoryview]) -> MidiRepresentation:
+    """Deserialize a ``.mrep`` file that is already in memory (or memory mapped)."""
+    (_, _, _, _, _, n_tracks, n_tempo, n_ts, n_channels, n_strings,
+     n_notes) = _unpack_header(buf)
+    pos = MREP_HEADER.size
+    if len(buf) < pos + 4 * (n_strings + 1):
+        raise ValueError("Truncated .mrep file")
+    string_offsets = struct.unpack_from(f"<{n_strings + 1}I", buf, pos)
+    pos += 4 * (n_strings + 1)
+    names = [bytes(buf[pos + string_offsets[i]:pos + string_offsets[i + 1]]).decode("UTF-8")
+             for i in range(n_strings)]
+    pos = _pad8(pos + string_offsets[-1])
+
+    # every table is bounds checked before any of them is unpacked, so nothing
+    # below can fail while the buffer is exported
+    spans: list[tuple[struct.Struct, int, int]] = []
+    for record, count in ((TRACK_RECORD, n_tracks), (TEMPO_RECORD, n_tempo), (TIME_SIGNATURE_RECORD, n_ts),
+                          (CHANNEL_RECORD, n_channels), (NOTE_RECORD, n_notes)):
+        spans.append((record, pos, pos + record.size * count))
+        pos += record.size * count
+    if pos > len(buf):
+        raise ValueError("Truncated .mrep file")
+    with memoryview(buf) as mv:
+        track_rows, tempo_rows, ts_rows, channel_rows, note_rows = [
+            list(record.iter_unpack(mv[b:e])) for record, b, e in spans]
+
+    tracks: dict[int, Track] = {}
+    for track_no, name_idx, first, count in track_rows:
+        tracks[track_no] = Track(
+            notes=[Note(channel=c, note=nt, velocity=v, beat=b, duration=d)
+                   for b, d, c, nt, v in note_rows[first:first + count]],
+            track_name=names[name_idx])
+    return MidiRepresentation(
+        tracks=tracks,
+        channel_instrument_map={c: p for c, p in channel_rows},
+        bpm_changes=[TempoChange(beat=b, new_bpm=bpm) for b, bpm in tempo_rows],
+        time_signature_changes=[TimeSignature(numerator=n, denominator=d, beat=b) for n, d, b in ts_rows]
+    )
+
+
+def load_mrep(path: _PathLike) -> MidiRepresentation:
+    """Load a ``.mrep`` file through a memory map."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("Not a .mrep file: empty")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mrep_buffer_to_representation(mm)
+
+
+def midi_to_mrep(midi_path: _PathLike, mrep_path: _PathLike) -> MidiRepresentation:
+    """Parse a MIDI and save it as a ``.mrep`` file. Return the representation."""
+    stat = os.stat(midi_path)
+    midi_rep = midi_to_representation(mido.MidiFile(midi_path))
+    save_mrep(midi_rep, mrep_path, stat.st_mtime_ns, stat.st_size)
+    return midi_rep
+
+
+def default_mrep_path(midi_path: _PathLike) -> Path:
+    """``song.mid`` is cached in ``song.mid.mrep``"""
+    p = Path(midi_path)
+    return p.with_name(p.name + ".mrep")
+
+
+def load_midi_cached(midi_path: _PathLike) -> MidiRepresentation:
+    """Load a MIDI as a ``MidiRepresentation``, using (and refreshing) the ``.mrep`` cache
+    next to it. The cache is used only if it was made from a MIDI with the same size and
+    mtime."""
+    mrep_path = default_mrep_path(midi_path)
+    stat = os.stat(midi_path)
+    try:
+        if read_mrep_source_stamp(mrep_path) == (stat.st_mtime_ns, stat.st_size):
+            return load_mrep(mrep_path)
+    except (OSError, ValueError):
+        pass
+    return midi_to_mrep(midi_path, mrep_path)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert MIDI files (.mid) into .mrep caches")
+    parser.add_argument("midi", nargs="+", help="MIDI files to convert")
+    args = parser.parse_args()
+    for md in args.midi:
+        midi_to_mrep(md, default_mrep_path(md))
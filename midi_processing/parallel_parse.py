@@ -0,0 +1,142 @@
+"""Parse the tracks of a MIDI file in parallel.
+
+Pairing up note_on and note_off messages only ever looks at one track, so every MTrk chunk
+can be decoded and paired in its own worker process. Workers get the raw bytes of their
+chunk and send back a compact ``TrackParse``; tempo changes, time signatures, track names and
+program changes are then merged in track order, so the result is exactly what
+``midi_to_representation`` gives for the same file.
+
+This only pays off for MIDIs with many large tracks.
+"""
+import io
+import os
+import struct
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional, Union
+
+from mido.midifiles.meta import meta_charset
+from mido.midifiles.midifiles import read_track
+
+from .diagnostics import ParseDiagnostics, PROGRAM_CHANGE
+from .midi_processor import (MidiRepresentation, Track, Note, _track_to_notes, _tempo_changes_from_events,
+                             _time_signatures_from_events)
+
+# (channel, note, velocity, beat, duration)
+NoteTuple = tuple[int, int, int, float, float]
+
+
+@dataclass
+class TrackParse:
+    """Everything ``midi_to_representation`` needs from one track.
+    Times are in ticks since the start of the track."""
+    notes: list[NoteTuple]
+    track_name: Optional[str]
+    program_changes: list[tuple[int, int]]  # (channel, program), in order
+    tempo_events: list[tuple[int, int]]  # (time, tempo)
+    time_signature_events: list[tuple[int, int, int]]  # (time, numerator, denominator)
+    total_ticks: int  # sum of every delta time in this track
+    diagnostics: ParseDiagnostics = field(default_factory=ParseDiagnostics)  # of pairing up the notes
+
+
+def split_midi_chunks(midi_bytes: bytes) -> tuple[int, list[bytes]]:
+    """Return the ticks per beat of a MIDI file, and every MTrk chunk in it (header included)."""
+    if len(midi_bytes) < 14 or midi_bytes[:4] != b"MThd":
+        raise OSError("MThd not found. Probably not a MIDI file")
+    header_size = struct.unpack_from(">L", midi_bytes, 4)[0]
+    _, num_tracks, ticks_per_beat = struct.unpack_from(">hhh", midi_bytes, 8)
+    pos = 8 + header_size
+    chunks: list[bytes] = []
+    for _ in range(num_tracks):
+        if pos + 8 > len(midi_bytes):
+            raise EOFError
+        name, size = struct.unpack_from(">4sL", midi_bytes, pos)
+        if name != b"MTrk":
+            raise OSError("no MTrk header at start of track")
+        chunks.append(midi_bytes[pos:pos + 8 + size])
+        pos += 8 + size
+    return ticks_per_beat, chunks
+
+
+def parse_track_chunk(chunk: bytes, ticks_per_beat: int, charset: str = "latin1") -> TrackParse:
+    """Decode one MTrk chunk. This runs in a worker process."""
+    with meta_charset(charset):
+        track = read_track(io.BytesIO(chunk))
+    track_name: Optional[str] = None
+    program_changes: list[tuple[int, int]] = []
+    tempo_events: list[tuple[int, int]] = []
+    time_signature_events: list[tuple[int, int, int]] = []
+    total_ticks = 0
+    for msg in track:
+        total_ticks += msg.time
+        if msg.type == 'track_name':
+            track_name = msg.name
+        elif msg.type == 'program_change':
+            program_changes.append((msg.channel, msg.program))
+        elif msg.type == 'set_tempo':
+            tempo_events.append((total_ticks, msg.tempo))
+        elif msg.type == 'time_signature':
+            time_signature_events.append((total_ticks, msg.numerator, msg.denominator))
+    diagnostics = ParseDiagnostics()
+    notes = [(n.channel, n.note, n.velocity, n.beat, n.duration)
+             for n in _track_to_notes(track, ticks_per_beat, diagnostics)]
+    return TrackParse(notes=notes, track_name=track_name, program_changes=program_changes,
+                      tempo_events=tempo_events, time_signature_events=time_signature_events,
+                      total_ticks=total_ticks, diagnostics=diagnostics)
+
+
+def merge_track_parses(parses: list[TrackParse], ticks_per_beat: int,
+                       diagnostics: Optional[ParseDiagnostics] = None) -> MidiRepresentation:
+    """Merge per-track results, in track order, into a MidiRepresentation.
+    What every track counted is added up in ``diagnostics``, if given."""
+    if diagnostics is None:
+        diagnostics = ParseDiagnostics()
+    tracks: dict[int, Track] = {}
+    channel_ins_mapping: dict[int, int] = {}
+    tempo_events: list[tuple[int, int]] = []
+    time_signature_events: list[tuple[int, int, int]] = []
+    # midi_to_representation keeps counting time across tracks, so do the same
+    track_start = 0
+    for i, tp in enumerate(parses):
+        for channel, program in tp.program_changes:
+            diagnostics.record(PROGRAM_CHANGE, "track %d: %d -> %d", i, channel, program)
+            channel_ins_mapping[channel] = program
+        diagnostics.merge(tp.diagnostics)
+        tempo_events.extend((track_start + t, tempo) for t, tempo in tp.tempo_events)
+        time_signature_events.extend((track_start + t, n, d) for t, n, d in tp.time_signature_events)
+        track_start += tp.total_ticks
+        tracks[i] = Track(notes=[Note(channel=c, note=nt, velocity=v, beat=b, duration=d)
+                                 for c, nt, v, b, d in tp.notes],
+                          track_name=tp.track_name if tp.track_name is not None else "")
+
+    midi_representation = MidiRepresentation(
+        tracks=tracks,
+        channel_instrument_map=channel_ins_mapping,
+        bpm_changes=_tempo_changes_from_events(tempo_events, ticks_per_beat),
+        time_signature_changes=_time_signatures_from_events(time_signature_events, ticks_per_beat)
+    )
+    midi_representation.clear_empty_tracks()
+    diagnostics.log("Parsed MIDI")
+    return midi_representation
+
+
+def midi_to_representation_parallel(midi: Union[str, "os.PathLike[str]", bytes], workers: Optional[int] = None,
+                                    executor: Optional[Executor] = None,
+                                    diagnostics: Optional[ParseDiagnostics] = None) -> MidiRepresentation:
+    """Same as ``midi_to_representation(mido.MidiFile(midi))``, but every track is parsed in
+    its own worker. ``midi`` is a path or the bytes of a MIDI file.
+
+    Tracks are sent to ``executor`` if one is given, otherwise to a new process pool
+    with ``workers`` processes. Like there, anything odd is counted in ``diagnostics``.
+    """
+    if not isinstance(midi, bytes):
+        with open(midi, "rb") as f:
+            midi = f.read()
+    ticks_per_beat, chunks = split_midi_chunks(midi)
+    tpbs = [ticks_per_beat] * len(chunks)
+    if executor is not None:
+        parses = list(executor.map(parse_track_chunk, chunks, tpbs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parses = list(pool.map(parse_track_chunk, chunks, tpbs))
+    return merge_track_parses(parses, ticks_per_beat, diagnostics)
@@ -0,0 +1,109 @@
+"""Run several MIDI transforms in memory, loading and saving only once.
+
+``process_and_save_midi`` parses a file, applies one function and writes a file, so
+chaining preprocessing steps with it goes through the disk once per step. A
+``MidiPipeline`` instead parses once, runs its stages in order on the same
+representation, only writes the MIDIs asked for with ``save`` and can hand the result
+straight to a converter::
+
+    pipeline = MidiPipeline().then(quantize).then(transpose).save("cleaned.mid")
+    result = pipeline.run("song.mid", sink=lambda rep: midi_conv.process_midi(rep, metadata))
+    chart = result.output
+"""
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Generic, Optional, TypeVar, Union
+
+from .midi_processor import MidiRepresentation, load_midi, representation_to_midi_file
+
+_T = TypeVar("_T")
+_V = TypeVar("_V")
+
+# Changes the representation in place, or returns the one to continue with
+Transform = Callable[[MidiRepresentation], Optional[MidiRepresentation]]
+
+
+@dataclass
+class PipelineStage:
+    """FIELDS:
+
+    - name: str
+    - fn: Transform
+    - saves_to: Optional[str]  # set for stages added with ``MidiPipeline.save``
+    """
+    name: str
+    fn: Transform
+    saves_to: Optional[str] = None
+
+
+@dataclass
+class PipelineResult(Generic[_T]):
+    """FIELDS:
+
+    - midi_rep: MidiRepresentation  # after the last stage
+    - timings_ms: dict[str, float]  # per stage, in the order they ran
+    - saved: list[str]  # MIDIs written by save stages
+    - output: Optional[_T]  # what the sink returned, if there was one
+    """
+    midi_rep: MidiRepresentation
+    timings_ms: dict[str, float]
+    saved: list[str]
+    output: Optional[_T] = None
+
+
+@dataclass
+class MidiPipeline:
+    """An ordered list of named stages. ``then`` and ``save`` return the pipeline so
+    calls can be chained."""
+    stages: list[PipelineStage] = field(default_factory=list)
+
+    def then(self, fn: Transform, name: Optional[str] = None) -> "MidiPipeline":
+        """Add a transform, which works like the ``fn`` of ``process_and_save_midi`` (changing
+        the representation in place) or ``process_and_save_midi_mut`` (returning a new one)."""
+        self.stages.append(PipelineStage(name=name or getattr(fn, "__name__", "transform"), fn=fn))
+        return self
+
+    def save(self, md_opt: Union[str, "os.PathLike[str]"]) -> "MidiPipeline":
+        """Add a stage writing the representation, as it is at that point, to ``md_opt``."""
+        path = os.fspath(md_opt)
+
+        def save_midi(midi_rep: MidiRepresentation) -> None:
+            representation_to_midi_file(midi_rep).save(path)
+
+        self.stages.append(PipelineStage(name=f"save {path}", fn=save_midi, saves_to=path))
+        return self
+
+    def run(self, source: Union[str, "os.PathLike[str]", MidiRepresentation], use_cache: bool = False,
+            sink: Optional[Callable[[MidiRepresentation], _T]] = None) -> PipelineResult[_T]:
+        """Run every stage on ``source``, a MIDI path (loaded with ``load_midi``) or an already
+        loaded representation, which is changed in place. If ``sink`` is given, it gets the
+        final representation, and what it returns ends up in ``output``."""
+        timings_ms: dict[str, float] = {}
+
+        def timed(name: str, fn: Callable[[], _V]) -> _V:
+            # stages with the same name get numbered, so no timing is lost
+            key, n = name, 2
+            while key in timings_ms:
+                key, n = f"{name} #{n}", n + 1
+            t0 = time.perf_counter()
+            rv = fn()
+            timings_ms[key] = (time.perf_counter() - t0) * 1000
+            return rv
+
+        if isinstance(source, MidiRepresentation):
+            midi_rep = source
+        else:
+            midi_rep = timed("load", lambda: load_midi(os.fspath(source), use_cache))
+        saved: list[str] = []
+        for stage in self.stages:
+            rv = timed(stage.name, lambda: stage.fn(midi_rep))
+            if stage.saves_to is not None:
+                saved.append(stage.saves_to)
+                continue
+            if rv is not None:
+                midi_rep = rv
+            midi_rep.invalidate_cache()  # the stage may have moved notes around
+        output = timed("sink", lambda: sink(midi_rep)) if sink is not None else None
+        return PipelineResult(midi_rep=midi_rep, timings_ms=timings_ms, saved=saved, output=output)
+
@@ -0,0 +1,109 @@
+"""Report how far a parse or a conversion got, and stop it early.
+
+Long running functions take an optional ``Progress``. They tell it which stage they are
+in and how many units of it (messages, notes, sections) are done, and it passes that on
+to ``callback`` no more than once every ``interval_s``. Every ``check_every`` units, and
+when a stage starts, ``is_cancelled`` is asked whether to stop, and if so
+``ConversionCancelled`` is raised from inside the function::
+
+    stop = threading.Event()
+    progress = Progress(callback=lambda stage, done, total: print(stage, done, total), is_cancelled=stop.is_set)
+    midi_rep = midi_to_representation(midi_file, progress=progress)
+
+To drop a conversion once its MIDI is saved again, use
+``Progress(is_cancelled=source_changed(path))``.
+
+Without a callback or ``is_cancelled``, a ``Progress`` costs one comparison per unit.
+"""
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Union
+
+# stage, units done, units in the stage (None if not known)
+ProgressCallback = Callable[[str, int, Optional[int]], None]
+
+DEFAULT_INTERVAL_S = 0.1
+DEFAULT_CHECK_EVERY = 1024
+
+# stages reported by the parser and the converter
+PARSE = "parse"
+LISTENERS = "listeners"
+EVENTS = "events"
+SECTIONS = "sections"
+SHARDS = "shards"
+EXPORT = "export"
+
+
+class ConversionCancelled(Exception):
+    """Raised by ``Progress`` once ``is_cancelled`` says so."""
+
+
+@dataclass
+class Progress:
+    """FIELDS:
+
+    - callback: Optional[ProgressCallback]  # gets (stage, done, total)
+    - is_cancelled: Optional[Callable[[], bool]]  # e.g. the is_set of a threading.Event
+    - interval_s: float  # least time between two calls of callback, except at stage starts and ends
+    - check_every: int  # units between two looks at the time and at is_cancelled
+    """
+    callback: Optional[ProgressCallback] = None
+    is_cancelled: Optional[Callable[[], bool]] = None
+    interval_s: float = DEFAULT_INTERVAL_S
+    check_every: int = DEFAULT_CHECK_EVERY
+    stage: str = field(default="", init=False)
+    total: Optional[int] = field(default=None, init=False)
+    _next_check: int = field(default=0, init=False, repr=False)
+    _last_report: float = field(default=0.0, init=False, repr=False)
+
+    def start(self, stage: str, total: Optional[int] = None) -> None:
+        """Begin ``stage``, made of ``total`` units if known."""
+        self.stage = stage
+        self.total = total
+        self._next_check = self.check_every
+        self.check_cancelled()
+        self._report(0)
+
+    def update(self, done: int) -> None:
+        """``done`` units of the current stage are done. Cheap enough to call for every unit."""
+        if done < self._next_check:
+            return
+        self._next_check = done + self.check_every
+        self.check_cancelled()
+        if self.callback is not None and time.monotonic() - self._last_report >= self.interval_s:
+            self._report(done)
+
+    def report(self, done: int) -> None:
+        """Like ``update``, but reporting and looking at ``is_cancelled`` right away.
+        For stages made of a few long units."""
+        self.check_cancelled()
+        self._report(done)
+
+    def finish(self, done: Optional[int] = None) -> None:
+        """The current stage is over, after ``done`` units (``total`` if not given)."""
+        self._report(done if done is not None else self.total or 0)
+
+    def check_cancelled(self) -> None:
+        if self.is_cancelled is not None and self.is_cancelled():
+            raise ConversionCancelled(f"Cancelled during {self.stage or 'start'}")
+
+    def _report(self, done: int) -> None:
+        if self.callback is not None:
+            self._last_report = time.monotonic()
+            self.callback(self.stage, done, self.total)
+
+
+def source_changed(path: Union[str, "os.PathLike[str]"]) -> Callable[[], bool]:
+    """An ``is_cancelled`` that says yes once ``path`` is modified or removed,
+    compared to when this was called."""
+
+    def stamp() -> Optional[tuple[int, int]]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    first = stamp()
+    return lambda: stamp() != first
@@ -0,0 +1,105 @@
+"""Parse only the tracks a conversion actually uses.
+
+Source MIDIs often carry the whole arrangement, while the chart only needs a handful of
+tracks (``en``, ``bf``, ``cam``, ...). ``midi_to_representation_selective`` fully decodes the
+tracks whose names are asked for, and for every other track only walks the raw MTrk bytes
+to pick up the track name, tempo changes, time signatures and program changes, without
+building a single message or note.
+"""
+import os
+from typing import Optional, Union, Iterable
+
+from .diagnostics import ParseDiagnostics
+from .midi_processor import MidiRepresentation
+from .parallel_parse import TrackParse, split_midi_chunks, parse_track_chunk, merge_track_parses
+
+# data bytes after the status byte of channel and system common messages
+_MESSAGE_LENGTHS: dict[int, int] = {
+    0x80: 2, 0x90: 2, 0xa0: 2, 0xb0: 2, 0xc0: 1, 0xd0: 1, 0xe0: 2,
+    0xf1: 1, 0xf2: 2, 0xf3: 1, 0xf6: 0, 0xf8: 0, 0xfa: 0, 0xfb: 0, 0xfc: 0, 0xfe: 0
+}
+
+
+def _read_variable_int(data: bytes, pos: int) -> tuple[int, int]:
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7f)
+        if byte < 0x80:
+            return value, pos
+
+
+def scan_track_chunk(chunk: bytes, charset: str = "latin1") -> TrackParse:
+    """Read everything but the notes of one MTrk chunk (header included),
+    following the same rules as mido."""
+    track_name: Optional[str] = None
+    program_changes: list[tuple[int, int]] = []
+    tempo_events: list[tuple[int, int]] = []
+    time_signature_events: list[tuple[int, int, int]] = []
+    total_ticks = 0
+    last_status: Optional[int] = None
+    pos = 8
+    try:
+        while pos < len(chunk):
+            delta, pos = _read_variable_int(chunk, pos)
+            total_ticks += delta
+            status = chunk[pos]
+            pos += 1
+            if status < 0x80:
+                if last_status is None:
+                    raise OSError('running status without last_status')
+                status = last_status
+                pos -= 1  # that byte was data
+            elif status != 0xff:
+                # meta messages don't set running status
+                last_status = status
+
+            if status == 0xff:
+                meta_type = chunk[pos]
+                length, pos = _read_variable_int(chunk, pos + 1)
+                data = chunk[pos:pos + length]
+                pos += length
+                if meta_type == 0x03:
+                    track_name = data.decode(charset)
+                elif meta_type == 0x51:
+                    tempo_events.append((total_ticks, (data[0] << 16) | (data[1] << 8) | data[2]))
+                elif meta_type == 0x58:
+                    time_signature_events.append((total_ticks, data[0], 2 ** data[1]))
+            elif status in (0xf0, 0xf7):
+                length, pos = _read_variable_int(chunk, pos)
+                pos += length
+            else:
+                kind = status & 0xf0 if status < 0xf0 else status
+                if kind not in _MESSAGE_LENGTHS:
+                    raise OSError(f'undefined status byte 0x{status:02x}')
+                if kind == 0xc0:
+                    program_changes.append((status & 0x0f, chunk[pos]))
+                pos += _MESSAGE_LENGTHS[kind]
+    except IndexError as e:
+        raise EOFError from e
+    return TrackParse(notes=[], track_name=track_name, program_changes=program_changes,
+                      tempo_events=tempo_events, time_signature_events=time_signature_events,
+                      total_ticks=total_ticks)
+
+
+def midi_to_representation_selective(midi: Union[str, "os.PathLike[str]", bytes], track_names: Iterable[str],
+                                     diagnostics: Optional[ParseDiagnostics] = None) -> MidiRepresentation:
+    """Same as ``midi_to_representation(mido.MidiFile(midi))``, except that only tracks named
+    in ``track_names`` have their notes. ``midi`` is a path or the bytes of a MIDI file.
+
+    Tempo changes, time signatures and the channel to instrument map still come from every
+    track. Since the other tracks end up with no notes (so they are dropped), anything that
+    depends on every note, like ``get_song_length``, only sees the kept tracks. Anything odd
+    in the kept tracks is counted in ``diagnostics``, if given.
+    """
+    if not isinstance(midi, bytes):
+        with open(midi, "rb") as f:
+            midi = f.read()
+    wanted = set(track_names)
+    ticks_per_beat, chunks = split_midi_chunks(midi)
+    parses: list[TrackParse] = []
+    for chunk in chunks:
+        scanned = scan_track_chunk(chunk)
+        parses.append(parse_track_chunk(chunk, ticks_per_beat) if scanned.track_name in wanted else scanned)
+    return merge_track_parses(parses, ticks_per_beat, diagnostics)
@@ -0,0 +1,135 @@
+"""Hand ``MidiRepresentation``s to worker processes through ``multiprocessing.shared_memory``
+instead of pickling them.
+
+The representation is written once, in the ``.mrep`` layout (see ``midi_processing.mrep``),
+into a shared memory block. Workers only receive a ``SharedBlock`` (the block's name and
+size), attach to it and build their own ``Note`` objects from the records in it. This
+is not zero-copy: what it saves is pickling the representation once per worker. Only the
+input goes this way: what workers send back (like the sections of a shard) is small next
+to the MIDI and is pickled as usual.
+
+Only processes started by the process that created a block (such as pool workers) should
+attach to it. Whoever ends up with the block unlinks it, usually with ``take_representation``.
+
+Run ``py -m midi_processing.shared_transport`` for a benchmark against pickling.
+"""
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Any, Callable
+
+from .midi_processor import MidiRepresentation
+from .mrep import representation_to_mrep_bytes, mrep_buffer_to_representation
+
+
+@dataclass(frozen=True)
+class SharedBlock:
+    """Descriptor of a shared memory block. Cheap to pickle."""
+    name: str
+    size: int
+
+
+def _create_block(data: bytes) -> SharedBlock:
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    try:
+        shm.buf[:len(data)] = data
+        return SharedBlock(name=shm.name, size=len(data))
+    finally:
+        shm.close()
+
+
+def share_representation(midi_rep: MidiRepresentation) -> SharedBlock:
+    """Copy ``midi_rep`` into a new shared memory block."""
+    return _create_block(representation_to_mrep_bytes(midi_rep))
+
+
+def attach_representation(block: SharedBlock) -> MidiRepresentation:
+    """Read the representation in ``block``, leaving the block alone."""
+    shm = shared_memory.SharedMemory(name=block.name)
+    view = shm.buf[:block.size]
+    try:
+        return mrep_buffer_to_representation(view)
+    finally:
+        view.release()
+        shm.close()
+
+
+def take_representation(block: SharedBlock) -> MidiRepresentation:
+    """Read the representation in ``block``, then free the block."""
+    try:
+        return attach_representation(block)
+    finally:
+        unlink_block(block)
+
+
+def unlink_block(block: SharedBlock) -> None:
+    shm = shared_memory.SharedMemory(name=block.name)
+    shm.close()
+    shm.unlink()
+
+
+def _count_notes_pickled(midi_rep: MidiRepresentation) -> int:
+    return sum(len(t.notes) for t in midi_rep.tracks.values())
+
+
+def _count_notes_shared(block: SharedBlock) -> int:
+    return _count_notes_pickled(attach_representation(block))
+
+
+def _echo_shared(block: SharedBlock) -> SharedBlock:
+    """Read a representation and send it back in a new block, like a worker would."""
+    return share_representation(attach_representation(block))
+
+
+def _benchmark(note_count: int = 100_000, rounds: int = 5) -> None:
+    import pickle
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+    from .midi_processor import Track, Note, TempoChange, TimeSignature
+
+    per_track = note_count // 10
+    midi_rep = MidiRepresentation(
+        tracks={i: Track(notes=[Note(channel=i, note=40 + j % 40, velocity=100, beat=j / 4, duration=0.25)
+                                for j in range(per_track)], track_name=f"track {i}") for i in range(10)},
+        channel_instrument_map={i: i for i in range(10)},
+        bpm_changes=[TempoChange(beat=0, new_bpm=120), TempoChange(beat=64, new_bpm=140)],
+        time_signature_changes=[TimeSignature(numerator=4, denominator=4, beat=0)]
+    )
+
+    def timed(fn: Callable[[], Any]) -> float:
+        best = float("inf")
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - t0)
+        return best * 1000
+
+    print(f"{note_count} notes, best of {rounds}, in ms")
+    print(f"pickle dumps + loads:            {timed(lambda: pickle.loads(pickle.dumps(midi_rep))):9.2f}")
+    print(f"share + attach + unlink:         "
+          f"{timed(lambda: take_representation(share_representation(midi_rep))):9.2f}")
+    print(f"pickled payload bytes:           {len(pickle.dumps(midi_rep)):9d}")
+    print(f"shared block bytes:              {len(representation_to_mrep_bytes(midi_rep)):9d}")
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        pool.submit(int).result()  # start the worker first
+        print(f"to worker, pickled:              "
+              f"{timed(lambda: pool.submit(_count_notes_pickled, midi_rep).result()):9.2f}")
+
+        def shared_to_worker() -> None:
+            block = share_representation(midi_rep)
+            pool.submit(_count_notes_shared, block).result()
+            unlink_block(block)
+
+        print(f"to worker, shared memory:        {timed(shared_to_worker):9.2f}")
+        print(f"round trip, pickled:             "
+              f"{timed(lambda: pool.submit(pickle.loads, pickle.dumps(midi_rep)).result()):9.2f}")
+
+        def shared_round_trip() -> None:
+            block = share_representation(midi_rep)
+            take_representation(pool.submit(_echo_shared, block).result())
+            unlink_block(block)
+
+        print(f"round trip, shared memory:       {timed(shared_round_trip):9.2f}")
+
+
+if __name__ == '__main__':
+    _benchmark()
@@ -0,0 +1,249 @@
+"""Check that the converter still makes exactly the same charts, and is not slower or
+hungrier than it used to be.
+
+Every fixture goes through ``BasicConverter`` the way ``from_midi`` runs it. The chart
+has to match its golden chart byte for byte, and the conversion time and peak memory have
+to stay within a tolerance of the recorded baseline. Fixtures are:
+
+- every ``*.mid`` in ``<fixtures>/midi``, converted with ``<fixtures>/events.json`` and
+  ``<fixtures>/note_types.txt`` if they exist
+- a few synthetic songs, made with ``representation_to_midi_file`` and saved in
+  ``<fixtures>/synthetic`` by ``--update``
+
+Besides the fixtures, ``check_bar_round_trip`` checks that notes edited in the bars of
+``generate_bar_midi_representation`` keep their edits when the bars are joined back.
+
+```
+py regression_harness.py fixtures/ --update   # record golden charts and the baseline
+py regression_harness.py fixtures/            # compare against them
+```
+
+Golden charts go in ``<fixtures>/golden`` and the baseline in ``<fixtures>/perf.json``.
+The exit code is 1 if any fixture fails. The ``fixtures`` folder of this repo holds the
+synthetic songs with their golden charts and baseline, so a plain
+``py regression_harness.py fixtures/`` checks a change.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict, field
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from chart_diff import diff_charts
+from midi_processing import MidiRepresentation, Track, Note, TempoChange, TimeSignature, \
+    representation_to_midi_file_with_conductor, generate_bar_midi_representation
+from run_with_ui import BasicConverter, CustomEventMetadata, load_event_information, load_note_types
+
+DEFAULT_REPEAT = 3
+DEFAULT_TIME_TOLERANCE = 0.25  # fraction of the baseline
+DEFAULT_MEMORY_TOLERANCE = 0.10
+# below these, differences are noise
+TIME_SLACK_S = 0.05
+MEMORY_SLACK_MB = 0.5
+
+SYNTHETIC_EVENTS: list[CustomEventMetadata] = [
+    {"track_name": "drm", "event_name": "Add Camera Zoom", "v1": "0.015", "v2": "0.03"}
+]
+SYNTHETIC_NOTE_TYPES = ["", "GF Sing", "Hurt Note"]
+
+
+@dataclass
+class Fixture:
+    name: str
+    midi_file: Path
+    events: list[CustomEventMetadata]
+    note_types: list[str]
+
+
+@dataclass
+class FixtureResult:
+    name: str
+    seconds: float
+    peak_mb: float
+    baseline_seconds: Optional[float] = None
+    baseline_peak_mb: Optional[float] = None
+    failures: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.failures
+
+
+def synthetic_song(bars: int, seed: int, extra_tracks: int = 0,
+                   tempo_changes: Optional[list[TempoChange]] = None) -> MidiRepresentation:
+    """A random but reproducible song with every track ``BasicConverter`` reads."""
+    rng = random.Random(seed)
+    tracks: dict[int, Track] = {}
+
+    def add(name: str, notes: list[Note]) -> None:
+        tracks[len(tracks) + 1] = Track(notes=notes, track_name=name)
+
+    for name in ("en", "bf"):
+        add(name, [Note(channel=rng.randrange(3), note=60 + rng.randrange(4), velocity=rng.choice([40, 100]),
+                        beat=b / 2, duration=rng.choice([0.25, 0.5, 2]))
+                   for b in range(bars * 8) if rng.random() < 0.6])
+    add("cam", [Note(channel=0, note=60 + i % 2, velocity=100, beat=i * 4.0, duration=1) for i in range(0, bars, 2)])
+    add("gf", [Note(channel=0, note=61, velocity=100, beat=i * 4.0, duration=1) for i in range(0, bars, 8)])
+    add("alt", [Note(channel=0, note=61, velocity=100, beat=i * 4.0, duration=1) for i in range(3, bars, 8)])
+    add("drm", [Note(channel=rng.randrange(4), note=60 + rng.randrange(5), velocity=100, beat=i * 1.0,
+                     duration=0.5) for i in range(bars * 4)])
+    for k in range(extra_tracks):
+        add(f"inst{k}", [Note(channel=k % 16, note=40 + rng.randrange(40), velocity=90, beat=i / 4, duration=0.25)
+                         for i in range(bars * 16)])
+    return MidiRepresentation(
+        tracks=tracks,
+        channel_instrument_map={0: 5, 1: 7},
+        bpm_changes=tempo_changes or [TempoChange(beat=0, new_bpm=150)],
+        time_signature_changes=[TimeSignature(numerator=4, denominator=4, beat=0)]
+    )
+
+
+def save_synthetic_midi(midi_rep: MidiRepresentation, path: Path) -> None:
+    representation_to_midi_file_with_conductor(midi_rep).save(path)
+
+
+SYNTHETIC_SONGS: dict[str, Callable[[], MidiRepresentation]] = {
+    "synthetic-short": lambda: synthetic_song(bars=32, seed=1),
+    "synthetic-tempo-changes": lambda: synthetic_song(bars=64, seed=2, tempo_changes=[
+        TempoChange(beat=0, new_bpm=150), TempoChange(beat=32, new_bpm=180), TempoChange(beat=64, new_bpm=140.5)]),
+    "synthetic-long-arrangement": lambda: synthetic_song(bars=400, seed=3, extra_tracks=10),
+}
+
+
+def check_bar_round_trip() -> list[str]:
+    """Split a synthetic song into bars, change the pitch of every note in them, join them
+    back and compare with the song. Returns what differs."""
+    song = synthetic_song(bars=16, seed=4)
+    bar_rep = generate_bar_midi_representation(song)
+    for bar in bar_rep.bars:
+        for track in bar.tracks.values():
+            for note in track.notes:
+                note.note = 72
+    joined = bar_rep.to_regular_midi_representation()
+
+    def summary(notes: list[Note]) -> list[tuple[float, int, float, int]]:
+        return sorted((round(n.beat, 6), n.note, n.duration, n.channel) for n in notes)
+
+    failures: list[str] = []
+    for i, track in song.tracks.items():
+        expected = summary([n.copy(update={"note": 72}) for n in track.notes])
+        got = summary(joined.tracks[i].notes) if i in joined.tracks else []
+        if got != expected:
+            failures.append(f"bar round trip: track {track.track_name} differs, "
+                            f"first notes {got[:3]} instead of {expected[:3]}")
+    return failures
+
+
+def collect_fixtures(fixtures_dir: Path, update: bool = False) -> list[Fixture]:
+    """Every fixture. With ``update``, the synthetic songs are made again and saved first."""
+    fixtures: list[Fixture] = []
+    synthetic_dir = fixtures_dir / "synthetic"
+    synthetic_dir.mkdir(parents=True, exist_ok=True)
+    for name, make in SYNTHETIC_SONGS.items():
+        path = synthetic_dir / f"{name}.mid"
+        if update or not path.exists():
+            save_synthetic_midi(make(), path)
+        fixtures.append(Fixture(name=name, midi_file=path, events=SYNTHETIC_EVENTS, note_types=SYNTHETIC_NOTE_TYPES))
+    events = load_event_information(fixtures_dir / "events.json")
+    note_types = load_note_types(fixtures_dir / "note_types.txt")
+    for path in sorted((fixtures_dir / "midi").glob("*.mid")):
+        fixtures.append(Fixture(name=path.stem, midi_file=path, events=events, note_types=note_types))
+    return fixtures
+
+
+def convert_fixture(fixture: Fixture) -> str:
+    """The chart ``from_midi`` would write for this fixture."""
+    bc = BasicConverter(midi_file=fixture.midi_file, output_chart=Path(f"{fixture.name}.json"), stage="Stage")
+    bc.resolve_song_name()
+    c_json = bc.convert(bc.read_midi(), fixture.events, fixture.note_types)
+    return json.dumps(c_json)
+
+
+def run_fixture(fixture: Fixture, golden_dir: Path, baseline: dict[str, Any], repeat: int,
+                time_tolerance: float, memory_tolerance: float, update: bool) -> FixtureResult:
+    seconds = float("inf")
+    chart = ""
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        chart = convert_fixture(fixture)
+        seconds = min(seconds, time.perf_counter() - t0)
+    tracemalloc.start()
+    convert_fixture(fixture)
+    peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+
+    result = FixtureResult(name=fixture.name, seconds=seconds, peak_mb=peak_mb)
+    golden = golden_dir / f"{fixture.name}.json"
+    if update:
+        golden.write_text(chart, encoding="UTF-8")
+        return result
+
+    if not golden.exists():
+        result.failures.append("no golden chart, run with --update")
+    elif golden.read_text(encoding="UTF-8") != chart:
+        diff = diff_charts(json.loads(golden.read_text(encoding="UTF-8")), json.loads(chart))
+        result.failures.append("chart differs from golden:\n" + diff.describe(limit=5))
+
+    recorded = baseline.get(fixture.name)
+    if recorded is not None:
+        result.baseline_seconds = recorded["seconds"]
+        result.baseline_peak_mb = recorded["peak_mb"]
+        if seconds > recorded["seconds"] * (1 + time_tolerance) + TIME_SLACK_S:
+            result.failures.append(f"took {seconds:.3f}s, baseline {recorded['seconds']:.3f}s")
+        if peak_mb > recorded["peak_mb"] * (1 + memory_tolerance) + MEMORY_SLACK_MB:
+            result.failures.append(f"peaked at {peak_mb:.2f} MB, baseline {recorded['peak_mb']:.2f} MB")
+    return result
+
+
+def run_harness(fixtures_dir: Path, repeat: int = DEFAULT_REPEAT, time_tolerance: float = DEFAULT_TIME_TOLERANCE,
+                memory_tolerance: float = DEFAULT_MEMORY_TOLERANCE, update: bool = False) -> list[FixtureResult]:
+    """Run every fixture. With ``update``, record golden charts and the baseline instead of checking them."""
+    golden_dir = fixtures_dir / "golden"
+    golden_dir.mkdir(parents=True, exist_ok=True)
+    perf_path = fixtures_dir / "perf.json"
+    baseline: dict[str, Any] = json.loads(perf_path.read_text()) if perf_path.exists() else {}
+    results = [run_fixture(fixture, golden_dir, baseline, repeat, time_tolerance, memory_tolerance, update)
+               for fixture in collect_fixtures(fixtures_dir, update)]
+    if update:
+        perf_path.write_text(json.dumps({r.name: {"seconds": r.seconds, "peak_mb": r.peak_mb} for r in results},
+                                        indent=2))
+    return results
+
+
+def _print_results(results: list[FixtureResult]) -> None:
+    print(f"{'fixture':32} {'seconds':>9} {'baseline':>9} {'peak MB':>9} {'baseline':>9}  status")
+    for r in results:
+        base_s = f"{r.baseline_seconds:9.3f}" if r.baseline_seconds is not None else f"{'-':>9}"
+        base_mb = f"{r.baseline_peak_mb:9.2f}" if r.baseline_peak_mb is not None else f"{'-':>9}"
+        print(f"{r.name:32} {r.seconds:9.3f} {base_s} {r.peak_mb:9.2f} {base_mb}  {'ok' if r.ok else 'FAILED'}")
+    for r in results:
+        for failure in r.failures:
+            print(f"\n{r.name}: {failure}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Golden chart and performance regression checks")
+    parser.add_argument("fixtures", help="Fixture folder (midi/, synthetic/, golden/, perf.json, events.json, "
+                                         "note_types.txt)")
+    parser.add_argument("--update", action="store_true", help="Record golden charts and the performance baseline")
+    parser.add_argument("-r", "--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="Conversions per fixture, the fastest one counts")
+    parser.add_argument("--time_tolerance", type=float, default=DEFAULT_TIME_TOLERANCE,
+                        help="How much slower than the baseline is allowed, as a fraction")
+    parser.add_argument("--memory_tolerance", type=float, default=DEFAULT_MEMORY_TOLERANCE,
+                        help="How much more memory than the baseline is allowed, as a fraction")
+    parser.add_argument("--report", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+    harness_results = run_harness(Path(args.fixtures), repeat=args.repeat, time_tolerance=args.time_tolerance,
+                                  memory_tolerance=args.memory_tolerance, update=args.update)
+    _print_results(harness_results)
+    round_trip_failures = check_bar_round_trip()
+    for round_trip_failure in round_trip_failures:
+        print(f"\n{round_trip_failure}")
+    if args.report:
+        Path(args.report).write_text(json.dumps([asdict(r) for r in harness_results], indent=2))
+    sys.exit(0 if all(r.ok for r in harness_results) and not round_trip_failures else 1)
@@ -1,5 +1,9 @@
+import logging
+import time
 from pathlib import Path
 
+from chart_export import get_exporters
+from chart_output import BuildManifest
 from run_with_ui import BasicConverter
 import argparse
 
@@ -20,7 +24,24 @@ if __name__ == '__main__':
     parser.add_argument("-m", "--song", help="Name of song. If omitted, will be based on output json file name",
                         default="")
     parser.add_argument('-l', '--stage', help="Stage", default="Stage")
+    parser.add_argument("--shards", type=int, help="Convert very long songs in this many parallel parts",
+                        default=1)
+    parser.add_argument("--only_required_tracks", action="store_true",
+                        help="Only parse the notes of tracks the chart uses. Faster for MIDIs with the "
+                             "whole arrangement in them")
+    parser.add_argument("--stream", action="store_true",
+                        help="Write the chart section by section instead of building it all in memory first")
+    parser.add_argument("-f", "--formats", help="Chart formats to write, separated by commas "
+                                              "(psych, vslice). Psych only if omitted", default="")
+    parser.add_argument("--events_json", help="Write the events to this file (events.json, w) instead of into the "
+                                              "chart, for every difficulty to share. Kept if the MIDI and event info "
+                                              "file still hash to what <events_json>.sources recorded", default=None)
+    parser.add_argument("--manifest", help="Record the hashes of the inputs and of the files written in this "
+                                           "manifest (.json, rw), see chart_output", default=None)
+    parser.add_argument("--debug", action="store_true", help="Show debug logs, like what was odd about the MIDI")
     args = parser.parse_args()
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
     bc = BasicConverter(
         midi_file=Path(args.midi),
         output_chart=Path(args.output),
@@ -33,4 +54,12 @@ if __name__ == '__main__':
         song=args.song,
         stage=args.stage
     )
-    bc.from_midi()
+    start = time.perf_counter()
+    written = bc.from_midi(shards=args.shards, only_required_tracks=args.only_required_tracks,
+                           stream=args.stream,
+                           exporters=get_exporters(args.formats.split(",")) if args.formats else None,
+                           events_json=Path(args.events_json) if args.events_json else None)
+    if args.manifest:
+        manifest = BuildManifest.load(Path(args.manifest))
+        manifest.record(bc.output_chart, bc.input_files(), written, time.perf_counter() - start)
+        manifest.save(Path(args.manifest))
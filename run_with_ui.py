@@ -1,18 +1,23 @@
 import json
 import math
 import re
-import sys
-from dataclasses import dataclass, field
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass, field, replace
 from json import JSONDecodeError
 from pathlib import Path
-from typing import Optional, cast, TypedDict, Union
+from typing import Optional, cast, TypedDict, Union, Any
 
 import mido
 
+from chart_export import export_chart, write_chart_files
+from chart_output import StagedFile, WrittenFile, chart_text, file_hash, write_if_changed
 from chart_gen import MidiConv, RegularFNFNoteListener, FNFMetadata, AbstractEventListener, AbstractFNFEvent, \
-    FNFEvent, ExtraData, AbstractFNFNote, FNFNote, get_actual_duration
-from midi_processing import midi_to_representation, Note
-from ui import DataclassUI
+    FNFEvent, ExtraData, AbstractFNFNote, FNFNote, get_actual_duration, AbstractChartExporter, ChartIntermediate, \
+    PsychChartExporter, build_events_json
+from midi_processing import midi_to_representation, Note, MidiRepresentation, midi_to_representation_selective, \
+    MidiPipeline, Progress, ConversionCancelled, PARSE
+from ui import DataclassUI, UITask, TaskCancelled
 
 
 class CustomEventMetadata(TypedDict):
@@ -100,6 +105,12 @@ class CustomEventListener(AbstractEventListener):
         return FNFEvent(time_ms, self.event_metadata["event_name"], value_1, value_2)
 
 
+def events_sources_path(events_json: Path) -> Path:
+    """Where the hashes of the files ``events_json`` was made from are kept: ``<events_json>.sources``,
+    which is not picked up as a chart."""
+    return events_json.with_name(f"{events_json.name}.sources")
+
+
 @dataclass
 class BasicConverter(DataclassUI):
     midi_file: Path = field(
@@ -126,39 +137,126 @@ class BasicConverter(DataclassUI):
     song: str = ""
     stage: str = "stage"
 
-    def from_midi(self) -> None:
+    def from_midi(self, shards: int = 1, only_required_tracks: bool = False,
+                  preprocess: Optional[MidiPipeline] = None, stream: bool = False,
+                  progress: Optional[Progress] = None,
+                  exporters: Optional[list[AbstractChartExporter]] = None,
+                  export_executor: Optional[Executor] = None,
+                  events_json: Optional[Path] = None) -> list[WrittenFile]:
+        """If ``only_required_tracks``, only the tracks the conversion reads have their
+        notes parsed, see ``read_midi``. If ``preprocess`` is given, the parsed MIDI goes
+        through it before being converted, without being written back to disk. If ``stream``,
+        the chart is written section by section (see ``MidiConv.write_chart_streaming``).
+        Every stage is reported to ``progress``, which may cancel the conversion by raising
+        ``ConversionCancelled``. If ``exporters`` are given, the chart is written in each of
+        their formats instead, from one conversion (see ``chart_export``), with the exporters
+        running on ``export_executor`` if given.
+
+        If ``events_json`` is given, the events go to that file instead of into the Psych
+        chart, so every difficulty of the song can share it. If it was made from the MIDI and
+        the event information as they are now (see ``events_json_up_to_date``), it is kept and
+        the events are not made again, unless ``exporters`` need them for another format.
+
+        Files that would get the content they already have are not written again (see
+        ``chart_output``). Return every file written or found unchanged."""
+        if stream and shards > 1:
+            raise ValueError("A chart can't be both streamed and converted in shards")
+        if stream and exporters:
+            raise ValueError("Only the Psych chart can be streamed")
+        evs = load_event_information(self.event_information)
+        note_types = load_note_types(self.note_types)
+
+        self.resolve_song_name()
+
+        midi_conv = self.get_midi_conv(evs, note_types)
+        with_events = events_json is None
+        write_events = events_json is not None and not self.events_json_up_to_date(events_json)
+
+        # the event tracks are read even when the events are kept, as they count towards the song length
+        required_tracks = midi_conv.required_tracks() if only_required_tracks else None
+        midi_representation = self.read_midi(required_tracks, progress)
+        if preprocess is not None:
+            midi_representation = preprocess.run(midi_representation).midi_rep
+        written: list[WrittenFile] = []
+        if exporters:
+            chart = self.build_chart(midi_representation, evs, note_types, shards, progress)
+            if events_json is not None:
+                exporters = [replace(e, embed_events=False) if isinstance(e, PsychChartExporter) else e
+                             for e in exporters]
+                written.append(self.save_events(
+                    build_events_json([ev.export_event_with_time() for ev in chart.events]), events_json))
+            return written + write_chart_files(self.output_chart, export_chart(chart, exporters, export_executor))
+        if write_events:
+            written.append(self.save_events(midi_conv.process_events(midi_representation, progress), events_json))
+        if stream:
+            with StagedFile(self.output_chart) as f:
+                midi_conv.write_chart_streaming(midi_representation, self.get_metadata(), f, progress,
+                                                with_events)
+            return written + [f.result]
+        c_json = self.convert(midi_representation, evs, note_types, shards, progress, with_events)
+        return written + [self.save_chart(c_json)]
+
+    def read_midi(self, track_names: Optional[set[str]] = None,
+                  progress: Optional[Progress] = None) -> MidiRepresentation:
+        """Parse the input MIDI. If ``track_names`` is given, only those tracks get their
+        notes, which is much faster for MIDIs that carry the whole arrangement. The song
+        then only lasts until the last note of those tracks, so there may be fewer empty
+        sections at the end of the chart. That parse only reports when it starts and ends
+        to ``progress``."""
+        if track_names is None:
+            return midi_to_representation(mido.MidiFile(self.midi_file.__str__()), progress=progress)
+        if progress is None:
+            return midi_to_representation_selective(self.midi_file, track_names)
+        progress.start(PARSE)
+        midi_representation = midi_to_representation_selective(self.midi_file, track_names)
+        progress.finish()
+        return midi_representation
+
+    def save_chart(self, c_json: dict[str, Any]) -> WrittenFile:
+        return write_if_changed(self.output_chart, chart_text(c_json))
+
+    def save_events(self, events_data: dict[str, Any], events_json: Path) -> WrittenFile:
+        """Like ``save_chart``. The hashes of the files the events were made from are saved
+        next to them (see ``events_sources_path``), for ``events_json_up_to_date``."""
+        written = write_if_changed(events_json, chart_text(events_data))
+        write_if_changed(events_sources_path(events_json), json.dumps(self.events_sources(), sort_keys=True))
+        return written
+
+    def input_files(self) -> list[Path]:
+        """The files a conversion reads, for ``chart_output.BuildManifest``."""
+        return [p for p in (self.midi_file, self.event_information, self.note_types) if p.is_file()]
+
+    def events_sources(self) -> dict[str, str]:
+        """SHA-256 of the files the events are made from, "" for a missing one."""
+        return {"midi_file": file_hash(self.midi_file) or "",
+                "event_information": file_hash(self.event_information) or ""}
+
+    def events_json_up_to_date(self, events_json: Path) -> bool:
+        """Whether ``events_json`` was made from the MIDI and the event information as they are now."""
+        sources_path = events_sources_path(events_json)
+        if not events_json.is_file() or not sources_path.is_file():
+            return False
+        try:
+            with open(sources_path, "r", encoding="UTF-8") as f:
+                return json.load(f) == self.events_sources()
+        except (OSError, JSONDecodeError):
+            return False
 
-        if self.event_information.is_dir() or (not self.event_information.exists()):
-            print("No events! This is fine, just acting like there are no events.")
-            evs = []
-        else:
-            with open(self.event_information, "r", encoding="UTF-8") as jsf:
-                evs: list[CustomEventMetadata] = json.load(jsf)
-                if not isinstance(evs, list):
-                    raise ValueError(
-                        "Event information must be in a list. "
-                        "Did you forget to wrap it around with [ square brackets ]?")
+    def resolve_song_name(self) -> None:
+        """If no song name was given, name the song after the output chart."""
+        if self.song == "":
+            self.song = self.output_chart.parts[-1].split(".")[0]
+
+    def get_midi_conv(self, evs: list[CustomEventMetadata], note_types: list[str]) -> MidiConv:
+        """The converter ``from_midi`` uses, given already loaded
+        event information and note types."""
         ev_listeners = [
             CustomEventListener(
                 track=sev["track_name"],
                 event_metadata=sev
             ) for sev in evs
         ]
-
-        if self.note_types.is_dir() or (not self.note_types.exists()):
-            print("No note types! This is fine")
-            note_types = []
-        else:
-            with open(self.note_types, "r", encoding="UTF-8") as ntf:
-                note_types_str = ntf.read()
-                note_types = [c.split("//")[0].strip() for c in note_types_str.split("\n")]
-
-        if self.song == "":
-            self.song = self.output_chart.parts[-1].split(".")[0]
-
-        midi_file = mido.MidiFile(self.midi_file.__str__())
-        midi_representation = midi_to_representation(midi_file)
-        midi_conv = MidiConv(
+        return MidiConv(
             note_listeners=[
                 ModifiedFNFNoteListener(
                     track="en",
@@ -174,17 +272,64 @@ class BasicConverter(DataclassUI):
             event_listeners=ev_listeners,
             cam_track="cam"
         )
-        c_json = midi_conv.process_midi(midi_representation,
-                                        FNFMetadata(
-                                            bf=self.bf,
-                                            en=self.en,
-                                            gf=self.gf,
-                                            scroll_speed=self.scroll_speed,
-                                            song=self.song,
-                                            stage=self.stage
-                                        ))
-        with open(self.output_chart.__str__(), "w", encoding="UTF-8") as f:
-            json.dump(c_json, f)
+
+    def get_metadata(self) -> FNFMetadata:
+        return FNFMetadata(
+            bf=self.bf,
+            en=self.en,
+            gf=self.gf,
+            scroll_speed=self.scroll_speed,
+            song=self.song,
+            stage=self.stage
+        )
+
+    def convert(self, midi_representation: MidiRepresentation, evs: list[CustomEventMetadata],
+                note_types: list[str], shards: int = 1, progress: Optional[Progress] = None,
+                with_events: bool = True) -> dict[str, Any]:
+        """Convert an already parsed MIDI into the chart ``from_midi`` would write.
+        If ``shards`` is over 1, the song is split into that many parts converted
+        in parallel (see ``MidiConv.process_midi_sharded``)."""
+        midi_conv = self.get_midi_conv(evs, note_types)
+        if shards > 1:
+            return midi_conv.process_midi_sharded(midi_representation, self.get_metadata(), shards,
+                                                  progress=progress, with_events=with_events)
+        return midi_conv.process_midi(midi_representation, self.get_metadata(), progress, with_events)
+
+    def build_chart(self, midi_representation: MidiRepresentation, evs: list[CustomEventMetadata],
+                    note_types: list[str], shards: int = 1, progress: Optional[Progress] = None) -> ChartIntermediate:
+        """Like ``convert``, but stopping before the chart is made, so it can be exported
+        in any format."""
+        midi_conv = self.get_midi_conv(evs, note_types)
+        if shards > 1:
+            return midi_conv.build_chart_sharded(midi_representation, self.get_metadata(), shards,
+                                                 progress=progress)
+        return midi_conv.build_chart(midi_representation, self.get_metadata(), progress)
+
+
+def load_event_information(event_information: Path) -> list[CustomEventMetadata]:
+    """Load the event configuration JSON, or no events if there
+    is no such file."""
+    if event_information.is_dir() or (not event_information.exists()):
+        print("No events! This is fine, just acting like there are no events.")
+        return []
+    with open(event_information, "r", encoding="UTF-8") as jsf:
+        evs: list[CustomEventMetadata] = json.load(jsf)
+        if not isinstance(evs, list):
+            raise ValueError(
+                "Event information must be in a list. "
+                "Did you forget to wrap it around with [ square brackets ]?")
+    return evs
+
+
+def load_note_types(note_types_path: Path) -> list[str]:
+    """Load the note types file, one note type per channel,
+    or no note types if there is no such file."""
+    if note_types_path.is_dir() or (not note_types_path.exists()):
+        print("No note types! This is fine")
+        return []
+    with open(note_types_path, "r", encoding="UTF-8") as ntf:
+        note_types_str = ntf.read()
+        return [c.split("//")[0].strip() for c in note_types_str.split("\n")]
 
 
 @dataclass
@@ -213,6 +358,47 @@ class ModifiedFNFNoteListener(RegularFNFNoteListener):
             return None
 
 
+# the last MIDI parsed by ``convert_in_ui``, so converting it again with other settings
+# does not parse it again: (path, (mtime_ns, size)) -> representation
+_warm_midi: dict[tuple[str, tuple[int, int]], MidiRepresentation] = {}
+
+
+def _read_midi_warm(bc: BasicConverter, progress: Optional[Progress] = None) -> MidiRepresentation:
+    """``bc.read_midi()``, reusing the last parse while the MIDI file is unchanged.
+    Only the last song is kept. The conversion does not change the representation,
+    so it can be handed out again as is."""
+    stat = bc.midi_file.stat()
+    key = (str(bc.midi_file.resolve()), (stat.st_mtime_ns, stat.st_size))
+    cached = _warm_midi.get(key)
+    if cached is not None:
+        return cached
+    midi_representation = bc.read_midi(progress=progress)
+    _warm_midi.clear()
+    _warm_midi[key] = midi_representation
+    return midi_representation
+
+
+def convert_in_ui(bc: BasicConverter, task: UITask) -> str:
+    """``from_midi``, reporting each stage to ``task`` and stopping as soon as it is
+    cancelled. Meant for ``BasicConverter.run_from_ui``."""
+    progress = Progress(callback=task.report, is_cancelled=lambda: task.cancelled)
+    task.report("Loading events and note types")
+    evs = load_event_information(bc.event_information)
+    note_types = load_note_types(bc.note_types)
+    bc.resolve_song_name()
+    try:
+        midi_representation = _read_midi_warm(bc, progress)
+        c_json = bc.convert(midi_representation, evs, note_types, progress=progress)
+    except ConversionCancelled as e:
+        raise TaskCancelled() from e
+    task.check_cancelled()
+
+    task.report("Writing chart")
+    if not bc.save_chart(c_json).changed:
+        return f"{bc.output_chart} is already up to date ({time.monotonic() - task.started:.1f} s)"
+    return f"Saved {bc.output_chart} in {time.monotonic() - task.started:.1f} s"
+
+
 def _validate_basic_converter(bcc: BasicConverter) -> Optional[str]:
     if bcc.song == "":
         return "You must specify a song"
@@ -245,15 +431,5 @@ def _validate_basic_converter(bcc: BasicConverter) -> Optional[str]:
 
 
 if __name__ == '__main__':
-    bc = cast(BasicConverter,
-              BasicConverter.get_instance_from_ui("FnF MIDI to chart", "Check the readme for more information",
-                                                  custom_check=_validate_basic_converter))
-
-    try:
-        bc.from_midi()
-    except ValueError as e:
-        print(f"{e}", file=sys.stderr)
-        input("Something went wrong, so the error is displayed here. Input to close program")
-    except KeyError as e:
-        print(f"{e}", file=sys.stderr)
-        input("Something went wrong, so the error is displayed here. Input to close program")
+    BasicConverter.run_from_ui(convert_in_ui, "FnF MIDI to chart", "Check the readme for more information",
+                               custom_check=_validate_basic_converter, sbmt="Convert")
@@ -124,10 +124,22 @@ Specifically, here's the structure for the ``metadata`` dictionary:
   that the user will see when the save dialog pops up. This is only
   applicable when `save == True`
 - `title` (str): In the UI, this shows in place of the field name. Can have newlines
+
+## Keeping the form open
+
+``get_instance_from_ui`` closes the window once the form is submitted. If the form should
+rather stay open, so it can be submitted again with other values, use
+``run_from_ui(action, ...)``. Every time the button is pushed, ``action(instance, task)``
+runs on a worker thread while the window shows what it is doing, with a button to cancel
+it. ``task`` is a ``UITask``: call ``task.report("stage", done, total)`` to show progress and
+``task.check_cancelled()`` every now and then, which raises ``TaskCancelled`` once the user
+cancelled. Whatever string ``action`` returns is shown when it finishes.
 """
 
 from dataclasses import dataclass, fields, MISSING, is_dataclass
 from pathlib import Path
+import threading
+import time
 from typing import (Literal, get_type_hints, Callable, Any,
                     get_args, get_origin, Optional, TypedDict, Iterable, TypeVar,
                     Union, Type)
@@ -261,6 +273,174 @@ class FieldMetadata(TypedDict):
 _T = TypeVar("_T", bound="DataclassUI")
 
 
+class TaskCancelled(Exception):
+    """Raised by ``UITask.check_cancelled`` once the user pushed Cancel."""
+
+
+class UITask:
+    """What a ``run_from_ui`` action gets to report progress and notice cancels.
+    Safe to use from the worker thread while the window reads it."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._stage = "Starting"
+        self._done: Optional[int] = None
+        self._total: Optional[int] = None
+        self.started = time.monotonic()
+
+    def report(self, stage: str, done: Optional[int] = None, total: Optional[int] = None) -> None:
+        """Show that ``stage`` is running, ``done`` out of ``total`` units into it if known."""
+        with self._lock:
+            self._stage, self._done, self._total = stage, done, total
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check_cancelled(self) -> None:
+        if self._cancelled.is_set():
+            raise TaskCancelled()
+
+    def status(self) -> str:
+        with self._lock:
+            stage, done, total = self._stage, self._done, self._total
+        if done is not None and total:
+            stage += f" {done}/{total} ({100 * done // total}%)"
+        elif done is not None:
+            stage += f" {done}"
+        return f"{stage} - {time.monotonic() - self.started:.1f} s"
+
+
+def _add_field_widgets(cls: type, root: tk.Tk, frame: tk.Frame, top_offset: int, pdx: int,
+                       pdy: int) -> dict[str, Callable[[], Any]]:
+    """Add an input for every field of dataclass ``cls`` to ``frame``, from row ``top_offset``.
+    Return a getter for the value of every field."""
+    dc_fields = fields(cls)
+    type_hints = get_type_hints(cls)
+    widgets: dict[str, Callable[[], Any]] = {}
+    for i, fld in enumerate(dc_fields):
+        ci = i + top_offset
+        type_of = type_hints[fld.name]
+        default_value = fld.default_factory() if fld.default_factory is not MISSING else fld.default
+        has_default = (fld.default is not MISSING) or (fld.default_factory is not MISSING)
+        # print(default_value, has_default)
+        # print(type_of)
+
+        f_name = (dict(fld.metadata) or {}).get("title", "") or fld.name
+        metadata = MappingProxyType(dict(fld.metadata) or {})
+        label = tk.Label(frame, text=f_name)
+        if type_of == str or type_of == int or type_of == float:
+
+            label.grid(row=ci, column=0, padx=pdx, pady=pdy, sticky='E')
+            if type_of == str:
+                entry = tk.Entry(frame)
+                widgets[fld.name] = lambda e=entry: e.get()
+            elif type_of == int:
+                vcmd_integer = (root.register(lambda P, lb_=label: _validate_integer(P, lb_)), '%P')
+                entry = tk.Entry(frame, validate="key", validatecommand=vcmd_integer)
+                widgets[fld.name] = lambda e=entry: int(e.get())
+            else:
+                vcmd_floating = (root.register(lambda P, lb_=label: _validate_decimal(P, lb_)), '%P')
+                entry = tk.Entry(frame, validate="key", validatecommand=vcmd_floating)
+                widgets[fld.name] = lambda e=entry: float(e.get())
+            entry.grid(row=ci, column=1, pady=pdy)
+            if has_default:
+                entry.delete(0, tk.END)
+                entry.insert(0, default_value)
+        elif type_of == bool:
+            checkbox_var = tk.BooleanVar()
+            if has_default:
+                checkbox_var.set(default_value)
+            label.grid(row=ci, column=0, padx=pdx, pady=pdy, sticky='E')
+            checkbox = tk.Checkbutton(frame, variable=checkbox_var)
+            checkbox.grid(row=ci, column=1)
+            widgets[fld.name] = lambda cbv=checkbox_var: cbv.get()
+        elif get_origin(type_of) is Literal:
+            literal_values = get_args(type_of)
+            literal_values_str = tuple(str(s) for s in literal_values)
+            if len(set(literal_values_str)) != len(literal_values_str):
+                raise ValueError("Literal has duplicates")
+            # print(literal_values)
+
+            label.grid(row=ci, column=0, padx=pdx, pady=pdy, sticky='E')
+            if len(literal_values_str) == 0:
+                raise ValueError("GUI error: Literal has zero options")
+            default_value = literal_values_str[0] if not has_default else default_value
+            sv = tk.StringVar()
+            sv.set(default_value)
+            dropdown = tk.OptionMenu(frame, sv,
+                                     *literal_values)
+            dropdown.grid(row=ci, column=1, padx=pdx, pady=pdy)
+            widgets[fld.name] = (lambda sv_=sv, lv=literal_values, lvs=literal_values_str:
+                                 literal_values[literal_values_str.index(sv_.get())])
+        elif type_of is Path:
+            label.grid(row=ci, column=0, padx=pdx, pady=pdy, sticky='E')
+            current_path = tk.StringVar()
+            current_path.set("") if not has_default else current_path.set(str(default_value))
+            button_text = tk.StringVar()
+            button_text.set("Select File") if not has_default else button_text.set(
+                str(default_value) if str(default_value) != "." else "Select file")
+            # ignore this warning about default values being mutable
+            button = tk.Button(frame, textvariable=button_text,
+                               command=lambda s=current_path,
+                                              ttl=fld.name,
+                                              btt=button_text,
+                                              meta=metadata: [_select_file(s, ttl, meta),
+                                                              btt.set(_get_path_basename(s.get()))])
+            button.grid(row=ci, column=1, padx=10, pady=10)
+            widgets[fld.name] = (lambda sv_=current_path: Path(sv_.get()))
+        elif get_origin(type_of) is list:
+            args_of = get_args(type_of)
+            if len(args_of) >= 2:
+                raise ValueError("list[T, T, ...] is illegal")
+            c_arg = args_of[0] if len(args_of) >= 1 else str
+            # nested list
+            if get_origin(c_arg) is list:
+                raise ValueError("Nested lists are not allowed")
+                # inner_args_of = get_args(c_arg)
+                # if len(inner_args_of) >= 2:
+                #     raise ValueError("list[T, T, ...] is illegal")
+                # c_arg_2 = inner_args_of[0] if len(inner_args_of) >= 1 else str
+            else:
+                if c_arg not in [str, int, float]:
+                    raise ValueError("Lists may only contain str, int, or float")
+
+                label.grid(row=ci, column=0, padx=pdx, pady=pdy, sticky='E')
+                # c_arg is the argument type
+                lb = _EditableListbox(frame)
+                vsb = tk.Scrollbar(frame, command=lb.yview, orient=tk.VERTICAL)
+                lb.configure(yscrollcommand=vsb.set)
+                vsb.grid(row=ci, column=3)
+                lb.grid(row=ci, column=1, padx=10, pady=10)
+                button = tk.Button(frame, text="+", command=lambda b=lb: b.insert("end", 'CLICK TO EDIT'))
+                button.grid(row=ci, column=2, padx=pdx, pady=pdy)
+                widgets[fld.name] = (lambda lb_=lb, ca=c_arg: [ca(s) for s in lb_.get(0, tk.END)])
+                if has_default:
+                    for d in default_value:
+                        lb.insert("end", str(d))
+        else:
+            continue
+    return widgets
+
+
+def _read_form(cls: Type[_T], widgets: dict[str, Callable[[], Any]],
+               custom_check: Optional[Callable[[_T], Optional[str]]]) -> tuple[Optional[_T], str]:
+    """Build the instance the form describes. Return it, or None and the error message
+    to show if the form is not valid."""
+    try:
+        instance = cls(**{k: v() for k, v in widgets.items()})  # type: ignore
+        st = custom_check(instance) if custom_check is not None else None
+    except ValueError:
+        return None, "Some fields are not the right type (for example, a number field that is not a number)"
+    if st is not None:
+        return None, st
+    return instance, ""
+
+
 @dataclass
 class DataclassUI:
     """
@@ -297,11 +477,6 @@ class DataclassUI:
             raise ValueError("This method may only be called in dataclasses.")
         button_pushed = []
         root = tk.Tk()
-        dc_fields = fields(cls)
-        # print(dc_fields)
-        type_hints = get_type_hints(cls)
-        # print(type_hints)
-        widgets: dict[str, Callable[[], Any]] = {}
         root.minsize(300, 300)
         root.title(title)
         # v = tk.Scrollbar(root)
@@ -316,108 +491,7 @@ class DataclassUI:
             top_offset += 1
             label_in = tk.Label(frame, text=desc)
             label_in.grid(row=0, column=0, columnspan=2, padx=pdx, pady=pdy)
-        for i, fld in enumerate(dc_fields):
-            ci = i + top_offset
-            type_of = type_hints[fld.name]
-            default_value = fld.default_factory() if fld.default_factory is not MISSING else fld.default
-            has_default = (fld.default is not MISSING) or (fld.default_factory is not MISSING)
-            # print(default_value, has_default)
-            # print(type_of)
-
-            f_name = (dict(fld.metadata) or {}).get("title", "") or fld.name
-            metadata = MappingProxyType(dict(fld.metadata) or {})
-            label = tk.Label(frame, text=f_name)
-            if type_of == str or type_of == int or type_of == float:
-
-                label.grid(row=ci, column=0, padx=pdx, pady=pdy, sticky='E')
-                if type_of == str:
-                    entry = tk.Entry(frame)
-                    widgets[fld.name] = lambda e=entry: e.get()
-                elif type_of == int:
-                    vcmd_integer = (root.register(lambda P, lb_=label: _validate_integer(P, lb_)), '%P')
-                    entry = tk.Entry(frame, validate="key", validatecommand=vcmd_integer)
-                    widgets[fld.name] = lambda e=entry: int(e.get())
-                else:
-                    vcmd_floating = (root.register(lambda P, lb_=label: _validate_decimal(P, lb_)), '%P')
-                    entry = tk.Entry(frame, validate="key", validatecommand=vcmd_floating)
-                    widgets[fld.name] = lambda e=entry: float(e.get())
-                entry.grid(row=ci, column=1, pady=pdy)
-                if has_default:
-                    entry.delete(0, tk.END)
-                    entry.insert(0, default_value)
-            elif type_of == bool:
-                checkbox_var = tk.BooleanVar()
-                if has_default:
-                    checkbox_var.set(default_value)
-                label.grid(row=ci, column=0, padx=pdx, pady=pdy, sticky='E')
-                checkbox = tk.Checkbutton(frame, variable=checkbox_var)
-                checkbox.grid(row=ci, column=1)
-                widgets[fld.name] = lambda cbv=checkbox_var: cbv.get()
-            elif get_origin(type_of) is Literal:
-                literal_values = get_args(type_of)
-                literal_values_str = tuple(str(s) for s in literal_values)
-                if len(set(literal_values_str)) != len(literal_values_str):
-                    raise ValueError("Literal has duplicates")
-                # print(literal_values)
-
-                label.grid(row=ci, column=0, padx=pdx, pady=pdy, sticky='E')
-                if len(literal_values_str) == 0:
-                    raise ValueError("GUI error: Literal has zero options")
-                default_value = literal_values_str[0] if not has_default else default_value
-                sv = tk.StringVar()
-                sv.set(default_value)
-                dropdown = tk.OptionMenu(frame, sv,
-                                         *literal_values)
-                dropdown.grid(row=ci, column=1, padx=pdx, pady=pdy)
-                widgets[fld.name] = (lambda sv_=sv, lv=literal_values, lvs=literal_values_str:
-                                     literal_values[literal_values_str.index(sv_.get())])
-            elif type_of is Path:
-                label.grid(row=ci, column=0, padx=pdx, pady=pdy, sticky='E')
-                current_path = tk.StringVar()
-                current_path.set("") if not has_default else current_path.set(str(default_value))
-                button_text = tk.StringVar()
-                button_text.set("Select File") if not has_default else button_text.set(
-                    str(default_value) if str(default_value) != "." else "Select file")
-                # ignore this warning about default values being mutable
-                button = tk.Button(frame, textvariable=button_text,
-                                   command=lambda s=current_path,
-                                                  ttl=fld.name,
-                                                  btt=button_text,
-                                                  meta=metadata: [_select_file(s, ttl, meta),
-                                                                  btt.set(_get_path_basename(s.get()))])
-                button.grid(row=ci, column=1, padx=10, pady=10)
-                widgets[fld.name] = (lambda sv_=current_path: Path(sv_.get()))
-            elif get_origin(type_of) is list:
-                args_of = get_args(type_of)
-                if len(args_of) >= 2:
-                    raise ValueError("list[T, T, ...] is illegal")
-                c_arg = args_of[0] if len(args_of) >= 1 else str
-                # nested list
-                if get_origin(c_arg) is list:
-                    raise ValueError("Nested lists are not allowed")
-                    # inner_args_of = get_args(c_arg)
-                    # if len(inner_args_of) >= 2:
-                    #     raise ValueError("list[T, T, ...] is illegal")
-                    # c_arg_2 = inner_args_of[0] if len(inner_args_of) >= 1 else str
-                else:
-                    if c_arg not in [str, int, float]:
-                        raise ValueError("Lists may only contain str, int, or float")
-
-                    label.grid(row=ci, column=0, padx=pdx, pady=pdy, sticky='E')
-                    # c_arg is the argument type
-                    lb = _EditableListbox(frame)
-                    vsb = tk.Scrollbar(frame, command=lb.yview, orient=tk.VERTICAL)
-                    lb.configure(yscrollcommand=vsb.set)
-                    vsb.grid(row=ci, column=3)
-                    lb.grid(row=ci, column=1, padx=10, pady=10)
-                    button = tk.Button(frame, text="+", command=lambda b=lb: b.insert("end", 'CLICK TO EDIT'))
-                    button.grid(row=ci, column=2, padx=pdx, pady=pdy)
-                    widgets[fld.name] = (lambda lb_=lb, ca=c_arg: [ca(s) for s in lb_.get(0, tk.END)])
-                    if has_default:
-                        for d in default_value:
-                            lb.insert("end", str(d))
-            else:
-                continue
+        widgets = _add_field_widgets(cls, root, frame, top_offset, pdx, pdy)
 
         dc_val = []
         err_msg = tk.StringVar()
@@ -427,25 +501,14 @@ class DataclassUI:
 
         def on_exit() -> None:
             dc_val.clear()
-            try:
-                dc_val.append(cls(**{k: v() for k, v in widgets.items()}))  # type: ignore
-                if custom_check is not None:
-                    st = custom_check(dc_val[0])
-                    if st is not None:
-                        err_msg.set(st)
-                        dc_val.clear()
-                        return
-                    else:
-                        exit_state.append(True)
-                        print("exiting")
-                        root.quit()
-                else:
-                    exit_state.append(True)
-                    print("exiting")
-                    root.quit()
-            except ValueError:
-                dc_val.clear()
-                err_msg.set("Some fields are not the right type (for example, a number field that is not a number)")
+            instance, st = _read_form(cls, widgets, custom_check)
+            if instance is None:
+                err_msg.set(st)
+                return
+            dc_val.append(instance)
+            exit_state.append(True)
+            print("exiting")
+            root.quit()
 
         button = tk.Button(frame, text=sbmt, command=on_exit)
         button.grid(row=len(widgets) + top_offset, column=0, padx=pdx, pady=pdy, columnspan=2)
@@ -454,4 +517,89 @@ class DataclassUI:
         root.mainloop()
         if len(dc_val) == 0 or not exit_state:
             raise KeyboardInterrupt("You closed the UI")
-        return dc_val[0]
\ No newline at end of file
+        return dc_val[0]
+
+    @classmethod
+    def run_from_ui(cls: Type[_T], action: Callable[[_T, UITask], Optional[str]], title: str = "Form",
+                    desc: str = "", custom_check: Optional[Callable[[_T], Optional[str]]] = None,
+                    sbmt: str = "Run", poll_ms: int = 100) -> None:
+        """Like ``get_instance_from_ui``, but the window stays open and every push of the button
+        runs ``action`` on the instance in the background (see "Keeping the form open").
+        Returns once the window is closed, which cancels whatever is still running.
+        """
+        if not is_dataclass(cls):
+            raise ValueError("This method may only be called in dataclasses.")
+        root = tk.Tk()
+        root.minsize(300, 300)
+        root.title(title)
+
+        frame = tk.Frame(root)
+        frame.pack(expand=True, side="top", anchor="n")
+        pdx = 1
+        pdy = 1
+        top_offset = 0
+        if desc != "":
+            top_offset += 1
+            label_in = tk.Label(frame, text=desc)
+            label_in.grid(row=0, column=0, columnspan=2, padx=pdx, pady=pdy)
+        widgets = _add_field_widgets(cls, root, frame, top_offset, pdx, pdy)
+
+        status = tk.StringVar()
+        status.set("")
+        running: list[tuple[UITask, threading.Thread]] = []
+        outcome: list[str] = []  # set by the worker thread when it is done
+
+        def work(instance: _T, task: UITask) -> None:
+            try:
+                message = action(instance, task)
+                outcome.append(message or f"Done in {time.monotonic() - task.started:.1f} s")
+            except TaskCancelled:
+                outcome.append("Cancelled")
+            except Exception as e:
+                outcome.append(f"{type(e).__name__}: {e}")
+
+        def poll() -> None:
+            if not running:
+                return
+            task, thread = running[0]
+            if thread.is_alive():
+                status.set(task.status())
+                root.after(poll_ms, poll)
+                return
+            running.clear()
+            status.set(outcome.pop() if outcome else "")
+            run_button.config(state=tk.NORMAL)
+            cancel_button.config(state=tk.DISABLED)
+
+        def on_run() -> None:
+            if running:
+                return
+            instance, st = _read_form(cls, widgets, custom_check)
+            if instance is None:
+                status.set(st)
+                return
+            task = UITask()
+            thread = threading.Thread(target=work, args=(instance, task), daemon=True)
+            running.append((task, thread))
+            run_button.config(state=tk.DISABLED)
+            cancel_button.config(state=tk.NORMAL)
+            thread.start()
+            poll()
+
+        def on_cancel() -> None:
+            if running:
+                running[0][0].cancel()
+                status.set("Cancelling...")
+
+        def on_close() -> None:
+            on_cancel()
+            root.destroy()
+
+        run_button = tk.Button(frame, text=sbmt, command=on_run)
+        run_button.grid(row=len(widgets) + top_offset, column=0, padx=pdx, pady=pdy)
+        cancel_button = tk.Button(frame, text="Cancel", command=on_cancel, state=tk.DISABLED)
+        cancel_button.grid(row=len(widgets) + top_offset, column=1, padx=pdx, pady=pdy)
+        status_label = tk.Label(frame, textvariable=status)
+        status_label.grid(row=len(widgets) + top_offset + 1, column=0, padx=pdx, pady=pdy, columnspan=2)
+        root.protocol("WM_DELETE_WINDOW", on_close)
+        root.mainloop()
\ No newline at end of file